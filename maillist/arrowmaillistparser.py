@@ -0,0 +1,162 @@
+import numpy as np
+from .maillistparser import MailListParser
+from .maillist import MailList
+from .columns import ColumnStore, DictionaryColumn, MappedColumn, TextColumn, code_type
+
+
+class ArrowMailListParser(MailListParser):
+    """
+        Reads Parquet and Arrow IPC (Feather) files. Arrow stores strings the same way TextColumn does, as offsets into
+        one block of UTF-8 bytes, so columns are built from its buffers without converting each value in Python.
+        Dictionary encoded columns become DictionaryColumns and other types are cast to strings by Arrow.
+    """
+    SELECTS_COLUMNS = True
+
+    def __init__(self, file_format, columns=None):
+        # Column names are always read from the file's schema
+        super(ArrowMailListParser, self).__init__(True)
+        # "parquet" or "ipc"
+        self.file_format = file_format
+        # Names of the columns to read, None for every column. Columns that aren't asked for are never read.
+        self.columns = columns
+
+    def readList(self, file_path):
+        # Imported here as pyarrow is only needed for these files
+        import pyarrow as pa
+
+        try:
+            table = self.readTable(file_path)
+        except (OSError, pa.ArrowInvalid, KeyError):
+            return MailList([], [], "")
+
+        file_name = self.nameFromPath(file_path)
+        content = [self.toColumn(table.column(i).combine_chunks()) for i in range(0, table.num_columns)]
+
+        new_list = MailList(table.column_names, ColumnStore(content), file_name)
+        new_list.address_columns = MailListParser.identifyAddressColumns(new_list)
+        return new_list
+
+    def estimateRecords(self, file_path):
+        """
+        Both formats record how many rows they have, so this is exact and no column is read
+        """
+        import pyarrow as pa
+
+        try:
+            if self.file_format == "parquet":
+                import pyarrow.parquet as pq
+                return pq.ParquetFile(file_path).metadata.num_rows
+
+            reader = pa.ipc.open_file(pa.memory_map(file_path, "r"))
+            return sum(reader.get_batch(i).num_rows for i in range(0, reader.num_record_batches))
+        except (OSError, pa.ArrowInvalid):
+            return None
+
+    def readTable(self, file_path):
+        """
+        :return: pyarrow.Table of the columns asked for, and only the first max_rows rows if it is set
+        """
+        import pyarrow as pa
+
+        if self.file_format == "parquet":
+            import pyarrow.parquet as pq
+
+            if self.max_rows is not None:
+                # Only reading as many row groups as needed for the first rows
+                batches = pq.ParquetFile(file_path).iter_batches(batch_size=self.max_rows, columns=self.columns)
+                batch = next(batches, None)
+                return pa.Table.from_batches([batch]) if batch is not None else pa.table({})
+            return pq.read_table(file_path, columns=self.columns, memory_map=True)
+
+        # Arrow IPC files are memory mapped so columns that aren't selected are never read from disk
+        table = pa.ipc.open_file(pa.memory_map(file_path, "r")).read_all()
+        if self.columns is not None:
+            table = table.select(self.columns)
+        if self.max_rows is not None:
+            table = table.slice(0, self.max_rows)
+        return table
+
+    @staticmethod
+    def toColumn(array):
+        """
+        :param array: pyarrow.Array
+        :return: Column using the array's buffers where it can
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        if pa.types.is_dictionary(array.type):
+            categories = ArrowMailListParser.toColumn(array.dictionary).to_numpy()
+            indices = array.indices.to_numpy(zero_copy_only=False)
+            if array.null_count > 0:
+                # Nulls are read as blank strings
+                categories = np.append(categories, "")
+                indices = np.where(array.is_null().to_numpy(zero_copy_only=False), len(categories) - 1, indices)
+            return DictionaryColumn(categories, indices.astype(code_type(len(categories))))
+
+        if not (pa.types.is_string(array.type) or pa.types.is_large_string(array.type)):
+            array = pc.cast(array, pa.large_string())
+        if array.null_count > 0:
+            array = pc.fill_null(array, "")
+
+        _, offsets, data = array.buffers()
+        offset_type = np.int64 if pa.types.is_large_string(array.type) else np.int32
+        offsets = np.frombuffer(offsets, dtype=offset_type)[array.offset:array.offset + len(array) + 1]
+        offsets = offsets.astype(np.int64)
+        data = np.frombuffer(data, dtype=np.uint8) if data is not None else np.zeros(0, dtype=np.uint8)
+
+        # The array may be a slice of its buffers so only keep its own bytes
+        return TextColumn(offsets - offsets[0], data[offsets[0]:offsets[-1]])
+
+    @staticmethod
+    def toArrow(column, dictionary=None):
+        """
+        :param column: Column
+        :param dictionary: pyarrow.Array, the categories of a DictionaryColumn already converted
+        :return: pyarrow.Array
+        """
+        import pyarrow as pa
+
+        if isinstance(column, DictionaryColumn):
+            if dictionary is None:
+                dictionary = pa.array(column.categories, type=pa.large_string())
+            return pa.DictionaryArray.from_arrays(pa.array(column.codes.astype(np.int32)), dictionary)
+
+        if isinstance(column, MappedColumn):
+            column = column.to_text()
+        elif not isinstance(column, TextColumn):
+            column = TextColumn.from_numpy(column.to_numpy())
+
+        return pa.Array.from_buffers(pa.large_string(), len(column),
+                                     [None, pa.py_buffer(column.offsets), pa.py_buffer(column.data)])
+
+    @staticmethod
+    def writeList(file_path, headers, content, chunk_size=100000):
+        """
+        Writes columns to a Parquet file, or an Arrow IPC file if the path doesn't end with .parquet. Rows are written a
+        chunk at a time so only one chunk is ever copied out of the columns.
+        :param file_path: string
+        :param headers: string[]
+        :param content: ColumnStore
+        :param chunk_size: int, the number of rows in each row group or record batch
+        """
+        import pyarrow as pa
+
+        dictionaries = [pa.array(column.categories, type=pa.large_string())
+                        if isinstance(column, DictionaryColumn) else None for column in content]
+        schema = pa.schema([(str(header), pa.dictionary(pa.int32(), pa.large_string()) if dictionary is not None
+                             else pa.large_string()) for header, dictionary in zip(headers, dictionaries)])
+
+        if file_path.lower().endswith(".parquet"):
+            import pyarrow.parquet as pq
+            writer = pq.ParquetWriter(file_path, schema)
+        else:
+            writer = pa.ipc.new_file(file_path, schema)
+
+        with writer:
+            for start in range(0, content.num_records, chunk_size):
+                rows = np.arange(start, min(start + chunk_size, content.num_records))
+                # Every chunk of a column shares its dictionary as IPC files can't change one part way through
+                arrays = [ArrowMailListParser.toArrow(column[rows], dictionary)
+                          for column, dictionary in zip(content, dictionaries)]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
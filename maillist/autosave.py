@@ -0,0 +1,115 @@
+import threading
+import time
+
+
+class AutoSaver:
+    """
+        Saves a workspace on its own thread so the window isn't held up while it's written. Each request takes a
+        snapshot of the workspace straight away, on the thread that changed it, so a save never sees a list part way
+        through being changed. Requests made within delay seconds of each other are saved together, only the newest
+        snapshot is written.
+    """
+
+    def __init__(self, workspace, delay=1.0, on_status=None):
+        """
+        :param workspace: Workspace
+        :param delay: float, seconds to wait for more changes before saving
+        :param on_status: function(string), told what the saver is doing. Called from the saver's thread.
+        """
+        self.workspace = workspace
+        self.delay = delay
+        self.on_status = on_status
+        self.condition = threading.Condition()
+        # Snapshot waiting to be saved and when it was taken
+        self.pending = None
+        self.requested_at = 0.0
+        self.saving = False
+        # Set by flush so the pending snapshot is saved without waiting out the delay
+        self.hurry = False
+        self.stopped = False
+        # Error of the last save, None if it succeeded
+        self.error = None
+
+        self.thread = threading.Thread(target=self.run, name="autosave", daemon=True)
+        self.thread.start()
+
+    def request(self):
+        """
+        Asks for the workspace to be saved as it is now
+        """
+        snapshot = self.workspace.snapshot()
+        with self.condition:
+            if self.stopped:
+                raise RuntimeError("The autosaver has been stopped")
+            # A snapshot that hasn't been saved yet is replaced, it's older than this one
+            self.pending = snapshot
+            self.requested_at = time.monotonic()
+            self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Saves anything pending straight away and waits for it to be written
+        :param timeout: float, most seconds to wait, None to wait as long as it takes
+        :return: bool
+            False if the save was still going when the timeout ran out
+        """
+        with self.condition:
+            self.hurry = True
+            self.condition.notify_all()
+            saved = self.condition.wait_for(lambda: self.pending is None and not self.saving, timeout)
+            if self.pending is None:
+                # Later requests wait out the delay again
+                self.hurry = False
+            return saved
+
+    def stop(self):
+        """
+        Saves anything pending and ends the thread
+        """
+        self.flush()
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending is not None or self.stopped)
+                if self.pending is None:
+                    return
+
+                # Waiting until there have been no changes for delay seconds
+                while not self.hurry and not self.stopped:
+                    remaining = self.requested_at + self.delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+                snapshot, self.pending = self.pending, None
+                self.hurry = False
+                self.saving = True
+
+            self.save(snapshot)
+
+            with self.condition:
+                self.saving = False
+                self.condition.notify_all()
+
+    def save(self, snapshot):
+        self.report("Saving workspace...")
+        start = time.monotonic()
+        try:
+            snapshot.saveWorkspace()
+        except Exception as e:
+            # The next change tries again, there is nothing else that can be done from here
+            self.error = str(e) or type(e).__name__
+            self.report("Workspace could not be saved: " + self.error)
+            return
+
+        self.error = None
+        self.report("Workspace saved in {:.2f}s".format(time.monotonic() - start))
+
+    def report(self, message):
+        if self.on_status is not None:
+            self.on_status(message)
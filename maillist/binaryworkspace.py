@@ -0,0 +1,433 @@
+import json
+import os
+import struct
+import tempfile
+import threading
+import zlib
+import numpy as np
+from .workspace import Workspace
+from .xmlworkspace import XMLWorkspace
+from .maillist import MailList
+from .sort import SortResult
+from .columns import ColumnStore, LazyColumn, column_arrays, column_from_arrays
+from printpost.readprintpost import ReadPrintPost
+
+# The start of a binary workspace file has two of these headers, each with the magic bytes, format version, a sequence
+# number and where the manifest is, its length and its checksum. Saves write the header that isn't current so a crash
+# part way through writing one leaves the other to open from.
+HEADER = struct.Struct("<4sIQQQI")
+MAGIC = b"MSWB"
+FORMAT_VERSION = 2
+EXTENSION = ".msb"
+
+
+class SavedFile:
+    """
+        What is in a binary workspace file, so the next save only writes what changed. A workspace shares this with its
+        snapshots, see Workspace.snapshot, so it stays up to date whichever of them saves. Columns and code arrays are
+        never changed once made so one that is the same object as one that was saved doesn't need writing again.
+    """
+
+    def __init__(self, path=None, manifest=None, columns=None, sequence=0):
+        self.path = path
+        self.manifest = manifest
+        # dict of the id of each saved column or array to (object, blocks). The objects are kept so their ids can't be
+        # reused.
+        self.columns = {} if columns is None else columns
+        # Sequence number of the header that is current
+        self.sequence = sequence
+        self.lock = threading.RLock()
+
+
+class BinaryWorkspace(Workspace):
+    """
+        Saves a workspace as one file of binary blocks, one for each array of each column of each list, followed by a
+        JSON manifest of the lists and where their blocks are. Opening a workspace only reads the manifest, each column
+        is read the first time it's used. Every block has a checksum so a damaged file is found rather than read.
+        Saves only append the blocks of columns that aren't in the file yet and a new manifest, and the file is only
+        rewritten once most of it is no longer used. A workspace saved as XML (.msw) can be opened to convert it, and
+        is then saved in this format beside it. To keep saving a workspace as XML, open it with XMLWorkspace, as the
+        app does.
+        What has been worked out from each list, its sort codes, bad states and postcode histogram, is saved with its
+        fingerprint and the version of the sort plan, as is the last sort. They are taken back when the workspace is
+        opened with the same sort plan so they aren't worked out again.
+    """
+    # The file is rewritten when it is more than this many times the size of the blocks still in use
+    COMPACT_RATIO = 2
+    # Files smaller than this are never rewritten only to make them smaller
+    COMPACT_MIN_BYTES = 1 << 20
+
+    def __init__(self, compress=True):
+        super(BinaryWorkspace, self).__init__()
+        # Whether blocks are compressed with zlib. Compressing is quick at the lowest level and mail lists shrink well.
+        self.compress = compress
+        self.saved = SavedFile()
+
+    def saveWorkspace(self):
+        """
+        Saves the lists that changed since the workspace was last saved or opened. Nothing is written if nothing
+        changed.
+        :return: bool
+            True once the workspace is saved
+        """
+        if self.path == "":
+            raise ValueError("Workspace is trying to be saved with an unset path")
+
+        file_path = self.path + self.name + EXTENSION
+        # A snapshot being saved by the autosaver shares the file with this workspace so only one saves at a time
+        with self.saved.lock:
+            if file_path != self.saved.path or not os.path.exists(file_path):
+                self.writeWorkspace(file_path)
+                return True
+
+            if not self.isDirty():
+                return True
+
+            with open(file_path, "r+b") as file:
+                # Blocks and the manifest are appended after what the current manifest uses. Until the header is
+                # written the file still opens as it was.
+                file.seek(0, os.SEEK_END)
+                saved_columns = dict(self.saved.columns)
+                manifest = self.buildManifest(file, saved_columns)
+                self.writeManifest(file, manifest, self.saved.sequence + 1)
+                file_size = file.seek(0, os.SEEK_END)
+
+            self.saved.sequence += 1
+            self.saved.manifest = manifest
+            self.saved.columns = self.usedColumns(saved_columns)
+
+            if file_size > max(self.COMPACT_RATIO * self.usedBytes(), self.COMPACT_MIN_BYTES):
+                self.writeWorkspace(file_path)
+        return True
+
+    def isDirty(self):
+        """
+        :return: bool
+            True if anything has changed since the workspace was last saved or opened
+        """
+        if self.saved.manifest is None or len(self.saved.manifest["lists"]) != len(self.lists):
+            return True
+        if any(id(item) not in self.saved.columns for item in self.blockObjects()):
+            return True
+
+        # Every block is saved so only the names, headers, address fields or bad states can have changed
+        return self.buildManifest(None, self.saved.columns) != self.saved.manifest
+
+    def writeWorkspace(self, file_path):
+        """
+        Writes every list to a new file that replaces file_path in one step, so a failed save never leaves a half
+        written workspace. Every column is read from the old file while writing, before it is replaced.
+        """
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)), suffix=".tmp")
+        saved_columns = {}
+        try:
+            with os.fdopen(handle, "wb") as file:
+                file.write(b"\0" * 2 * HEADER.size)
+                manifest = self.buildManifest(file, saved_columns)
+                self.writeManifest(file, manifest, 1)
+            os.replace(temp_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self.saved.path = file_path
+        self.saved.manifest = manifest
+        self.saved.columns = saved_columns
+        self.saved.sequence = 1
+
+    def buildManifest(self, file, saved_columns):
+        """
+        :param file: binary file object that the blocks of columns not in saved_columns are appended to, None if
+            every block is already saved
+        :param saved_columns: dict of id to (object, blocks), added to as blocks are written
+        :return: dict, the manifest of the workspace
+        """
+        lists = []
+        for mail_list in self.lists:
+            columns = [self.savedBlocks(file, saved_columns, column, lambda column=column: column_arrays(column))
+                       for column in mail_list.content]
+
+            entry = {"name": mail_list.name, "records": int(mail_list.num_records),
+                     "headers": [str(header) for header in mail_list.headers],
+                     "address_columns": [int(i) for i in mail_list.address_columns], "columns": columns}
+            if self.hasDerived(mail_list):
+                entry["derived"] = self.derivedEntry(file, saved_columns, mail_list)
+            lists.append(entry)
+
+        manifest = {"name": self.name, "lists": lists}
+        if self.sort_result is not None:
+            order = self.sort_result.order
+            manifest["sort_result"] = {"fingerprint": self.sort_result.fingerprint,
+                                       "categories": self.sort_result.categories,
+                                       "order": self.savedBlocks(file, saved_columns, order, lambda: {"data": order})}
+        return manifest
+
+    def savedBlocks(self, file, saved_columns, item, arrays):
+        """
+        :param item: Column or np.ndarray that the blocks are of
+        :param arrays: function() -> dict of string to np.ndarray, what to write if item isn't saved yet
+        :return: dict of string to block, the blocks item is saved in
+        """
+        if id(item) not in saved_columns:
+            saved_columns[id(item)] = (item, {name: self.writeBlock(file, array) for name, array in arrays().items()})
+        return saved_columns[id(item)][1]
+
+    @staticmethod
+    def hasDerived(mail_list):
+        # Everything that is worked out for a list starts from the sort codes of its postcodes
+        return mail_list.sort_codes is not None and mail_list.address_columns[-1] != -1
+
+    def derivedEntry(self, file, saved_columns, mail_list):
+        """
+        :return: dict, the manifest entry of what has been worked out from the list
+        """
+        histogram = mail_list.postcode_histogram()
+        return {"fingerprint": mail_list.fingerprint(), "plan_version": ReadPrintPost.get_instance().version,
+                "sort_codes": self.savedBlocks(file, saved_columns, mail_list.sort_codes,
+                                               lambda: {"data": mail_list.sort_codes})["data"],
+                "state_codes": self.savedBlocks(file, saved_columns, mail_list.state_codes,
+                                                lambda: {"data": mail_list.state_codes})["data"],
+                "histogram": self.savedBlocks(file, saved_columns, histogram,
+                                              lambda: {"pairs": histogram[0], "counts": histogram[1]}),
+                "incorrect_states": mail_list.incorrect_states}
+
+    def blockObjects(self):
+        """
+        :return: list of every column and array of the workspace that is saved in blocks
+        """
+        items = []
+        for mail_list in self.lists:
+            items.extend(mail_list.content)
+            if self.hasDerived(mail_list):
+                items.extend([mail_list.sort_codes, mail_list.state_codes, mail_list.postcode_histogram()])
+        if self.sort_result is not None:
+            items.append(self.sort_result.order)
+        return items
+
+    def usedColumns(self, saved_columns):
+        """
+        :return: dict, the saved columns and arrays still used. Ones that are let go of aren't kept alive.
+        """
+        used = {id(item) for item in self.blockObjects()}
+        return {key: value for key, value in saved_columns.items() if key in used}
+
+    def usedBytes(self):
+        """
+        :return: int, the size of the blocks the current manifest uses
+        """
+        return sum(block["length"] for block in self.manifestBlocks(self.saved.manifest))
+
+    @staticmethod
+    def manifestBlocks(manifest):
+        """
+        :return: list of every block in the manifest
+        """
+        blocks = []
+        for entry in manifest["lists"]:
+            for column in entry["columns"]:
+                blocks.extend(column.values())
+            if "derived" in entry:
+                derived = entry["derived"]
+                blocks.extend([derived["sort_codes"], derived["state_codes"], *derived["histogram"].values()])
+        if "sort_result" in manifest:
+            blocks.extend(manifest["sort_result"]["order"].values())
+        return blocks
+
+    def writeBlock(self, file, array):
+        """
+        :param file: binary file object
+        :param array: np.ndarray
+        :return: dict, where the block is and how to read it back
+        """
+        if array.dtype.hasobject:
+            # Only the values can be saved, not Python objects
+            array = array.astype(str)
+        array = np.ascontiguousarray(array)
+        data = array.tobytes()
+        compression = None
+        if self.compress and len(data) > 0:
+            compressed = zlib.compress(data, 1)
+            # Blocks that don't get smaller, e.g. already random codes, are kept as they are
+            if len(compressed) < len(data):
+                data, compression = compressed, "zlib"
+
+        offset = file.tell()
+        file.write(data)
+        return {"offset": offset, "length": len(data), "dtype": array.dtype.str, "shape": list(array.shape),
+                "compression": compression, "checksum": zlib.crc32(data)}
+
+    @staticmethod
+    def writeManifest(file, manifest, sequence):
+        """
+        Writes the manifest after the blocks and points a header at it. Everything else is on disk before the header
+        is written so the header never points at something that isn't there.
+        """
+        data = json.dumps(manifest).encode("utf-8")
+        offset = file.tell()
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+        # Headers take turns so the one that is current isn't written over
+        file.seek((sequence % 2) * HEADER.size)
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, sequence, offset, len(data), zlib.crc32(data)))
+        file.flush()
+        os.fsync(file.fileno())
+
+    def createWorkspace(self, file_path):
+        self.setPath(file_path)
+        self.lists = []
+        self.saveWorkspace()
+
+    def openWorkspace(self, file_path):
+        """
+        Reads the manifest of a workspace file. The lists' columns are read when they are first used.
+        :param file_path: string
+                          The absolute file path of the workspace file, either format
+        :return: bool
+                 status of the workspace file being successfully read
+        """
+        try:
+            sequence, manifest = self.readManifest(file_path)
+        except OSError:
+            return False
+
+        if manifest is None:
+            return self.openXMLWorkspace(file_path)
+
+        saved_columns = {}
+        try:
+            mail_lists = [self.readList(file_path, entry, saved_columns) for entry in manifest["lists"]]
+            sort_result = self.readSortResult(file_path, manifest.get("sort_result"), saved_columns)
+        except (KeyError, TypeError, ValueError):
+            return False
+
+        self.lists = mail_lists
+        self.sort_result = sort_result
+        self.setPath(file_path)
+        self.saved = SavedFile(file_path, manifest, saved_columns, sequence)
+        return True
+
+    @staticmethod
+    def readManifest(file_path):
+        """
+        :return: (int, dict)
+            The sequence number and manifest of a binary workspace, (0, None) if the file is in the old XML format
+        :raises OSError
+            If the file can't be read or is damaged
+        """
+        with open(file_path, "rb") as file:
+            headers = file.read(2 * HEADER.size)
+            if MAGIC not in [headers[:len(MAGIC)], headers[HEADER.size:HEADER.size + len(MAGIC)]]:
+                return 0, None
+
+            newest = (0, None)
+            for start in [0, HEADER.size]:
+                header = headers[start:start + HEADER.size]
+                if len(header) < HEADER.size:
+                    continue
+                magic, version, sequence, offset, length, checksum = HEADER.unpack(header)
+                if magic != MAGIC or sequence <= newest[0]:
+                    # Never written, or older than the other header
+                    continue
+                if version > FORMAT_VERSION:
+                    raise OSError("The workspace was saved by a newer version of Mail Sort")
+
+                file.seek(offset)
+                data = file.read(length)
+                # A header that was being written when a save stopped points at nothing valid, so the other is used
+                if len(data) != length or zlib.crc32(data) != checksum:
+                    continue
+                try:
+                    newest = (sequence, json.loads(data.decode("utf-8")))
+                except ValueError:
+                    continue
+
+        if newest[1] is None:
+            raise OSError("The workspace's manifest is damaged")
+        return newest
+
+    @staticmethod
+    def readList(file_path, entry, saved_columns):
+        """
+        :param file_path: string
+        :param entry: dict, the list's entry in the manifest
+        :param saved_columns: dict that the list's saved columns and arrays are added to
+        :return: MailList with columns that are read from file_path when first used
+        """
+        num_records = int(entry["records"])
+
+        def loader(blocks):
+            return lambda: column_from_arrays({name: BinaryWorkspace.readBlock(file_path, block)
+                                               for name, block in blocks.items()})
+
+        content = ColumnStore([LazyColumn(num_records, loader(blocks)) for blocks in entry["columns"]])
+        mail_list = MailList(np.array(entry["headers"], dtype=np.dtype('U100')), content, entry["name"])
+        # Lists without columns still have their number of records
+        mail_list.num_records = num_records
+        mail_list.address_columns = np.array(entry["address_columns"])
+        saved_columns.update({id(column): (column, blocks) for column, blocks in zip(content, entry["columns"])})
+
+        derived = entry.get("derived")
+        # Anything worked out with another sort plan is worked out again
+        if derived is not None and derived["plan_version"] == ReadPrintPost.get_instance().version:
+            sort_codes = BinaryWorkspace.readBlock(file_path, derived["sort_codes"])
+            state_codes = BinaryWorkspace.readBlock(file_path, derived["state_codes"])
+            histogram = (BinaryWorkspace.readBlock(file_path, derived["histogram"]["pairs"]),
+                         BinaryWorkspace.readBlock(file_path, derived["histogram"]["counts"]))
+            incorrect_states = derived["incorrect_states"]
+            mail_list.restore_derived(derived["fingerprint"], sort_codes, state_codes, histogram, incorrect_states)
+
+            saved_columns[id(sort_codes)] = (sort_codes, {"data": derived["sort_codes"]})
+            saved_columns[id(state_codes)] = (state_codes, {"data": derived["state_codes"]})
+            saved_columns[id(histogram)] = (histogram, derived["histogram"])
+        return mail_list
+
+    @staticmethod
+    def readSortResult(file_path, entry, saved_columns):
+        """
+        :param entry: dict, the sort result's entry in the manifest or None if there isn't one
+        :return: SortResult or None
+        """
+        if entry is None:
+            return None
+
+        order = BinaryWorkspace.readBlock(file_path, entry["order"]["data"])
+        saved_columns[id(order)] = (order, entry["order"])
+        # Whether it still applies is known from its fingerprint once the lists are sorted
+        return SortResult(entry["fingerprint"], entry["categories"], order)
+
+    @staticmethod
+    def readBlock(file_path, block):
+        """
+        :return: np.ndarray read from the block
+        :raises ValueError
+            If the block's checksum doesn't match, i.e. the file has been damaged
+        """
+        with open(file_path, "rb") as file:
+            file.seek(block["offset"])
+            data = file.read(block["length"])
+
+        if len(data) != block["length"] or zlib.crc32(data) != block["checksum"]:
+            raise ValueError("A list in the workspace " + file_path + " is damaged")
+        if block["compression"] == "zlib":
+            data = zlib.decompress(data)
+
+        return np.frombuffer(data, dtype=np.dtype(block["dtype"])).reshape(block["shape"])
+
+    def openXMLWorkspace(self, file_path):
+        """
+        Opens a workspace saved in the XML format to convert it. This workspace saves it in the binary format beside
+        the XML file, which is left as it is. XMLWorkspace opens it to keep saving it as XML.
+        """
+        workspace = XMLWorkspace()
+        if not workspace.openWorkspace(file_path):
+            return False
+
+        self.lists = workspace.lists
+        self.setPath(file_path)
+        return True
+
+    def getName(self):
+        return self.name
@@ -0,0 +1,686 @@
+import threading
+from abc import ABC, abstractmethod
+import numpy as np
+
+
+class Column(ABC):
+    """
+        A column of strings in a MailList. Columns are never changed once they are built, operations that would change
+        a column return a new one instead.
+        Indexing with an int returns the string at that row. Indexing with a slice or an array of indices/booleans
+        returns a new column with those rows.
+    """
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+    @abstractmethod
+    def value(self, i: int) -> str:
+        pass
+
+    @abstractmethod
+    def take(self, indices) -> 'Column':
+        """
+        :param indices: np.ndarray of int
+        :return: Column
+            A column with the rows at the given indices in that order
+        """
+        pass
+
+    @abstractmethod
+    def to_numpy(self) -> np.ndarray:
+        """
+        :return: np.ndarray
+            Every value in the column as a unicode numpy array
+        """
+        pass
+
+    @abstractmethod
+    def transform(self, function) -> np.ndarray:
+        """
+        Applies a vectorised function that takes and returns numpy arrays to every value in the column. Dictionary
+        encoded columns only apply it to each distinct value.
+        :param function: function(np.ndarray) -> np.ndarray
+        :return: np.ndarray
+            The result of the function for every row
+        """
+        pass
+
+    @abstractmethod
+    def non_empty(self) -> np.ndarray:
+        """
+        :return: np.ndarray of bool
+            True for each row that is not a blank string
+        """
+        pass
+
+    @property
+    @abstractmethod
+    def nbytes(self):
+        pass
+
+    def gather(self, indices) -> np.ndarray:
+        """
+        :param indices: np.ndarray of int
+        :return: np.ndarray
+            The decoded values at the given indices
+        """
+        return self.take(indices).to_numpy()
+
+    def fixed_width_digits(self, width) -> np.ndarray:
+        """
+        Reads values that are exactly width digits as integers, e.g. postcodes. Leading zeros are allowed.
+        :param width: int, at most 9
+        :return: np.ndarray of int32
+            The value of each row or -1 where it is not exactly width digits
+        """
+        return TextColumn.from_numpy(self.to_numpy()).fixed_width_digits(width)
+
+    def compact(self) -> 'Column':
+        """
+        :return: Column
+            A column holding its own copy of the values. Columns that only refer to values stored elsewhere, such as
+            a mapped file, copy them, other columns return themselves.
+        """
+        return self
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            if key < 0 or key >= len(self):
+                raise IndexError("Column index out of range")
+            return self.value(key)
+
+        if isinstance(key, slice):
+            return self.take(np.arange(len(self))[key])
+
+        key = np.asarray(key)
+        if key.dtype == bool:
+            key = np.nonzero(key)[0]
+        return self.take(key)
+
+    def __iter__(self):
+        # Decoding in one go is much faster than decoding each value separately
+        return iter(self.to_numpy().tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.to_numpy()
+        return values if dtype is None else values.astype(dtype)
+
+    def tolist(self):
+        return self.to_numpy().tolist()
+
+
+class DictionaryColumn(Column):
+    """
+        Stores each distinct value once in categories, and each row as the index of its value. Used for columns with
+        few distinct values such as states, suburbs and postcodes.
+    """
+
+    def __init__(self, categories, codes):
+        self.categories = np.asarray(categories)
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def value(self, i: int) -> str:
+        return str(self.categories[self.codes[i]])
+
+    def take(self, indices) -> 'DictionaryColumn':
+        return DictionaryColumn(self.categories, self.codes[indices])
+
+    def to_numpy(self) -> np.ndarray:
+        return self.categories[self.codes]
+
+    def transform(self, function) -> np.ndarray:
+        return np.asarray(function(self.categories))[self.codes]
+
+    def non_empty(self) -> np.ndarray:
+        return (self.categories != "")[self.codes]
+
+    def fixed_width_digits(self, width) -> np.ndarray:
+        return TextColumn.from_numpy(self.categories).fixed_width_digits(width)[self.codes]
+
+    @property
+    def nbytes(self):
+        return self.categories.nbytes + self.codes.nbytes
+
+
+class TextColumn(Column):
+    """
+        Stores free text as every value encoded with UTF-8 one after the other in data. Row i is the bytes from
+        offsets[i] to offsets[i+1]. Values can be any length and only take the space they need.
+    """
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def value(self, i: int) -> str:
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def take(self, indices) -> 'TextColumn':
+        indices = np.asarray(indices, dtype=np.int64)
+        lengths = self.lengths()[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        # Position of every byte to copy from the old data into the new data
+        positions = np.repeat(self.offsets[:-1][indices] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return TextColumn(offsets, self.data[positions])
+
+    def to_numpy(self) -> np.ndarray:
+        lengths = self.lengths()
+        width = max(int(lengths.max()) if len(lengths) > 0 else 0, 1)
+
+        # Scattering the bytes into a fixed width block so numpy can decode every value at once
+        block = np.zeros((len(self), width), dtype=np.uint8)
+        rows = np.repeat(np.arange(len(self)), lengths)
+        block[rows, np.arange(len(self.data)) - np.repeat(self.offsets[:-1], lengths)] = self.data
+        return np.char.decode(block.view("S" + str(width)).reshape(-1), "utf-8")
+
+    def transform(self, function) -> np.ndarray:
+        return np.asarray(function(self.to_numpy()))
+
+    def non_empty(self) -> np.ndarray:
+        return self.lengths() > 0
+
+    def fixed_width_digits(self, width) -> np.ndarray:
+        return byte_digits(self.data, self.offsets[:-1], self.lengths(), width)
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.data.nbytes
+
+    @staticmethod
+    def from_numpy(values) -> 'TextColumn':
+        """
+        :param values: np.ndarray of str
+        :return: TextColumn
+        """
+        encoded = np.char.encode(values, "utf-8")
+        width = max(encoded.dtype.itemsize, 1)
+        lengths = np.char.str_len(encoded)
+
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        # Each value is padded out to the same width so only keep the bytes that are part of a value
+        block = encoded.view(np.uint8).reshape(-1, width) if len(values) > 0 else np.zeros((0, width), np.uint8)
+        data = block[np.arange(width) < lengths[:, None]]
+        return TextColumn(offsets, data)
+
+
+class ChainedColumn(Column):
+    """
+        Columns joined end to end without copying them. Used when lists are joined together for sorting so the joined
+        list shares the data of the lists in the workspace.
+    """
+
+    def __init__(self, columns: list[Column]):
+        self.columns = columns
+        self.starts = np.zeros(len(columns) + 1, dtype=np.int64)
+        np.cumsum([len(column) for column in columns], out=self.starts[1:])
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def value(self, i: int) -> str:
+        piece = np.searchsorted(self.starts, i, side="right") - 1
+        return self.columns[piece].value(i - self.starts[piece])
+
+    def take(self, indices) -> 'IndexedColumn':
+        return IndexedColumn(self, np.asarray(indices, dtype=np.int64))
+
+    def gather(self, indices) -> np.ndarray:
+        indices = np.asarray(indices, dtype=np.int64)
+        pieces = np.searchsorted(self.starts, indices, side="right") - 1
+
+        parts, positions = [], []
+        for piece in np.unique(pieces):
+            at = np.nonzero(pieces == piece)[0]
+            parts.append(self.columns[piece].gather(indices[at] - self.starts[piece]))
+            positions.append(at)
+
+        values = np.empty(len(indices), dtype=np.result_type(*parts) if len(parts) > 0 else np.dtype("U1"))
+        for part, at in zip(parts, positions):
+            values[at] = part
+        return values
+
+    def to_numpy(self) -> np.ndarray:
+        return np.concatenate([column.to_numpy() for column in self.columns])
+
+    def transform(self, function) -> np.ndarray:
+        return np.concatenate([column.transform(function) for column in self.columns])
+
+    def non_empty(self) -> np.ndarray:
+        return np.concatenate([column.non_empty() for column in self.columns])
+
+    def fixed_width_digits(self, width) -> np.ndarray:
+        return np.concatenate([column.fixed_width_digits(width) for column in self.columns])
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns)
+
+
+class IndexedColumn(Column):
+    """
+        The rows of another column at the given indices. Reordering a list only builds these so the values are not
+        copied until they are read, usually when the list is written out.
+    """
+
+    def __init__(self, base: Column, indices):
+        self.base = base
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def value(self, i: int) -> str:
+        return self.base.value(self.indices[i])
+
+    def take(self, indices) -> 'IndexedColumn':
+        return IndexedColumn(self.base, self.indices[indices])
+
+    def gather(self, indices) -> np.ndarray:
+        return self.base.gather(self.indices[indices])
+
+    def to_numpy(self) -> np.ndarray:
+        return self.base.gather(self.indices)
+
+    def transform(self, function) -> np.ndarray:
+        return self.base.transform(function)[self.indices]
+
+    def non_empty(self) -> np.ndarray:
+        return self.base.non_empty()[self.indices]
+
+    def fixed_width_digits(self, width) -> np.ndarray:
+        return self.base.fixed_width_digits(width)[self.indices]
+
+    @property
+    def nbytes(self):
+        return self.indices.nbytes
+
+
+class MappedColumn(Column):
+    """
+        A column of a delimited file that has been memory mapped. Row i is the UTF-8 bytes of buffer from starts[i] for
+        lengths[i] bytes, so nothing is copied out of the file until the values are needed.
+    """
+
+    def __init__(self, buffer, starts, lengths):
+        self.buffer = buffer
+        self.starts = starts
+        self.lengths = lengths
+
+    def __len__(self):
+        return len(self.starts)
+
+    def value(self, i: int) -> str:
+        return self.buffer[self.starts[i]:self.starts[i] + self.lengths[i]].tobytes().decode("utf-8")
+
+    def take(self, indices) -> 'MappedColumn':
+        return MappedColumn(self.buffer, self.starts[indices], self.lengths[indices])
+
+    def to_text(self) -> TextColumn:
+        """
+        :return: TextColumn with a copy of the bytes of every value
+        """
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(self.lengths, out=offsets[1:])
+
+        positions = np.repeat(self.starts - offsets[:-1], self.lengths) + np.arange(offsets[-1])
+        return TextColumn(offsets, self.buffer[positions])
+
+    def to_numpy(self) -> np.ndarray:
+        return self.to_text().to_numpy()
+
+    def transform(self, function) -> np.ndarray:
+        return np.asarray(function(self.to_numpy()))
+
+    def non_empty(self) -> np.ndarray:
+        return self.lengths > 0
+
+    def fixed_width_digits(self, width) -> np.ndarray:
+        return byte_digits(self.buffer, self.starts, self.lengths, width)
+
+    def compact(self) -> Column:
+        sample = self.take(np.arange(min(len(self), 1000))).to_numpy()
+        if is_repetitive(sample):
+            return encode_column(self.to_numpy())
+        return self.to_text()
+
+    @property
+    def nbytes(self):
+        # The values themselves are in the mapped file rather than memory
+        return self.starts.nbytes + self.lengths.nbytes
+
+
+class LazyColumn(Column):
+    """
+        A column that is only loaded, e.g. from a saved workspace, the first time its values are used. Its length is
+        known up front so a list can be shown and counted without loading any of its columns.
+    """
+
+    def __init__(self, length, load):
+        """
+        :param length: int, the number of rows
+        :param load: function() -> Column, called once to load the column
+        """
+        self.length = length
+        self.load = load
+        self.column = None
+        # The autosave thread can read a column at the same time as the window
+        self.lock = threading.Lock()
+
+    def loaded(self) -> Column:
+        if self.column is None:
+            with self.lock:
+                if self.column is None:
+                    self.column = self.load()
+                    # The loader can hold on to a file so it is let go once it isn't needed
+                    self.load = None
+        return self.column
+
+    def __len__(self):
+        return self.length
+
+    def value(self, i: int) -> str:
+        return self.loaded().value(i)
+
+    def take(self, indices) -> Column:
+        return self.loaded().take(indices)
+
+    def gather(self, indices) -> np.ndarray:
+        return self.loaded().gather(indices)
+
+    def to_numpy(self) -> np.ndarray:
+        return self.loaded().to_numpy()
+
+    def transform(self, function) -> np.ndarray:
+        return self.loaded().transform(function)
+
+    def non_empty(self) -> np.ndarray:
+        return self.loaded().non_empty()
+
+    def fixed_width_digits(self, width) -> np.ndarray:
+        return self.loaded().fixed_width_digits(width)
+
+    def compact(self) -> Column:
+        return self.loaded().compact()
+
+    @property
+    def nbytes(self):
+        return self.column.nbytes if self.column is not None else 0
+
+
+def byte_digits(buffer, starts, lengths, width) -> np.ndarray:
+    """
+    Reads values that are exactly width ASCII digits straight from their UTF-8 bytes
+    :param buffer: np.ndarray of uint8
+    :param starts: np.ndarray of int, where each value starts in buffer
+    :param lengths: np.ndarray of int, the number of bytes in each value
+    :param width: int, at most 9
+    :return: np.ndarray of int32, -1 where the value is not exactly width digits
+    """
+    valid = np.asarray(lengths) == width
+    values = np.zeros(len(valid), dtype=np.int32)
+    if not np.any(valid):
+        return np.full(len(valid), -1, dtype=np.int32)
+
+    positions = np.where(valid, starts, 0)
+    for k in range(0, width):
+        digits = buffer[positions + k].astype(np.int32) - ord("0")
+        valid &= (digits >= 0) & (digits <= 9)
+        values = values * 10 + digits
+
+    return np.where(valid, values, -1).astype(np.int32)
+
+
+def code_type(num_categories):
+    """
+    :return: the smallest unsigned integer type that can index num_categories values
+    """
+    if num_categories <= 1 << 8:
+        return np.uint8
+    if num_categories <= 1 << 16:
+        return np.uint16
+    return np.uint32
+
+
+def as_strings(values) -> np.ndarray:
+    """
+    Converts values into a unicode numpy array. None is treated as a blank string.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == "U":
+        return values
+    if values.dtype == object:
+        values = np.where(np.equal(values, None), "", values)
+    return values.astype(str)
+
+
+def is_repetitive(sample, dictionary_ratio=0.5) -> bool:
+    """
+    :param sample: np.ndarray of str, the first values of a column
+    :param dictionary_ratio: the most distinct values per row in the sample for the column to be dictionary encoded
+    :return: bool
+    """
+    return len(np.unique(sample)) <= max(1, len(sample) * dictionary_ratio)
+
+
+def encode_column(values, dictionary_ratio=0.5) -> Column:
+    """
+    Builds the most compact column for the values given. If a sample of the values is mostly repeated values then it's
+    dictionary encoded, otherwise it is stored as text.
+    :param values: array-like of str
+    :param dictionary_ratio: the most distinct values per row in the sample for it to be dictionary encoded
+    :return: Column
+    """
+    if isinstance(values, Column):
+        return values
+
+    values = as_strings(values)
+    if is_repetitive(values[:1000], dictionary_ratio):
+        categories, codes = np.unique(values, return_inverse=True)
+        return DictionaryColumn(categories, codes.astype(code_type(len(categories))))
+
+    return TextColumn.from_numpy(values)
+
+
+def column_arrays(column) -> dict:
+    """
+    Gives the arrays a column is stored as so it can be saved, e.g. with np.savez
+    :param column: Column
+    :return: dict of string to np.ndarray
+        "categories" and "codes" for dictionary encoded columns, otherwise "offsets" and "data"
+    """
+    column = column.compact()
+    if isinstance(column, DictionaryColumn):
+        return {"categories": column.categories, "codes": column.codes}
+    if not isinstance(column, TextColumn):
+        column = TextColumn.from_numpy(column.to_numpy())
+    return {"offsets": column.offsets, "data": column.data}
+
+
+def column_from_arrays(arrays) -> Column:
+    """
+    Rebuilds a column saved with column_arrays
+    :param arrays: dict of string to np.ndarray
+    :return: Column
+    """
+    if "categories" in arrays:
+        return DictionaryColumn(arrays["categories"], arrays["codes"])
+    return TextColumn(arrays["offsets"], arrays["data"])
+
+
+def blank_column(length) -> DictionaryColumn:
+    """
+    :return: DictionaryColumn of blank strings
+    """
+    return DictionaryColumn(np.array([""]), np.zeros(length, dtype=np.uint8))
+
+
+def concat_columns(columns: list[Column]) -> Column:
+    """
+    Joins columns end to end. The result is only allocated once.
+    :param columns: Column[]
+    :return: Column
+    """
+    if len(columns) == 1:
+        return columns[0]
+
+    if all(isinstance(column, DictionaryColumn) for column in columns):
+        categories = np.unique(np.concatenate([column.categories for column in columns]))
+        dtype = code_type(len(categories))
+        codes = np.empty(sum(len(column) for column in columns), dtype=dtype)
+
+        start = 0
+        for column in columns:
+            # Remapping the codes of each column to where its categories are in the merged categories
+            remap = np.searchsorted(categories, column.categories).astype(dtype)
+            codes[start:start + len(column)] = remap[column.codes]
+            start += len(column)
+
+        return DictionaryColumn(categories, codes)
+
+    columns = [column if isinstance(column, TextColumn) else TextColumn.from_numpy(column.to_numpy())
+               for column in columns]
+
+    offsets = np.zeros(sum(len(column) for column in columns) + 1, dtype=np.int64)
+    data = np.empty(sum(len(column.data) for column in columns), dtype=np.uint8)
+
+    row, position = 0, 0
+    for column in columns:
+        offsets[row + 1:row + len(column) + 1] = column.offsets[1:] + position
+        data[position:position + len(column.data)] = column.data
+        row += len(column)
+        position += len(column.data)
+
+    return TextColumn(offsets, data)
+
+
+class ColumnBuilder:
+    """
+        Builds a column a chunk at a time for parsers that read a file as a stream. Each chunk is encoded as soon as
+        it's added so only the chunk being read is held as Python strings.
+    """
+
+    def __init__(self, num_records=0):
+        # Columns first seen part way through a file are blank for the rows before
+        self.pieces = [blank_column(num_records)] if num_records > 0 else []
+        self.num_records = num_records
+        self.has_data = False
+
+    def append(self, values):
+        """
+        :param values: array-like of str
+        """
+        if len(values) == 0:
+            return
+
+        piece = encode_column(values)
+        self.has_data = self.has_data or bool(np.any(piece.non_empty()))
+        self.pieces.append(piece)
+        self.num_records += len(piece)
+
+    def build(self) -> Column:
+        if len(self.pieces) == 0:
+            return encode_column([])
+        return concat_columns(self.pieces)
+
+
+class ColumnStore:
+    """
+        The content of a MailList as a list of columns. Indexing with an int returns a Column and indexing with a
+        slice returns a ColumnStore of those columns.
+    """
+
+    def __init__(self, columns=None):
+        self.columns = [] if columns is None else list(columns)
+
+    @staticmethod
+    def from_values(content):
+        """
+        :param content: a 2D array or a list of lists where each inner list is a column
+        :return: ColumnStore
+        """
+        if isinstance(content, ColumnStore):
+            return content
+
+        return ColumnStore([encode_column(column) for column in content])
+
+    @property
+    def num_records(self):
+        return len(self.columns[0]) if len(self.columns) > 0 else 0
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return ColumnStore(self.columns[key])
+        return self.columns[key]
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def append(self, column: Column):
+        self.columns.append(column)
+
+    def compact(self) -> 'ColumnStore':
+        """
+        :return: ColumnStore where every column holds its own copy of its values, see Column.compact
+        """
+        return ColumnStore([column.compact() for column in self.columns])
+
+    def take(self, indices) -> 'ColumnStore':
+        """
+        Reorders the rows of every column. Dictionary columns are reordered straight away as that only copies their
+        codes, other columns are given as an IndexedColumn so their values are only copied when they are read.
+        :param indices: np.ndarray of int
+        :return: ColumnStore
+            A store with the rows at the given indices of every column, in that order
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        # Columns that were reordered together share their indices, so compose them only once
+        composed = {}
+        columns = []
+        for column in self.columns:
+            if isinstance(column, DictionaryColumn):
+                columns.append(column.take(indices))
+            elif isinstance(column, IndexedColumn):
+                if id(column.indices) not in composed:
+                    composed[id(column.indices)] = column.indices[indices]
+                columns.append(IndexedColumn(column.base, composed[id(column.indices)]))
+            else:
+                columns.append(IndexedColumn(column, indices))
+
+        return ColumnStore(columns)
+
+    def iter_rows(self, chunk_size=10000):
+        """
+        Yields the content one row at a time as a tuple of strings. Rows are only built a chunk at a time so the
+        whole list is never held as rows in memory at once.
+        :param chunk_size: number of rows to decode at a time
+        """
+        for start in range(0, self.num_records, chunk_size):
+            chunk = slice(start, min(start + chunk_size, self.num_records))
+            yield from zip(*[column[chunk].tolist() for column in self.columns])
+
+    def tolist(self):
+        return [column.tolist() for column in self.columns]
@@ -0,0 +1,106 @@
+import bz2
+import gzip
+import io
+import os
+import zipfile
+
+# The first bytes of each kind of compressed file
+MAGIC_NUMBERS = {"gzip": b"\x1f\x8b", "bz2": b"BZh", "zip": b"PK\x03\x04"}
+# Extensions removed to find the type of the file inside
+COMPRESSED_EXTENSIONS = [".gz", ".gzip", ".bz2"]
+# Extensions of the files that are read as lists from a zip archive without a .zip extension
+ARCHIVE_LIST_EXTENSIONS = [".csv", ".txt"]
+# Files that only office documents such as .xlsx and .ods have in their zip. These are read as one document.
+OFFICE_MEMBERS = ["[Content_Types].xml", "mimetype"]
+
+
+def compression(file_path):
+    """
+    Works out how a file is compressed from its first bytes rather than its name
+    :param file_path: string
+    :return: string
+        "gzip", "bz2" or "zip", None if the file isn't compressed or can't be read
+    """
+    try:
+        with open(file_path, "rb") as file:
+            start = file.read(4)
+    except OSError:
+        return None
+
+    return next((kind for kind, magic in MAGIC_NUMBERS.items() if start.startswith(magic)), None)
+
+
+def archiveMembers(file_path):
+    """
+    :return: string[]
+        The names of the files in a zip archive of lists, an empty list if it isn't one. Office documents are zips
+        too but aren't archives of lists.
+    """
+    if compression(file_path) != "zip":
+        return []
+
+    with zipfile.ZipFile(file_path) as archive:
+        # Leaving out folders and the resource files macOS adds to archives
+        members = [info.filename for info in archive.infolist()
+                   if not info.is_dir() and not info.filename.startswith("__MACOSX/")]
+
+    if any(member in OFFICE_MEMBERS for member in members):
+        return []
+    # Other zips are only archives of lists if they are named as one or hold nothing but lists
+    if not file_path.lower().endswith(".zip") and \
+            not all(os.path.splitext(member)[1].lower() in ARCHIVE_LIST_EXTENSIONS for member in members):
+        return []
+    return members
+
+
+def openBinary(file_path, member=None):
+    """
+    Opens a file for reading its decompressed bytes as a stream. Nothing is decompressed to disk.
+    :param file_path: string
+    :param member: string, the file to read from a zip archive, the first file if None
+    :return: binary file object
+    """
+    kind = compression(file_path)
+    if kind == "gzip":
+        return gzip.open(file_path, "rb")
+    if kind == "bz2":
+        return bz2.open(file_path, "rb")
+    if kind == "zip":
+        archive = zipfile.ZipFile(file_path)
+        members = archiveMembers(file_path)
+        if member is None and len(members) == 0:
+            archive.close()
+            raise FileNotFoundError("There are no files in the archive " + file_path)
+        # The member keeps the archive's file open until it is closed
+        stream = archive.open(member if member is not None else members[0])
+        archive.close()
+        return stream
+
+    return open(file_path, "rb")
+
+
+def openText(file_path, encoding=None, member=None):
+    """
+    Same as openBinary but decodes the text, with newlines left as they are for the csv module
+    """
+    if compression(file_path) is None:
+        return open(file_path, "r", newline="", encoding=encoding)
+    return io.TextIOWrapper(openBinary(file_path, member), encoding=encoding, newline="")
+
+
+def innerFileType(file_path):
+    """
+    :return: string
+        The extension of the file inside a compressed file, or of the first file in a zip archive. The file's own
+        extension if it isn't compressed.
+    """
+    name = file_path
+    members = archiveMembers(file_path)
+    if len(members) > 0:
+        name = members[0]
+    else:
+        for extension in COMPRESSED_EXTENSIONS:
+            if name.lower().endswith(extension):
+                name = name[:-len(extension)]
+
+    return name.split(".")[-1].lower() if "." in name else ""
@@ -0,0 +1,210 @@
+import pathlib
+import sqlite3
+import threading
+from .maillistparser import MailListParser
+from .maillist import MailList
+from .columns import ColumnBuilder
+
+
+def connectSQLite(database):
+    """
+    Opens an SQLite database read only, so a missing file isn't created and the list can't be changed by reading it
+    :param database: string, the path of the database file
+    :return: sqlite3.Connection
+    """
+    uri = pathlib.Path(database).absolute().as_uri() + "?mode=ro"
+    # Connections are only used by the thread that opened them but the pool can close them from any thread
+    return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+
+class ConnectionPool:
+    """
+        Keeps database connections open so lists read from the same database one after another share a connection
+        rather than each connecting again. Connections are kept for each thread as DB-API modules don't all allow a
+        connection to be used from another thread. The workspace closes a thread's connections with closeThread once
+        its import or preview is done.
+    """
+    instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_instance():
+        if ConnectionPool.instance is None:
+            with ConnectionPool._instance_lock:
+                if ConnectionPool.instance is None:
+                    ConnectionPool.instance = ConnectionPool()
+        return ConnectionPool.instance
+
+    def connection(self, database, connect):
+        """
+        :param database: string, the database file or connection string
+        :param connect: DB-API connect function
+        :return: DB-API connection, opened the first time this thread asks for the database
+        """
+        key = (connect, database, threading.get_ident())
+        with self.lock:
+            if key not in self.connections:
+                self.connections[key] = connect(database)
+            return self.connections[key]
+
+    def release(self, database, connect):
+        """
+        Closes this thread's connection to the database, e.g. after it failed so the next read connects again
+        """
+        with self.lock:
+            connection = self.connections.pop((connect, database, threading.get_ident()), None)
+        if connection is not None:
+            connection.close()
+
+    def closeThread(self):
+        """
+        Closes every connection this thread opened, e.g. once the thread has finished reading a list
+        """
+        thread = threading.get_ident()
+        with self.lock:
+            keys = [key for key in self.connections if key[2] == thread]
+            connections = [self.connections.pop(key) for key in keys]
+        for connection in connections:
+            connection.close()
+
+    def close(self):
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections = {}
+        for connection in connections:
+            connection.close()
+
+
+class DatabaseMailListParser(MailListParser):
+    """
+        Reads the results of a query as a mail list from any DB-API database, SQLite by default. Rows are fetched a
+        chunk at a time into the columns so only one chunk is ever held as Python values. Headers are the names of
+        the query's columns.
+    """
+
+    def __init__(self, query=None, parameters=(), connect=connectSQLite, chunk_size=10000):
+        # Headers always come from the query
+        super(DatabaseMailListParser, self).__init__(True)
+        # Query the list is read from. If None the list is read from a table of an SQLite database.
+        self.query = query
+        self.parameters = parameters
+        self.connect = connect
+        # Number of rows fetched at a time
+        self.chunk_size = chunk_size
+
+    def readList(self, file_path):
+        if self.query is not None:
+            return self.readQuery(file_path, self.query, self.parameters, self.nameFromPath(file_path))
+
+        tables = self.tableNames(file_path)
+        if len(tables) == 0:
+            return MailList([], [], "")
+        return self.readTable(file_path, tables[0], len(tables))
+
+    def readLists(self, file_path):
+        """
+        Without a query each table of the database is read as its own list
+        :return: MailList[]
+        """
+        if self.query is not None:
+            return [self.readList(file_path)]
+
+        tables = self.tableNames(file_path)
+        return [self.readTable(file_path, table, len(tables)) for table in tables] or [MailList([], [], "")]
+
+    def readTable(self, file_path, table, num_tables):
+        name = self.nameFromPath(file_path) if num_tables == 1 else self.nameFromPath(file_path) + " - " + table
+        return self.readQuery(file_path, 'SELECT * FROM "' + table.replace('"', '""') + '"', (), name)
+
+    def readQuery(self, database, query, parameters, name):
+        """
+        :param database: string, passed to the connect function
+        :param query: string
+        :param parameters: sequence or mapping of the query's parameters
+        :param name: string, the name of the list
+        :return: MailList, empty if the query couldn't be run
+        """
+        try:
+            connection = ConnectionPool.get_instance().connection(database, self.connect)
+            cursor = connection.cursor()
+        except Exception:
+            # Each DB-API module has its own exceptions and connect can fail on anything from a missing file to a
+            # refused login
+            return MailList([], [], "")
+
+        try:
+            cursor.execute(query, parameters)
+            headers = [str(description[0]) for description in cursor.description or []]
+            columns = [ColumnBuilder() for _ in headers]
+
+            num_records = 0
+            while self.max_rows is None or num_records < self.max_rows:
+                size = self.chunk_size if self.max_rows is None else min(self.chunk_size, self.max_rows - num_records)
+                rows = cursor.fetchmany(size)
+                if len(rows) == 0:
+                    break
+
+                # Fetched rows are turned into columns straight away, with values as text the same as other files
+                for column, values in zip(columns, zip(*rows)):
+                    column.append(["" if value is None else str(value) for value in values])
+                num_records += len(rows)
+        except getattr(connection, "Error", Exception):
+            # A failed query can leave the connection unusable, so the next read connects again
+            ConnectionPool.get_instance().release(database, self.connect)
+            return MailList([], [], "")
+        finally:
+            cursor.close()
+
+        new_list = MailList(headers, [column.build() for column in columns], name)
+        new_list.address_columns = MailListParser.identifyAddressColumns(new_list)
+        return new_list
+
+    def estimateRecords(self, file_path):
+        """
+        Counts the records with the database, which doesn't need the rows to be fetched
+        """
+        if self.query is not None:
+            query, parameters = "SELECT COUNT(*) FROM (" + self.query + ")", self.parameters
+        else:
+            tables = self.tableNames(file_path)
+            if len(tables) == 0:
+                return None
+            query, parameters = 'SELECT COUNT(*) FROM "' + tables[0].replace('"', '""') + '"', ()
+
+        try:
+            connection = ConnectionPool.get_instance().connection(file_path, self.connect)
+            cursor = connection.cursor()
+        except Exception:
+            return None
+
+        try:
+            cursor.execute(query, parameters)
+            return int(cursor.fetchone()[0])
+        except getattr(connection, "Error", Exception):
+            return None
+        finally:
+            cursor.close()
+
+    def tableNames(self, database):
+        """
+        :return: string[]
+            The tables of an SQLite database in the order they were made, an empty list if they can't be read
+        """
+        try:
+            connection = ConnectionPool.get_instance().connection(database, self.connect)
+            cursor = connection.cursor()
+        except Exception:
+            return []
+
+        try:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+                           "ORDER BY rowid")
+            return [row[0] for row in cursor.fetchall()]
+        except getattr(connection, "Error", Exception):
+            return []
+        finally:
+            cursor.close()
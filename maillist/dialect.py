@@ -0,0 +1,98 @@
+import codecs
+import csv
+import io
+import zipfile
+from .compressed import openBinary
+
+
+class FileDialect:
+    """
+        How a delimited file is written: its encoding, the delimiter and quote character between values and whether
+        the first row is headers. sniff works these out from the start of a file.
+    """
+    # Delimiters considered when sniffing
+    DELIMITERS = "\t,;|"
+
+    def __init__(self, delimiter, encoding="utf-8", quotechar='"', has_header=True):
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.quotechar = quotechar
+        self.has_header = has_header
+
+    @staticmethod
+    def sniff(file_path, default_delimiter, sample_bytes=1 << 16, member=None):
+        """
+        :param file_path: string
+        :param default_delimiter: string, used if the delimiter can't be worked out
+        :param sample_bytes: int, how much of the start of the file is looked at
+        :param member: string, the file in a zip archive to sniff, the first file if None
+        :return: FileDialect
+            The dialect of the file, or the defaults if the file can't be read
+        """
+        try:
+            # Compressed files are sniffed from their decompressed bytes
+            with openBinary(file_path, member) as file:
+                sample = file.read(sample_bytes)
+        except (OSError, EOFError, zipfile.BadZipFile):
+            return FileDialect(default_delimiter)
+
+        encoding = FileDialect.sniffEncoding(sample)
+        text = codecs.getincrementaldecoder(encoding)(errors="replace").decode(sample)
+        if len(sample) == sample_bytes:
+            # Leaving out the last line as it is likely cut short
+            text = text[:text.rfind("\n") + 1] or text
+
+        dialect = FileDialect(default_delimiter, encoding)
+        sniffer = csv.Sniffer()
+        # The delimiter of the chosen file type is kept when it splits the file the same way on every line, as the
+        # sniffer can prefer a delimiter that is only within values, e.g. commas in the addresses of a tab file
+        if not FileDialect.splitsEvenly(text, default_delimiter):
+            try:
+                sniffed = sniffer.sniff(text, delimiters=FileDialect.DELIMITERS)
+                dialect.delimiter = sniffed.delimiter
+                dialect.quotechar = sniffed.quotechar or '"'
+            except csv.Error:
+                pass
+
+        try:
+            dialect.has_header = sniffer.has_header(text)
+        except csv.Error:
+            pass
+
+        return dialect
+
+    @staticmethod
+    def splitsEvenly(text, delimiter, quotechar='"'):
+        """
+        :param text: string, lines from the start of a file
+        :return: bool
+            Whether delimiter splits every line of text into the same number of values, and into more than one
+        """
+        try:
+            num_fields = {len(row) for row in csv.reader(io.StringIO(text), delimiter=delimiter, quotechar=quotechar)
+                          if len(row) > 0}
+        except csv.Error:
+            return False
+        return len(num_fields) == 1 and num_fields.pop() > 1
+
+    @staticmethod
+    def sniffEncoding(sample):
+        """
+        :param sample: bytes from the start of a file
+        :return: string, the name of the encoding the sample is most likely in
+        """
+        if sample.startswith(codecs.BOM_UTF8):
+            return "utf-8-sig"
+        if sample.startswith(codecs.BOM_UTF16_LE) or sample.startswith(codecs.BOM_UTF16_BE):
+            return "utf-16"
+
+        # Decoding incrementally so a character cut off at the end of the sample isn't an error
+        for encoding in ["utf-8", "cp1252"]:
+            try:
+                codecs.getincrementaldecoder(encoding)().decode(sample)
+                return encoding
+            except UnicodeDecodeError:
+                pass
+
+        # Every byte is a character in latin-1 so it can always be read
+        return "latin-1"
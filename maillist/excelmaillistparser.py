@@ -1,31 +1,184 @@
+import zipfile
 from .maillistparser import MailListParser
-import numpy as np
 import pandas as pd
 from .maillist import MailList
+from .columns import ColumnBuilder
+
 
 class ExcelMailListParser(MailListParser):
-    def __init__(self, include_headers, sheetNumber):
+    def __init__(self, include_headers, sheetNumber, chunk_size=10000, max_rows=None):
         super(ExcelMailListParser, self).__init__(include_headers)
         self.sheetNumber = 0 if sheetNumber == "" else int(sheetNumber) - 1
+        # Number of rows held as Python strings at once before they are added to the columns
+        self.chunk_size = chunk_size
+        # Stop reading a sheet after this many records, e.g. to preview it. None reads every record.
+        self.max_rows = max_rows
 
     def readList(self, file_path):
+        return self.readSheets(file_path, [self.sheetNumber])[0]
+
+    def estimateRecords(self, file_path):
+        """
+        Takes the number of rows from the size the sheet says it is, which doesn't need the rows to be read
+        """
+        if file_path.lower().endswith(".xls"):
+            return None
+
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+
         try:
+            workbook = load_workbook(file_path, read_only=True, data_only=True)
+        except (FileNotFoundError, ValueError, InvalidFileException, zipfile.BadZipFile):
+            return None
+
+        try:
+            if not 0 <= self.sheetNumber < len(workbook.worksheets):
+                return None
+            rows = workbook.worksheets[self.sheetNumber].max_row
+        finally:
+            workbook.close()
+
+        if rows is None:
+            return None
+        return max(rows - (1 if self.include_headers else 0), 0)
+
+    def readSheets(self, file_path, sheet_numbers=None):
+        """
+        Reads several sheets of a workbook while only opening it once.
+        :param file_path: string
+        :param sheet_numbers: int[]
+            Zero based numbers of the sheets to read, every sheet if None
+        :return: MailList[]
+            A list for each sheet in the order asked for. Sheets that couldn't be read give an empty list.
+        """
+        if file_path.lower().endswith(".xls"):
+            # Only the newer format can be streamed
+            return self.readWithPandas(file_path, sheet_numbers)
+
+        # Imported here as openpyxl is only needed once an excel file is read, the same as pandas does
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+
+        try:
+            # Read only mode streams the rows of a sheet rather than loading every cell first
+            workbook = load_workbook(file_path, read_only=True, data_only=True)
+        except (FileNotFoundError, ValueError, InvalidFileException, zipfile.BadZipFile):
+            return [MailList([], [], "") for _ in (sheet_numbers or [0])]
+
+        try:
+            worksheets = workbook.worksheets
+            if sheet_numbers is None:
+                sheet_numbers = range(0, len(worksheets))
+
+            mail_lists = []
+            for sheet_number in sheet_numbers:
+                if 0 <= sheet_number < len(worksheets):
+                    name = self.listName(file_path, worksheets[sheet_number].title, len(sheet_numbers))
+                    rows = worksheets[sheet_number].iter_rows(values_only=True)
+                    mail_lists.append(self.readRows(rows, name))
+                else:
+                    mail_lists.append(MailList([], [], ""))
+        finally:
+            # Workbooks in read only mode keep the file open until closed
+            workbook.close()
+
+        return mail_lists
+
+    def readRows(self, rows, name):
+        """
+        :param rows: iterable of tuples of cell values
+        :param name: string, the name of the list
+        :return: MailList
+        """
+        headers = None
+        columns = []
+        chunk = []
+        num_records = 0
+
+        for row in rows:
+            # Cells are read as text the same way pandas does with dtype=str
+            values = ["" if value is None else str(value) for value in row]
+            if all(value == "" for value in values):
+                continue
+
+            if headers is None and self.include_headers:
+                headers = self.uniqueHeaders(["Unnamed: " + str(i) if value == "" else value
+                                              for i, value in enumerate(values)])
+                columns = [ColumnBuilder() for _ in values]
+                continue
+
+            chunk.append(values)
+            num_records += 1
+            if len(chunk) >= self.chunk_size:
+                self.addChunk(columns, chunk)
+                chunk = []
+
+            if self.max_rows is not None and num_records >= self.max_rows:
+                break
+
+        self.addChunk(columns, chunk)
+
+        if headers is None:
+            headers = []
+        headers = headers + ["Column " + str(i) for i in range(len(headers), len(columns))]
+
+        new_list = MailList(headers, [column.build() for column in columns], name)
+        new_list.address_columns = MailListParser.identifyAddressColumns(new_list)
+        return new_list
+
+    @staticmethod
+    def uniqueHeaders(headers):
+        """
+        Renames repeated headers the same way pandas does, so the second Name column is Name.1
+        :param headers: string[]
+        :return: string[]
+        """
+        unique = list(headers)
+        counts = {}
+        for i, header in enumerate(headers):
+            name = header
+            count = counts.get(header, 0)
+            # Skipping numbers that would give a name another header already has, e.g. Name.1
+            while count > 0:
+                counts[header] = count + 1
+                name = header + "." + str(count)
+                count = count + 1 if name in unique else counts.get(name, 0)
+            unique[i] = name
+            counts[name] = count + 1
+
+        return unique
+
+    def readWithPandas(self, file_path, sheet_numbers):
+        """
+        Reads sheets of a file in the older excel format with pandas
+        """
+        header = 0 if self.include_headers else None
+        try:
+            sheets = pd.read_excel(file_path, header=header, na_filter=False, dtype=str, nrows=self.max_rows,
+                                   sheet_name=sheet_numbers)
+        except (FileNotFoundError, ValueError, IndexError):
+            return [MailList([], [], "") for _ in (sheet_numbers or [0])]
+
+        mail_lists = []
+        for sheet_name, spreadsheet in sheets.items():
             if self.include_headers:
-                spreadsheet = pd.read_excel(file_path, na_filter=False, dtype=str, sheet_name=self.sheetNumber)
                 headers = spreadsheet.columns.to_list()
             else:
-                spreadsheet = pd.read_excel(file_path, header=None, na_filter=False, dtype=str,
-                                            sheet_name=self.sheetNumber)
-
                 headers = ["Column " + str(i) for i in range(0, len(spreadsheet.columns))]
 
-            content = np.transpose(spreadsheet.to_numpy())
-            file_name = file_path.split("\\")[-1].split(".")[0]
+            # Taking each column on its own as converting the whole frame to an array would copy every cell
+            content = [spreadsheet.iloc[:, i].to_numpy() for i in range(0, len(spreadsheet.columns))]
+            name = self.listName(file_path, str(sheet_name), len(sheets))
 
-            new_list = MailList(headers, content, file_name)
-            new_list.address_columns = MailListParser.identifyAddressField(new_list.headers)
-            return new_list
+            new_list = MailList(headers, content, name)
+            new_list.address_columns = MailListParser.identifyAddressColumns(new_list)
+            mail_lists.append(new_list)
 
-        except (FileNotFoundError, ValueError):
-            return MailList([], [], "")
+        return mail_lists
 
+    @staticmethod
+    def listName(file_path, sheet_name, num_sheets):
+        file_name = MailListParser.nameFromPath(file_path)
+        # Lists from the same workbook are told apart by their sheet
+        return file_name if num_sheets == 1 else file_name + " - " + sheet_name
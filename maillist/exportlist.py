@@ -1,6 +1,8 @@
 from .maillist import MailList
+from .maillistparser import MailListParser
+from .columns import ColumnStore, ChainedColumn, blank_column
+from printpost.readprintpost import ReadPrintPost
 import numpy as np
-import functools
 
 
 class ExportList:
@@ -10,94 +12,145 @@ class ExportList:
         has to prepare the final list in an order that matches the manifest.
     """
 
+    # Sort key given to rows without a presort indicator. It is larger than any key built from the other fields.
+    OVERSEAS_KEY = 1 << 40
+
     @staticmethod
     def join(lists: list[MailList]):
+        """
+        Joins lists into one list with the columns of every list. Columns are matched by name ignoring case. The joined
+        columns are chained views of the lists' columns so no values are copied.
+        :param lists: MailList[]
+        :return: MailList
+            the joined list, with sort codes and source_ids (the index of the list each record came from)
+        """
         assert len(lists) > 0
-        # Join lists one at a time
-
-        if len(lists) == 1:
-            return lists[0].headers, lists[0].content
-
-        headers, combined_list = ExportList.__join_two(lists[0], lists[1])
-
-        for i in range(2, len(lists)):
-            headers, combined_list = ExportList.__join_two(combined_list, lists[i])
-
-        # Finding the MS_SortCode index so it can be shifted to the end column
-        sort_idx = -1
-        for i in range(0, len(headers)):
-            if headers[i] == "MS_SortCode":
-                sort_idx = i
-                break
-
-        dropped_content = combined_list[sort_idx]
-        dropped_header = headers[sort_idx]
-
-        new_headers = np.concatenate((np.delete(headers, sort_idx), [dropped_header]))
-        new_content = np.concatenate((np.delete(combined_list, sort_idx, axis=0), [dropped_content]))
-
-        return new_headers, new_content
-
-    @staticmethod
-    def __join_two(aList, bList):
-        # First we need to identify if there are any names of columns that are similar between the two
-        related = ExportList.__duplicate_headers(aList.headers, bList.headers)
-        combined_list = aList.content.copy()
-        total_related = len(aList.headers) - np.count_nonzero(related == -1)
-
-        # Filling right side of aList with empty values for the remaining column that aren't matching in bList
-        empty_columns = np.full((len(bList.headers) - total_related, len(combined_list[0])), '')
-
-        combined_list = np.append(combined_list, empty_columns, axis=0)
-        # Filling left side of bList with all blank columns to fill what will be aList (duplicates are included)
-        empty_columns = np.full((len(aList.headers), len(bList.content[0])), '')
-
-        to_combine_list = np.append(empty_columns, bList.content, axis=0)
 
-        to_delete = []
-        # Removing the extra columns in to_combine_list and setting them so they align with the matching ones in aList
-        for i in range(0, len(related)):
-            if related[i] != -1:
-                to_delete.append(related[i] + len(aList.headers))
-                to_combine_list[i] = bList.content[related[i]]
-
-        to_combine_list = np.delete(to_combine_list, to_delete, 0)
-
-        # Stacking the new lists on top of each other
-        combined_list = np.hstack((combined_list, to_combine_list))
-        headers = aList.headers.copy()
-        for i in range(0, len(bList.headers)):
-            if i not in related:
-                headers = np.append(headers, [bList.headers[i]])
-
-        return headers, combined_list
+        headers, slots = ExportList.__header_union([mail_list.headers for mail_list in lists])
+
+        for mail_list in lists:
+            if mail_list.sort_codes is None and mail_list.address_columns[-1] != -1:
+                mail_list.assign_sort_codes()
+
+        sizes = [mail_list.num_records for mail_list in lists]
+        sort_codes = np.full(sum(sizes), -1, dtype=np.int16)
+        state_codes = np.full(sum(sizes), -1, dtype=np.int8)
+
+        # The pieces that make up each joined column, blank where a list doesn't have that column
+        pieces = [[blank_column(size) for size in sizes] for _ in headers]
+
+        start = 0
+        for i, (mail_list, list_slots, size) in enumerate(zip(lists, slots, sizes)):
+            for column, slot in enumerate(list_slots):
+                pieces[slot][i] = mail_list.content[column]
+            if mail_list.sort_codes is not None:
+                sort_codes[start:start + size] = mail_list.sort_codes
+                state_codes[start:start + size] = mail_list.state_codes
+            start += size
+
+        # The joined columns share the data of the lists rather than copying it
+        content = ColumnStore([ChainedColumn(column_pieces) for column_pieces in pieces])
+        joined_list = MailList(headers, content, "Joined List")
+        joined_list.sort_codes = sort_codes
+        joined_list.state_codes = state_codes
+        joined_list.source_ids = np.repeat(np.arange(len(lists), dtype=np.int16), sizes)
+
+        # Exported lists have always had MS_State straight after the columns of the first list with sort codes, and
+        # the columns only later lists have after it. Kept so exported files don't change.
+        first = next((i for i, mail_list in enumerate(lists) if mail_list.sort_codes is not None), None)
+        if first is not None:
+            joined_list.state_column_position = 1 + max([-1] + [slot for list_slots in slots[:first + 1]
+                                                                for slot in list_slots])
+        joined_list.address_columns = MailListParser.identifyAddressField(headers)
+        # Fields without a header the joined list recognises are taken from the first list that has them, so a list
+        # whose postcode column isn't named "Postcode" is still sorted on it
+        for field in range(0, len(joined_list.address_columns)):
+            if joined_list.address_columns[field] == -1:
+                joined_list.address_columns[field] = next((list_slots[mail_list.address_columns[field]] for mail_list,
+                                                           list_slots in zip(lists, slots)
+                                                           if mail_list.address_columns[field] != -1), -1)
+        return joined_list
 
     @staticmethod
-    def __duplicate_headers(aHeader: list[str], bHeader: list[str]):
-        related = np.full(len(aHeader), -1)
-        for i in range(0, len(aHeader)):
-            for j in range(0, len(bHeader)):
-                if aHeader[i].lower() == bHeader[j].lower():
-                    related[i] = j
-                    break
-
-        return related
+    def __header_union(header_lists):
+        """
+        Works out the columns of the joined list. A header matches an earlier column with the same name ignoring case,
+        unless the same list already used that column, in which case it gets a column of its own.
+        :param header_lists: the headers of each list
+        :return: (np.ndarray, list[list[int]])
+            headers of the joined list and for each list, the joined column that each of its columns goes into
+        """
+        headers = []
+        columns_by_name = {}
+        slots = []
+
+        for list_headers in header_lists:
+            list_slots = []
+            for header in list_headers:
+                name = str(header).lower()
+                slot = next((i for i in columns_by_name.get(name, []) if i not in list_slots), None)
+                if slot is None:
+                    slot = len(headers)
+                    headers.append(header)
+                    columns_by_name.setdefault(name, []).append(slot)
+                list_slots.append(slot)
+            slots.append(list_slots)
+
+        return np.array(headers, dtype=np.dtype('U100')), slots
 
     @staticmethod
-    def __compareByIndex(item1, item2, idx):
+    def __sortKeys(listToSort: MailList, psiMap):
         """
-        Compares two lists together by using the value at the index given by idx
-        :param item1: first list to compare
-        :param item2: second list to compare
-        :param idx: value of the list to compare
-        :return: 1 if item1 is less, 0 if they are the same, -1 if item2 is less
+        Encodes the manifest order of every row into one integer so the list can be ordered with a single argsort.
+        From most to least significant the key holds:
+            overseas flag - rows without a presort indicator go to the bottom
+            state
+            residue flag - within a state, area and postcode direct indicators come before residue
+            presort indicator
+            not postcode direct flag - within an indicator, postcode direct postcodes come first
+            postcode
+        States and presort indicators are indices into the sorted tables of the compiled plan and postcodes are 4 digit
+        integers, so ordering the indices is the same as ordering the strings.
+        :param listToSort: a MailList (must have a postcode column and either sort codes or an MS_SortCode column)
+        :param psiMap: presort indicators that are not residue mapped to the postcodes in them that are postcode direct
+        :return: np.ndarray of int64
         """
-        if item1[idx] < item2[idx]:
-            return 1
-        elif item1[idx] > item2[idx]:
-            return -1
+        printPost = ReadPrintPost.get_instance()
+        assert len(printPost.plan_codes) < 256, "Presort indicators must fit in 8 bits of the sort key"
+
+        if listToSort.sort_codes is not None:
+            psi = listToSort.sort_codes.astype(np.int64)
         else:
-            return 0
+            psi = listToSort.content[-1].transform(printPost.encode_plans).astype(np.int64)
+
+        overseas = psi == -1
+        # Overseas rows index the tables with 0 but their other key parts are zeroed below
+        psi[overseas] = 0
+        state = printPost.plan_state_table[psi].astype(np.int64)
+        postcode = listToSort.content[listToSort.address_columns[2]].fixed_width_digits(4)
+        postcode = postcode.astype(np.int64)
+        postcode[postcode < 0] = 0
+
+        psiCodes = printPost.encode_plans(list(psiMap.keys())).astype(np.int64)
+        non_residue = np.zeros(len(printPost.plan_codes), dtype=bool)
+        non_residue[psiCodes[psiCodes != -1]] = True
+
+        # Postcode direct rows are identified by the pair of presort indicator and postcode
+        direct_postcodes = [np.zeros(0, dtype=np.int64)]
+        for psiCode, postMap in zip(psiCodes, psiMap.values()):
+            if psiCode != -1:
+                direct_postcodes.append(psiCode * 10000 + ReadPrintPost.encode_postcodes(list(postMap.keys())))
+
+        residue = ~non_residue[psi]
+        not_direct = residue | ~np.isin(psi * 10000 + postcode, np.concatenate(direct_postcodes))
+
+        key = state
+        key = (key << 1) | residue
+        key = (key << 8) | psi
+        key = (key << 1) | not_direct
+        key = (key << 14) | postcode
+        key[overseas] = ExportList.OVERSEAS_KEY
+        return key
 
     @staticmethod
     def createExportList(listToSort: MailList, categories):
@@ -108,7 +161,17 @@ class ExportList:
             type is residue), total number of articles]. If sortPlanType is postcode then total number of articles
             should be a list that contains lists of the format [postcode, total number of articles]. As more than one
             postcode may be direct within the same pre sort indicator
-        :return:
+        :return: MailList, listToSort in the order of the manifest
+        """
+        listToSort.reorder(ExportList.exportOrder(listToSort, categories))
+        return listToSort
+
+    @staticmethod
+    def exportOrder(listToSort: MailList, categories):
+        """
+        :param listToSort: as createExportList takes
+        :param categories: as createExportList takes
+        :return: np.ndarray, the record of listToSort that goes in each position of the export list
         """
         psiMap = {}
         # First create a mapping from a presort indicator to a [sort plan type (residue, area, postcode)]
@@ -116,6 +179,9 @@ class ExportList:
             # Loop through first index as all the lists are wrapped in a list because of the dataframe
             for row in categories[column]:
                 psi, sortPlanType = row[1], row[0]
+                # Residue doesn't have a presort indicator
+                if psi == "":
+                    continue
                 if psi not in psiMap:
                     # psiMap stores an array that describes all postcodes in postcode direct. A blank dict means its
                     # only area direct
@@ -124,62 +190,14 @@ class ExportList:
                     for postcode in row[2]:
                         psiMap[psi][postcode[0]] = True
 
-        stateIdx, postcodeIdx = listToSort.address_columns[1], listToSort.address_columns[2]
-
-        # Transpose the contents first as we need to sort by row and not column (its stored in columns)
-        exportListContent = np.transpose(listToSort.content)
-
-        def compareFunction(item1, item2):
-            # If both have the same state and non empty presort indicator then they are from AUS but different spots
-            if item1[stateIdx] == item2[stateIdx] and item1[-1] != "" and item2[-1] != "":
-                if item1[-1] == item2[-1]:
-                    # If its in the psiMap it means item1/item2 may be postcode direct
-                    if item1[-1] in psiMap:
-                        # Within the same presort indicator, postcode directs are sorted first in order of postcodes
-                        # If both item1 and item2 are postcode direct then take the smallest one
-                        postMap = psiMap[item1[-1]]
-                        if item1[postcodeIdx] in postMap and item2[postcodeIdx] in postMap:
-                            return ExportList.__compareByIndex(item1, item2, postcodeIdx)
-                        # If only one of the two is in postcode direct then it gets sorted first
-                            # item 1 is postcode direct and item 2 is not so item 1 goes first
-                        elif item1[postcodeIdx] in postMap and item2[postcodeIdx] not in postMap:
-                            return 1
-                        # item 2 is postcode direct and item 1 is not
-                        elif item1[postcodeIdx] not in postMap and item2[postcodeIdx] in postMap:
-                            return -1
-
-                    # Otherwise just sort them based on postcode if they are both area direct or residue
-                    return ExportList.__compareByIndex(item1, item2, postcodeIdx)
-                # Same state, but different presort indicators
-                else:
-                    # If both of these aren't in the psiMap it means both are residue
-                    if item1[-1] not in psiMap and item2[-1] not in psiMap:
-                        # Compare by presort indicator and then by postcode to determine correct sort order
-                        comparePSI = ExportList.__compareByIndex(item1, item2, -1)
-                        if comparePSI == 0:
-                            return ExportList.__compareByIndex(item1, item2, postcodeIdx)
-
-                        return comparePSI
-                    # Item 2 is not in residue, but item 1 is. Non-residue is placed first
-                    elif item1[-1] not in psiMap and item2[-1] in psiMap:
-                        return -1
-                    # Item 1 is not in residue, but item 2 is. Non-residue is placed first
-                    elif item1[-1] in psiMap and item2[-1] not in psiMap:
-                        return 1
-                    # Both are not not residue so we should compare by presort indicator
-                    else:
-                        return ExportList.__compareByIndex(item1, item2, -1)
-
-            # If item1 is overseas it instantly gets ranked to bottom. Presort indicator == "" if other
-            if item1[-1] == "":
-                return -1
-
-            # If item2 is overseas it instantly gets ranked to bottom
-            if item2[-1] == "":
-                return 1
-
-            return ExportList.__compareByIndex(item1, item2, stateIdx)
-
-        listToSort.content = np.transpose(sorted(exportListContent, key=functools.cmp_to_key(compareFunction), 
-                                                 reverse=True))
-        return listToSort
+        keys = ExportList.__sortKeys(listToSort, psiMap)
+
+        # A stable sort keeps rows with the same key in the order they were given in
+        order = np.argsort(keys, kind="stable")
+
+        # Overseas rows have always been placed at the bottom in the reverse of the order they were given in. This is
+        # kept so exported lists don't change.
+        overseas = np.count_nonzero(keys == ExportList.OVERSEAS_KEY)
+        if overseas > 0:
+            order[-overseas:] = order[-overseas:][::-1]
+        return order
@@ -0,0 +1,200 @@
+import hashlib
+import os
+import tempfile
+import numpy as np
+from printpost.readprintpost import ReadPrintPost
+from .maillist import MailList
+from .columns import ColumnStore, MappedColumn, column_arrays, column_from_arrays
+from .maillistparser import MailListParser
+from .mappedmaillistparser import MappedMailListParser
+
+
+class ImportCache:
+    """
+        Keeps lists that have been read from files on disk so importing the same file again loads the columns instead
+        of reading the file. Entries are named by a hash of the file's contents, the options of the parser that read
+        it and the version of the sort plan the sort codes came from, so a change to any of them misses the cache.
+        Columns of memory mapped files are stored as where their values are in the file rather than the values, so
+        storing a list doesn't copy out the values of columns that won't be kept. The file has the same contents
+        whenever its entry is loaded so they are mapped from it again.
+    """
+    # Changed whenever the way lists are stored changes so older entries are no longer read
+    FORMAT_VERSION = 1
+    # Parser attributes that don't change what is read. How a database is connected to doesn't either, as its file
+    # is hashed.
+    IGNORED_OPTIONS = ["chunk_size", "chunk_bytes", "max_rows", "connect"]
+    # Most bytes the cache keeps by default before the entries used longest ago are removed
+    MAX_BYTES = 1 << 30
+
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def defaultDirectory():
+        return os.path.join(os.path.expanduser("~"), ".mailsort", "imports")
+
+    def key(self, file_path, parser):
+        """
+        :param file_path: string
+        :param parser: MailListParser, that reads the file
+        :return: string
+            The name of the file's entry in the cache
+        :raises OSError
+            If the file can't be read
+        """
+        digest = hashlib.sha256()
+        digest.update(self.contentHash(file_path).encode("utf-8"))
+
+        options = sorted((name, repr(value)) for name, value in vars(parser).items()
+                         if name not in ImportCache.IGNORED_OPTIONS)
+        digest.update(repr((type(parser).__name__, options, ReadPrintPost.get_instance().version,
+                            ImportCache.FORMAT_VERSION)).encode("utf-8"))
+        return digest.hexdigest()
+
+    def contentHash(self, file_path):
+        """
+        Hashes the contents of a file. The hash is kept with the file's size and modified time so a file that hasn't
+        changed since it was last hashed isn't read again.
+        :return: string
+        :raises OSError
+            If the file can't be read
+        """
+        stat = os.stat(file_path)
+        file_id = str(stat.st_size) + " " + str(stat.st_mtime_ns) + " "
+        memo_path = os.path.join(self.directory, hashlib.sha256(os.path.abspath(file_path).encode("utf-8"))
+                                 .hexdigest()[:32] + ".stat")
+        try:
+            with open(memo_path, "r") as file:
+                memo = file.read()
+            if memo.startswith(file_id):
+                return memo[len(file_id):]
+        except OSError:
+            pass
+
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        content_hash = digest.hexdigest()
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(handle, "w") as file:
+                file.write(file_id + content_hash)
+            os.replace(temp_path, memo_path)
+        except OSError:
+            # The file is only hashed again next time
+            pass
+        return content_hash
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def load(self, key, file_path):
+        """
+        :param key: string, from ImportCache.key
+        :param file_path: string, the file the key is of
+        :return: MailList or None if the list isn't in the cache
+        """
+        try:
+            with np.load(self.path(key), allow_pickle=False) as stored:
+                arrays = dict(stored)
+            # Marking the entry as used so it's removed after the ones that haven't been
+            os.utime(self.path(key))
+        except (OSError, ValueError):
+            return None
+
+        buffer = None
+        columns = []
+        for i in range(0, int(arrays["num_columns"])):
+            prefix = "c" + str(i) + "_"
+            column_data = {name[len(prefix):]: array for name, array in arrays.items() if name.startswith(prefix)}
+            if "starts" not in column_data:
+                columns.append(column_from_arrays(column_data))
+                continue
+
+            if buffer is None:
+                try:
+                    buffer = MappedMailListParser.mapFile(file_path)
+                except OSError:
+                    buffer = None
+                if buffer is None:
+                    return None
+            columns.append(MappedColumn(buffer, column_data["starts"], column_data["lengths"]))
+
+        # The same contents can be imported from a file with another name, which the list is named after
+        name = MailListParser.nameFromPath(file_path) + str(arrays["name_suffix"])
+
+        mail_list = MailList(arrays["headers"], ColumnStore(columns), name)
+        mail_list.address_columns = arrays["address_columns"]
+        if "sort_codes" in arrays:
+            mail_list.sort_codes = arrays["sort_codes"]
+            mail_list.state_codes = arrays["state_codes"]
+        return mail_list
+
+    def store(self, key, mail_list, file_path):
+        """
+        Saves a list to the cache. Failing to save only means the file is read again next time so errors are ignored.
+        :param key: string, from ImportCache.key
+        :param mail_list: MailList
+        :param file_path: string, the file the list was read from
+        """
+        # Only what the parser added after the file name is kept, e.g. the sheet of a workbook
+        name_suffix = mail_list.name[len(MailListParser.nameFromPath(file_path)):]
+        arrays = {"headers": mail_list.headers, "name_suffix": np.array(name_suffix),
+                  "address_columns": mail_list.address_columns, "num_columns": np.array(len(mail_list.content))}
+        if mail_list.sort_codes is not None:
+            arrays["sort_codes"] = mail_list.sort_codes
+            arrays["state_codes"] = mail_list.state_codes
+        for i, column in enumerate(mail_list.content):
+            if isinstance(column, MappedColumn):
+                column_data = {"starts": column.starts, "lengths": column.lengths}
+            else:
+                column_data = column_arrays(column)
+            for name, array in column_data.items():
+                arrays["c" + str(i) + "_" + name] = array
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Written to a temporary file first so another import never reads a half written entry
+            handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError:
+            return
+
+        try:
+            with os.fdopen(handle, "wb") as file:
+                np.savez(file, **arrays)
+            os.replace(temp_path, self.path(key))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the entries that were used longest ago until the cache is no bigger than max_bytes
+        """
+        entries = []
+        try:
+            for entry in os.scandir(self.directory):
+                # Files still being written by another import are left alone
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        except OSError:
+            return
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                # Another import may have removed it already
+                pass
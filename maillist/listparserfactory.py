@@ -1,17 +1,37 @@
-from .splitmaillistparser import SplitMailListParser
+from .mappedmaillistparser import MappedMailListParser
 from .excelmaillistparser import ExcelMailListParser
+from .arrowmaillistparser import ArrowMailListParser
+from .databasemaillistparser import DatabaseMailListParser
+from .dialect import FileDialect
 
 class ListParserFactory:
     def __init__(self):
         pass
 
     @staticmethod
-    def createMailList(file_type, include_headers, sheetNumber):
+    def createMailList(file_type, include_headers, sheetNumber, file_path=None):
+        """
+        :param file_type: string, the file type selected in the file dialog or the file's extension
+        :param include_headers: bool, or None to work out from the file whether its first row is headers
+        :param sheetNumber: string, the sheet to read from excel files
+        :param file_path: string, if given delimited files are sniffed for their encoding, delimiter and quotes
+        :return: MailListParser or None if the file type isn't supported
+        """
         parser = None
-        if file_type.find("txt") != -1:
-            parser = SplitMailListParser("\t", include_headers)
-        elif file_type.find("csv") != -1:
-            parser = SplitMailListParser(",", include_headers)
+        if file_type.find("txt") != -1 or file_type.find("csv") != -1:
+            delimiter = "\t" if file_type.find("txt") != -1 else ","
+            dialect = FileDialect.sniff(file_path, delimiter) if file_path is not None else FileDialect(delimiter)
+            if include_headers is None:
+                include_headers = dialect.has_header
+            parser = MappedMailListParser(dialect.delimiter, include_headers, encoding=dialect.encoding,
+                                          quotechar=dialect.quotechar)
         elif file_type.find("xlsx") != -1 or file_type.find("xls") != -1:
-            parser = ExcelMailListParser(include_headers, sheetNumber)
+            parser = ExcelMailListParser(True if include_headers is None else include_headers, sheetNumber)
+        elif file_type.find("parquet") != -1:
+            parser = ArrowMailListParser("parquet")
+        elif file_type.find("arrow") != -1 or file_type.find("feather") != -1:
+            parser = ArrowMailListParser("ipc")
+        elif file_type.find("sqlite") != -1 or file_type.find("db") != -1:
+            # The first table of the database is read
+            parser = DatabaseMailListParser()
         return parser
@@ -1,6 +1,15 @@
+import copy
+import hashlib
 import numpy as np
 import os
 from printpost.readprintpost import ReadPrintPost
+from .columns import ColumnStore, DictionaryColumn, column_arrays
+
+# Each state can be expressed as an abbreviation or their expanded form so must check both
+STATE_SYNONYMS = {"NSW": ["nsw", "new south wales"], "VIC": ["vic", "victoria"], "TAS": ["tas", "tasmania"],
+                  "WA": ["wa", "western australia"], "SA": ["sa", "south australia"],
+                  "NT": ["nt", "northern territory"], "QLD": ["qld", "queensland"],
+                  "ACT": ["act", "australian capital territory"]}
 
 
 class MailList:
@@ -12,20 +21,36 @@ class MailList:
         elif headers.dtype < np.dtype('U8'):
             headers = np.array(np.asarray(headers), dtype=np.dtype('U100'))
 
-        if isinstance(content, list):
-            content = np.array(content, dtype=np.dtype('U100'))
+        # Content is stored as compact columns, see maillist/columns.py
+        content = ColumnStore.from_values(content)
 
         self.headers = headers
         self.content = content
         self.name = name
         # ["country", "state", "postcode"]
         self.address_columns = np.full(3, -1)
-        self.num_records = content.shape[1] if len(self.content) > 0 else 0
+        self.num_records = content.num_records
         self.incorrect_states = None
+        # Indices into the compiled sort plan (see ReadPrintPost.compilePlan) for each record, -1 if there isn't one.
+        # These are kept beside the string content instead of being stacked onto it as extra string columns.
+        self.sort_codes = None
+        self.state_codes = None
+        # Index of the list each record came from when this list is made by joining lists together
+        self.source_ids = None
+        # Column the MS_State column goes before when the sort codes are added as columns, None for after the rest.
+        # Lists made by joining lists put it where the first list with sort codes had it, see ExportList.join.
+        self.state_column_position = None
+        # What has been worked out from the list's columns, see fingerprint and postcode_histogram. Each entry is kept
+        # with the objects it was worked out from so it's only used while they are still the list's. Snapshots share
+        # it, the entries are the same whichever list works them out.
+        self.cache = {}
 
     @staticmethod
     def subset(headers: list[str], mail_list: 'MailList', new_name="", new_headers=[]):
         """
+        The new list shares the columns of mail_list rather than copying them. Columns are never changed once made,
+        anything that changes one builds a new column in the list's own ColumnStore, so neither list can see the other
+        change. Only the headers are copied, so taking a subset costs the same however many records there are.
         :param headers: String[]
             A subset of column headers that should be extracted from the mail_list
         :param mail_list: MailList
@@ -44,50 +69,198 @@ class MailList:
             assert len(new_headers) == len(headers)
             column_names = np.array(new_headers)
 
-        indices = []
-        for header in headers:
-            where = np.where(mail_list.headers == header)
-            if len(where[0]) != 0:
-                # Column names should be unique so take the first instance of it occurring.
-                # Taking [0][0] because where returns a tuple of arrays for different dimensions
-                indices.append(where[0][0])
-
-        content = np.empty(shape=(len(headers), len(mail_list.content[0])), dtype=np.dtype('U100'))
+        # Column names should be unique so take the first instance of each. Built once rather than searching the
+        # headers again for every column kept.
+        positions = {}
+        for i, header in enumerate(mail_list.headers.tolist()):
+            positions.setdefault(header, i)
+        indices = [positions[header] for header in headers if header in positions]
 
-        for i in range(0, len(mail_list.content[0])):
-            for j in range(0, len(indices)):
-                content[j][i] = mail_list.content[indices[j]][i]
+        content = ColumnStore([mail_list.content[i] for i in indices])
 
         name = mail_list.name
         if new_name != "":
             name = new_name
 
-        return MailList(column_names, content, name)
+        new_list = MailList(column_names, content, name)
+        new_list.copy_record_state(mail_list, indices)
+        return new_list
+
+    @staticmethod
+    def renamed(mail_list: 'MailList', new_headers, new_name=""):
+        """
+        :param mail_list: MailList
+        :param new_headers: String[], a new name for every column
+        :param new_name: String
+            Optional parameter of a new name for the list
+        :return: MailList
+            A Mail List with the same columns, shared the same way as subset, under new names
+        """
+        assert len(new_headers) == len(mail_list.headers)
+        return MailList.subset(mail_list.headers.tolist(), mail_list, new_name, new_headers)
+
+    def copy_record_state(self, mail_list: 'MailList', indices):
+        """
+            Takes what was worked out for the records of mail_list, which this list has the columns indices of. Sort
+            codes are only kept if the postcode column is, and bad states only if the state column is as well.
+            :param mail_list: MailList
+            :param indices: int[], the column of mail_list each column of this list is
+        """
+        new_index = {old: new for new, old in enumerate(indices)}
+        self.address_columns = np.array([new_index.get(int(old), -1) for old in mail_list.address_columns])
+        self.source_ids = mail_list.source_ids
+
+        if mail_list.address_columns[-1] != -1 and self.address_columns[-1] != -1:
+            self.sort_codes = mail_list.sort_codes
+            self.state_codes = mail_list.state_codes
+            if mail_list.address_columns[1] != -1 and self.address_columns[1] != -1:
+                self.incorrect_states = mail_list.incorrect_states
+
+    def snapshot(self):
+        """
+            :return: MailList
+                A copy of the list that changes made to this list afterwards don't reach, e.g. for saving on another
+                thread. Columns are shared as they are never changed, and so are the code arrays as they are only
+                ever replaced.
+        """
+        snapshot = copy.copy(self)
+        snapshot.headers = self.headers.copy()
+        snapshot.content = ColumnStore(list(self.content.columns))
+        snapshot.address_columns = self.address_columns.copy()
+        if self.incorrect_states is not None:
+            snapshot.incorrect_states = list(self.incorrect_states)
+        return snapshot
+
+    def reorder(self, order):
+        """
+            Puts the records in the given order, along with their codes
+            :param order: np.ndarray of int, the record that goes in each position
+        """
+        self.content = self.content.take(order)
+        if self.sort_codes is not None:
+            self.sort_codes = self.sort_codes[order]
+            self.state_codes = self.state_codes[order]
+        if self.source_ids is not None:
+            self.source_ids = self.source_ids[order]
+
+    def fingerprint(self):
+        """
+            Identifies everything the sort codes, bad states and postcode histogram are worked out from: the sort plan,
+            which columns are the address fields and the values of the postcode and state columns. A saved workspace
+            keeps it beside those so they are only used while it still matches.
+            :return: string
+        """
+        key = self.__fingerprint_key()
+        cached = self.cache.get("fingerprint")
+        if cached is not None and cached[0][0] == key[0] and all(a is b for a, b in zip(cached[0][1:], key[1:])):
+            return cached[1]
+
+        digest = hashlib.sha256()
+        digest.update(str(ReadPrintPost.get_instance().version).encode("utf-8"))
+        digest.update(str(key[0]).encode("utf-8"))
+        for column in key[1:]:
+            if column is None:
+                digest.update(b"-")
+                continue
+            for name, array in sorted(column_arrays(column).items()):
+                digest.update(name.encode("utf-8"))
+                digest.update(np.ascontiguousarray(array.astype(str) if array.dtype.hasobject else array).tobytes())
+
+        fingerprint = digest.hexdigest()[:16]
+        self.cache["fingerprint"] = (key, fingerprint)
+        return fingerprint
+
+    def __fingerprint_key(self):
+        # The address fields and the state and postcode columns, which are compared by identity
+        columns = [self.content[i] if i != -1 else None for i in self.address_columns[1:]]
+        return (tuple(int(i) for i in self.address_columns), *columns)
+
+    def restore_derived(self, fingerprint, sort_codes, state_codes, histogram, incorrect_states):
+        """
+            Takes back what was worked out for the list before, e.g. from a saved workspace, so it isn't worked out
+            again. Everything given must have been worked out from the list's current columns.
+            :param fingerprint: string, what fingerprint gave then
+            :param sort_codes: np.ndarray
+            :param state_codes: np.ndarray
+            :param histogram: what postcode_histogram gave then
+            :param incorrect_states: list or None
+        """
+        self.sort_codes = sort_codes
+        self.state_codes = state_codes
+        self.incorrect_states = incorrect_states
+        self.cache["fingerprint"] = (self.__fingerprint_key(), fingerprint)
+        self.cache["histogram"] = ((sort_codes, self.content[self.address_columns[-1]]), histogram)
+
+    def postcode_histogram(self):
+        """
+            Counts the records of each presort indicator and postcode. Lists can be sorted from their histograms
+            without counting every record again, see PrintPostSort.organiseHistograms.
+            :return: (np.ndarray, np.ndarray)
+                presort indicator * 10000 + postcode of each pair in order and the number of records with it. Records
+                without a presort indicator aren't counted.
+        """
+        if self.sort_codes is None:
+            if self.address_columns[-1] == -1:
+                return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+            self.assign_sort_codes()
+
+        postcodes = self.content[self.address_columns[-1]]
+        key = (self.sort_codes, postcodes)
+        cached = self.cache.get("histogram")
+        if cached is not None and all(a is b for a, b in zip(cached[0], key)):
+            return cached[1]
+
+        # Sort codes are looked up from the postcodes, so every record with a presort indicator has a postcode
+        known = self.sort_codes >= 0
+        pairs = self.sort_codes[known].astype(np.int64) * 10000 + postcodes.fixed_width_digits(4)[known]
+        histogram = np.unique(pairs, return_counts=True)
+        self.cache["histogram"] = (key, histogram)
+        return histogram
+
+    def name_address_columns(self):
+        """
+            Renames the state and postcode columns "State" and "Postcode", the same as the import page does, so they
+            are matched with the same columns of other lists when lists are joined.
+        """
+        headers = self.headers.copy()
+        if self.address_columns[1] != -1:
+            headers[self.address_columns[1]] = "State"
+        if self.address_columns[-1] != -1:
+            headers[self.address_columns[-1]] = "Postcode"
+        self.headers = headers
 
     def assign_sort_codes(self):
         """
             Assigns sort codes to each entry based on the postcode along with a corresponding state to where that sort
             code belongs. This functions should be called after the postcode column has been identified.
         """
-        printPost = ReadPrintPost.get_instance()
-        postcode_to_plan = printPost.postcode_to_plan
-        plan_to_state = printPost.plan_to_state
-
-        self.headers = np.concatenate((self.headers, ["MS_State", "MS_SortCode"]))
-
         p_idx = self.address_columns[-1]
+        postcodes = self.content[p_idx].fixed_width_digits(4)
+        self.sort_codes, self.state_codes = ReadPrintPost.get_instance().lookup_codes(postcodes)
 
-        sort_codes = np.empty((1, len(self.content[p_idx])), dtype=np.dtype("U100"))
-        stateColumns = np.empty((1, len(self.content[p_idx])), dtype=np.dtype("U100"))
+    def with_sort_code_columns(self):
+        """
+            Builds the headers and content of the list with the sort codes added as the string columns MS_State and
+            MS_SortCode. Lists that never had sort codes assigned or already have the columns are returned as they are.
+            :return: (np.ndarray, ColumnStore)
+                headers and content
+        """
+        if self.sort_codes is None or "MS_SortCode" in self.headers:
+            return self.headers, self.content
 
-        for i in range(0, len(self.content[p_idx])):
-            if self.content[p_idx][i] in postcode_to_plan:
-                sort_codes[0][i] = postcode_to_plan[self.content[p_idx][i]]
-                stateColumns[0][i] = plan_to_state[sort_codes[0][i]]
-            else:
-                sort_codes[0][i] = ""
+        printPost = ReadPrintPost.get_instance()
+        position = len(self.headers) if self.state_column_position is None else self.state_column_position
+        headers = np.concatenate((self.headers[:position], ["MS_State"], self.headers[position:], ["MS_SortCode"]))
 
-        self.content = np.concatenate((self.content, stateColumns, sort_codes))
+        # The codes already index the plan's tables so they can be used as dictionary columns directly. A blank
+        # category is added to the end for the entries that have a code of -1.
+        states = np.append(printPost.states, "")
+        plans = np.append(printPost.plan_codes, "")
+        columns = list(self.content.columns)
+        columns.insert(position, DictionaryColumn(states, np.where(self.state_codes >= 0, self.state_codes,
+                                                                   len(states) - 1)))
+        columns.append(DictionaryColumn(plans, np.where(self.sort_codes >= 0, self.sort_codes, len(plans) - 1)))
+        return headers, ColumnStore(columns)
 
     def identify_bad_states(self):
         """
@@ -100,20 +273,29 @@ class MailList:
         if self.address_columns[1] == -1:
             return
 
-        plan_to_state = ReadPrintPost.get_instance().plan_to_state
+        if self.state_codes is None:
+            # Can't compare against the plan without knowing where the postcodes are
+            if self.address_columns[-1] == -1:
+                return
+            self.assign_sort_codes()
+
+        printPost = ReadPrintPost.get_instance()
         state_idx = self.address_columns[1]
-        self.incorrect_states = []
 
-        # Each state can be expressed as an abbreviation or their expanded form so must check both
-        synonyms = {"NSW": ["nsw", "new south wales"], "VIC": ["vic", "victoria"], "TAS": ["tas", "tasmania"],
-                    "WA": ["wa", "western australia"], "SA": ["sa", "south australia"],
-                    "NT": ["nt", "northern territory"], "QLD": ["qld", "queensland"],
-                    "ACT": ["act", "australian capital territory"]}
+        synonyms = STATE_SYNONYMS
+        checked_codes = [i for i, state in enumerate(printPost.states) if state in synonyms]
+
+        def to_state_codes(given_states):
+            # Converting the state column into the same state indices used by the sort plan so they can be compared
+            given_states = np.char.lower(given_states)
+            given_codes = np.full(len(given_states), -1, dtype=np.int8)
+            for i in checked_codes:
+                given_codes[np.isin(given_states, synonyms[printPost.states[i]])] = i
+            return given_codes
 
-        # Loop using last column as it is where the sort codes are stored
-        for i in range(0, len(self.content[-1])):
-            if self.content[-1][i] in plan_to_state:
-                print_post_state = plan_to_state[self.content[-1][i]]
+        given_codes = self.content[state_idx].transform(to_state_codes)
 
-                if print_post_state in synonyms and self.content[state_idx][i].lower() not in synonyms[print_post_state]:
-                    self.incorrect_states.append([i, print_post_state])
+        mismatched = np.isin(self.state_codes, checked_codes) & (given_codes != self.state_codes)
+        rows = np.nonzero(mismatched)[0]
+        self.incorrect_states = [[int(i), state] for i, state in
+                                 zip(rows, printPost.states[self.state_codes[rows]].tolist())]
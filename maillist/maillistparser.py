@@ -1,14 +1,184 @@
+import copy
+import ntpath
+import os
 from abc import ABC, abstractmethod
 import numpy as np
+from printpost.readprintpost import ReadPrintPost
+from .columns import ColumnBuilder
+from .compressed import COMPRESSED_EXTENSIONS
+from .maillist import STATE_SYNONYMS
+
+# Names of countries most often found in mail lists. Only needs to be enough to recognise a country column.
+COUNTRY_NAMES = ["australia", "aus", "au", "new zealand", "nz", "united kingdom", "uk", "england", "scotland",
+                 "wales", "ireland", "united states", "united states of america", "usa", "us", "canada", "singapore",
+                 "malaysia", "indonesia", "philippines", "thailand", "vietnam", "china", "hong kong", "japan",
+                 "korea", "south korea", "india", "sri lanka", "fiji", "papua new guinea", "png", "south africa",
+                 "germany", "france", "italy", "spain", "netherlands", "greece", "sweden", "switzerland"]
+
+
+class ListPreview:
+    """
+        The start of a file for the import page to show while the whole file is read.
+        mail_list: MailList of the first rows, with the headers and address fields of the whole file
+        estimated_records: int, roughly how many records the whole file has, None if it can't be estimated
+    """
+
+    def __init__(self, mail_list, estimated_records):
+        self.mail_list = mail_list
+        self.estimated_records = estimated_records
+
 
 class MailListParser(ABC):
+    # Whether the parser can read only some columns of a file, which are given as the headers in its columns attribute
+    SELECTS_COLUMNS = False
+
     def __init__(self, include_headers):
         self.include_headers = include_headers
+        # Stop reading after this many records, None reads every record
+        self.max_rows = None
 
     @abstractmethod
     def readList(self, file_path):
         pass
 
+    def readLists(self, file_path):
+        """
+        Reads every list in a file. Most files hold one list but archives can hold several.
+        :return: MailList[]
+        """
+        return [self.readList(file_path)]
+
+    def previewList(self, file_path, num_rows=100):
+        """
+        Reads only the first rows of a file so it can be shown before the whole file has been read.
+        :param file_path: string
+        :param num_rows: int, the most records to read
+        :return: ListPreview
+        """
+        # Reading with a copy so this parser can read the whole file at the same time
+        parser = copy.copy(self)
+        parser.max_rows = num_rows
+        mail_list = parser.readList(file_path)
+
+        if mail_list.num_records < num_rows:
+            # The whole file was read
+            return ListPreview(mail_list, mail_list.num_records)
+        return ListPreview(mail_list, self.estimateRecords(file_path))
+
+    def estimateRecords(self, file_path):
+        """
+        :return: int
+            Roughly how many records are in the file without reading all of it, None if it can't be estimated
+        """
+        return None
+
+    @staticmethod
+    def nameFromPath(file_path):
+        """
+        :param file_path: string, a file path or the name of a file in an archive
+        :return: string, the name of a list read from the file, which is the file name without its folders or extension
+        """
+        # Paths with \\ between folders are split too, so files chosen on Windows are named the same on every system
+        name, extension = os.path.splitext(ntpath.basename(file_path))
+        if extension.lower() in COMPRESSED_EXTENSIONS:
+            # list.csv.gz is named list like list.csv
+            name = os.path.splitext(name)[0]
+        return name
+
+    @staticmethod
+    def addChunk(columns, chunk):
+        """
+        Adds rows of values to the columns being built. Rows can have more or fewer values than there are columns,
+        missing values are left blank and extra values are given their own column.
+        :param columns: ColumnBuilder[]
+        :param chunk: String[][], rows of values
+        """
+        if len(chunk) == 0:
+            return
+
+        num_records = columns[0].num_records if len(columns) > 0 else 0
+        for _ in range(len(columns), max(len(row) for row in chunk)):
+            columns.append(ColumnBuilder(num_records))
+
+        for j, column in enumerate(columns):
+            column.append([row[j] if j < len(row) else "" for row in chunk])
+
+    @staticmethod
+    def identifyAddressColumns(mail_list, sample_size=2000, min_score=0.5):
+        """
+        Finds the country, state and postcode columns from the header names and what is in the columns
+        :param mail_list: MailList
+        :param sample_size: int, the most rows of each column looked at
+        :param min_score: float, the least score a column needs to be picked
+        :return: np.ndarray of int
+            The column for each of ["country", "state", "postcode"], -1 where no column scored well enough
+        """
+        ranked = MailListParser.rankAddressColumns(mail_list, sample_size)
+        address_columns = np.array([-1, -1, -1])
+
+        # Postcodes are the most distinctive so they're picked first and a column is only used for one field
+        for field in [2, 1, 0]:
+            for column, score in ranked[field]:
+                if score >= min_score and column not in address_columns:
+                    address_columns[field] = column
+                    break
+
+        return address_columns
+
+    @staticmethod
+    def rankAddressColumns(mail_list, sample_size=2000):
+        """
+        Scores how likely each column is to be each address field. A column scores the fraction of its sampled values
+        that look like the field, plus 1 if its header names the field. Only a fixed size sample of rows is looked at so
+        this takes the same time however long the list is.
+        :param mail_list: MailList
+        :param sample_size: int, the most rows of each column looked at
+        :return: (int, float)[][]
+            For each of ["country", "state", "postcode"] the columns and their scores, highest score first
+        """
+        printPost = ReadPrintPost.get_instance()
+        header_matches = MailListParser.matchHeaders(mail_list.headers)
+
+        # Rows spread evenly through the list so a sorted list doesn't give a sample of only one state
+        rows = np.unique(np.linspace(0, mail_list.num_records - 1, min(sample_size, mail_list.num_records))
+                         .astype(np.int64))
+        states = [synonym for synonyms in STATE_SYNONYMS.values() for synonym in synonyms]
+
+        ranked = [[], [], []]
+        for i, column in enumerate(mail_list.content):
+            sample = column.take(rows)
+            filled = sample.non_empty()
+            num_filled = max(int(np.count_nonzero(filled)), 1)
+
+            postcodes = sample.fixed_width_digits(4)
+            in_plan = (postcodes >= 0) & (printPost.postcode_table[np.maximum(postcodes, 0)] >= 0)
+            values = np.char.lower(np.char.strip(sample.to_numpy()))
+
+            scores = [np.count_nonzero(np.isin(values, COUNTRY_NAMES)) / num_filled,
+                      np.count_nonzero(np.isin(values, states)) / num_filled,
+                      np.count_nonzero(in_plan) / num_filled]
+
+            for field in range(0, 3):
+                ranked[field].append((i, float(scores[field]) + (1.0 if header_matches[i] == field else 0.0)))
+
+        return [sorted(field, key=lambda candidate: -candidate[1]) for field in ranked]
+
+    @staticmethod
+    def matchHeaders(column_names):
+        """
+        Loosely matches header names to address fields so names such as "Post Code 1" are still recognised
+        :return: int[]
+            The field from ["country", "state", "postcode"] each header names, -1 if it doesn't name one
+        """
+        field_names = [["country"], ["state"], ["postcode", "pcode", "postalcode"]]
+        matches = []
+        for name in column_names:
+            # Only comparing the letters so spaces, punctuation and numbering are ignored
+            letters = "".join(c for c in str(name).lower() if c.isalpha())
+            matches.append(next((j for j in range(0, len(field_names)) if letters in field_names[j]), -1))
+
+        return matches
+
     @staticmethod
     def identifyAddressField(column_names):
 
@@ -0,0 +1,225 @@
+import codecs
+import mmap
+import numpy as np
+from .splitmaillistparser import SplitMailListParser
+from .maillistparser import MailListParser
+from .maillist import MailList
+from .columns import MappedColumn
+from .compressed import compression
+
+# Bytes removed from either end of the last value of a line, the same as str.strip() for ASCII. The delimiter is
+# never removed as it separates blank values at the end of a line.
+WHITESPACE = np.array([b" "[0], b"\t"[0], b"\r"[0], b"\n"[0], b"\v"[0], b"\f"[0]], dtype=np.uint8)
+
+
+class MappedMailListParser(SplitMailListParser):
+    """
+        Reads delimited files by memory mapping them and finding the lines and values with numpy rather than Python.
+        Each column is kept as the position and length of its values in the mapped file so values are only copied out
+        once the list is added to the workspace, and only for the columns that were kept.
+        Files this can't read this way, those with quoted values or that aren't UTF-8, are read by SplitMailListParser.
+    """
+
+    def __init__(self, split_on_string, include_headers, chunk_bytes=1 << 26, encoding=None, quotechar='"'):
+        super(MappedMailListParser, self).__init__(split_on_string, include_headers, encoding=encoding,
+                                                   quotechar=quotechar)
+        # Size of the blocks the file is scanned in so the scan doesn't need memory proportional to the file
+        self.chunk_bytes = chunk_bytes
+
+    def readList(self, file_path):
+        if self.max_rows is not None or self.encoding not in [None, "utf-8", "utf-8-sig", "ascii"] or \
+                compression(file_path) is not None:
+            # Reading the first rows as a stream is quicker than scanning the whole mapped file, the mapped values are
+            # only ever decoded as UTF-8 and compressed files are decompressed as a stream
+            return super(MappedMailListParser, self).readList(file_path)
+
+        try:
+            buffer = self.mapFile(file_path)
+        except FileNotFoundError:
+            return MailList([], [], "")
+
+        if buffer is None or len(self.split_string) != 1 or not self.canMap(buffer):
+            return super(MappedMailListParser, self).readList(file_path)
+
+        headers, columns = self.mapColumns(buffer)
+        file_name = self.nameFromPath(file_path)
+
+        new_list = MailList(np.array(headers), columns, file_name)
+        new_list = self.remove_empty_columns(new_list)
+        new_list.address_columns = MailListParser.identifyAddressColumns(new_list)
+        return new_list
+
+    @staticmethod
+    def mapFile(file_path):
+        """
+        :param file_path: string
+        :return: np.ndarray of uint8 over the memory mapped file, None if the file is empty as those can't be mapped
+        :raises OSError
+            If the file can't be opened
+        """
+        with open(file_path, "rb") as file:
+            try:
+                mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return None
+        return np.frombuffer(mapping, dtype=np.uint8)
+
+    def canMap(self, buffer):
+        """
+        :param buffer: np.ndarray of uint8, the mapped file
+        :return: bool
+            True if the file has no quotes, only ends lines with \n or \r\n and is valid UTF-8
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        try:
+            for start in range(0, len(buffer), self.chunk_bytes):
+                chunk = buffer[start:start + self.chunk_bytes]
+                if self.quotechar is not None and np.any(chunk == ord(self.quotechar)):
+                    return False
+                # Lines are only found at \n, so files with old Mac line endings are left to the csv reader. The byte
+                # after a \r at the end of a chunk is in the next chunk so it's looked up in the whole buffer.
+                returns = np.flatnonzero(chunk == ord("\r")) + start + 1
+                returns = returns[returns < len(buffer)]
+                if np.any(buffer[returns] != ord("\n")):
+                    return False
+                # Only chunks with non ASCII bytes need decoding. A chunk without any ends on a whole character so the
+                # decoder never has part of one left over when a chunk is skipped.
+                if np.any(chunk >= 0x80):
+                    decoder.decode(chunk.tobytes())
+            decoder.decode(b"", final=True)
+        except UnicodeDecodeError:
+            return False
+
+        return True
+
+    def mapColumns(self, buffer):
+        """
+        Finds where every value of the file is
+        :param buffer: np.ndarray of uint8, the mapped file
+        :return: (string[], MappedColumn[])
+        """
+        delimiter = ord(self.split_string)
+        whitespace = WHITESPACE[WHITESPACE != delimiter]
+        position = 3 if buffer[:3].tobytes() == codecs.BOM_UTF8 else 0
+
+        headers = None
+        starts, lengths = [], []
+        num_records = 0
+
+        while position < len(buffer):
+            end = self.chunkEnd(buffer, position)
+            line_starts, line_ends = self.findLines(buffer, position, end, whitespace)
+            position = end
+
+            if headers is None and self.include_headers:
+                if len(line_starts) == 0:
+                    continue
+                line = buffer[line_starts[0]:line_ends[0]].tobytes().decode("utf-8")
+                headers = line.split(self.split_string)
+                line_starts, line_ends = line_starts[1:], line_ends[1:]
+
+            for column, (column_starts, column_lengths) in enumerate(self.findValues(buffer, line_starts, line_ends,
+                                                                                     delimiter, whitespace)):
+                # Columns first seen part way through the file are blank for the rows before
+                if column == len(starts):
+                    starts.append([np.zeros(num_records, dtype=np.int64)])
+                    lengths.append([np.zeros(num_records, dtype=np.int32)])
+                starts[column].append(column_starts)
+                lengths[column].append(column_lengths)
+
+            num_records += len(line_starts)
+            for column in range(0, len(starts)):
+                if sum(len(piece) for piece in starts[column]) < num_records:
+                    blank = num_records - sum(len(piece) for piece in starts[column])
+                    starts[column].append(np.zeros(blank, dtype=np.int64))
+                    lengths[column].append(np.zeros(blank, dtype=np.int32))
+
+        if headers is None:
+            headers = []
+        if len(headers) > 0:
+            headers[-1] = headers[-1].strip()
+        # Headers with no values under them still get a column
+        for _ in range(len(starts), len(headers)):
+            starts.append([np.zeros(num_records, dtype=np.int64)])
+            lengths.append([np.zeros(num_records, dtype=np.int32)])
+        headers = headers + ["Column " + str(i+1) for i in range(len(headers), len(starts))]
+
+        columns = [MappedColumn(buffer, np.concatenate(column_starts), np.concatenate(column_lengths))
+                   for column_starts, column_lengths in zip(starts, lengths)]
+        return headers, columns
+
+    def chunkEnd(self, buffer, position):
+        """
+        :return: int
+            The end of the next chunk from position, just after a newline so no line is split between chunks
+        """
+        end = position + self.chunk_bytes
+        while end < len(buffer):
+            newlines = np.flatnonzero(buffer[position:end] == ord("\n"))
+            if len(newlines) > 0:
+                return position + int(newlines[-1]) + 1
+            end += self.chunk_bytes
+
+        return len(buffer)
+
+    @staticmethod
+    def findLines(buffer, start, end, whitespace):
+        """
+        :return: (np.ndarray of int64, np.ndarray of int64)
+            The start and end of every line from start to end without trailing whitespace. Blank lines are left out.
+        """
+        newlines = np.flatnonzero(buffer[start:end] == ord("\n")).astype(np.int64) + start
+        line_starts = np.concatenate([[start], newlines + 1]).astype(np.int64)
+        line_ends = np.concatenate([newlines, [end]]).astype(np.int64)
+
+        # Stripping whitespace from the end of each line, one byte from every line at a time
+        stripping = line_ends > line_starts
+        while np.any(stripping):
+            stripping &= np.isin(buffer[np.where(stripping, line_ends - 1, 0)], whitespace)
+            line_ends[stripping] -= 1
+            stripping &= line_ends > line_starts
+
+        keep = line_ends > line_starts
+        return line_starts[keep], line_ends[keep]
+
+    @staticmethod
+    def findValues(buffer, line_starts, line_ends, delimiter, whitespace):
+        """
+        :return: generator of (np.ndarray of int64, np.ndarray of int32)
+            The start and length of the value in each line for each column in turn. Lines with fewer values are blank.
+        """
+        if len(line_starts) == 0:
+            return
+
+        start, end = int(line_starts[0]), int(line_ends[-1])
+        delimiters = np.flatnonzero(buffer[start:end] == delimiter).astype(np.int64) + start
+        # Only keeping delimiters that are inside the lines that were found
+        line_of = np.searchsorted(line_starts, delimiters, side="right") - 1
+        in_line = delimiters < line_ends[line_of]
+        delimiters, line_of = delimiters[in_line], line_of[in_line]
+
+        counts = np.bincount(line_of, minlength=len(line_starts))
+        first = np.zeros(len(line_starts), dtype=np.int64)
+        np.cumsum(counts[:-1], out=first[1:])
+
+        last = max(len(delimiters) - 1, 0)
+        for column in range(0, int(counts.max()) + 1):
+            has_value = counts >= column
+            is_last = counts == column
+
+            if column == 0:
+                value_starts = line_starts.copy()
+            else:
+                value_starts = np.where(has_value, delimiters[np.minimum(first + column - 1, last)] + 1, 0)
+            next_delimiter = delimiters[np.minimum(first + column, last)] if len(delimiters) > 0 else line_ends
+            value_ends = np.where(is_last, line_ends, np.where(has_value, next_delimiter, 0))
+
+            # The last value of a line also has whitespace stripped from its start
+            stripping = is_last & (value_ends > value_starts)
+            while np.any(stripping):
+                stripping &= np.isin(buffer[np.where(stripping, value_starts, 0)], whitespace)
+                value_starts[stripping] += 1
+                stripping &= value_ends > value_starts
+
+            value_starts = np.where(has_value, value_starts, 0)
+            yield value_starts, np.where(has_value, value_ends - value_starts, 0).astype(np.int32)
@@ -22,8 +22,38 @@
 from printpost.readprintpost import ReadPrintPost
 from .maillist import MailList
 from .exportlist import ExportList
+import hashlib
+import json
 import numpy as np
-import pandas as pd
+
+
+class SortResult:
+    """
+        The categories and export order of the last sort of a workspace's lists. It's kept with a fingerprint of
+        everything it was worked out from so sorting the same lists the same way again only has to put the records in
+        order, see Workspace.sortLists.
+    """
+
+    def __init__(self, fingerprint, categories, order):
+        """
+        :param fingerprint: string, from SortResult.fingerprint
+        :param categories: dict, from PrintPostSort.organiseCategories
+        :param order: np.ndarray of int64, the record of the joined lists that goes in each position of the export list
+        """
+        self.fingerprint = fingerprint
+        self.categories = categories
+        self.order = order
+
+    @staticmethod
+    def fingerprint(lists: list[MailList], weight, size, lodgement_state):
+        """
+        :return: string
+            Identifies the sort of the lists, in order, with the given article weight, size and lodgement state
+        """
+        inputs = [[mail_list.fingerprint(), [str(header) for header in mail_list.headers], int(mail_list.num_records)]
+                  for mail_list in lists]
+        data = json.dumps([inputs, weight, str(size).lower(), lodgement_state])
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
 
 
 class PrintPostSort:
@@ -35,43 +65,188 @@ class PrintPostSort:
         assert len(lists) > 0
 
         # Join the lists together
-        headers, combined_list = ExportList.join(lists)
+        preprocessedList = ExportList.join(lists)
+        preprocessedList.name = "Exported List"
+        preprocessedList.reorder(PrintPostSort.preprocessOrder(preprocessedList))
 
-        combined_list = np.transpose(combined_list)
+        return preprocessedList
 
-        df = pd.DataFrame(combined_list, columns=headers)
+    @staticmethod
+    def preprocessOrder(joined_list: MailList):
+        """
+        :param joined_list: MailList from ExportList.join
+        :return: np.ndarray, the order of the records sorted by presort indicator and then postcode
+        """
+        postcodes = joined_list.content[joined_list.address_columns[2]]
+        postcode_key = postcodes.fixed_width_digits(4).astype(np.int64)
 
-        combined_list = df.sort_values(['MS_SortCode', 'Postcode'], ascending=[True, True])
-        combined_list = np.transpose(combined_list.values)
+        # Entries without a presort indicator can have anything as a postcode so those are ordered by the string
+        unknown = joined_list.sort_codes == -1
+        if np.any(unknown):
+            postcode_key[unknown] = np.unique(postcodes[unknown].to_numpy(), return_inverse=True)[1]
 
-        preprocessedList = MailList(headers, combined_list, "Exported List")
+        # Sort by presort indicator and then postcode. Entries without a presort indicator come first like a blank
+        # string would. lexsort is stable so equal entries stay in the order they were joined in.
+        return np.lexsort((postcode_key, joined_list.sort_codes))
 
-        # Identifying address columns again for the lists after they've been all joined together
-        for i in range(0, len(headers)):
-            if headers[i] == "MS_State":
-                preprocessedList.address_columns[1] = i
-            elif headers[i] == "Postcode":
-                preprocessedList.address_columns[2] = i
+    @staticmethod
+    def sortLists(lists: list[MailList], weight: int, size, lodgement_state):
+        """
+        Joins, sorts and categorises the lists the same way as preprocessList, organiseCategories and createExportList
+        one after another.
+        :return: (SortResult, MailList)
+            the categories and order of the records, and the export list
+        """
+        fingerprint = SortResult.fingerprint(lists, weight, size, lodgement_state)
+        exportList = ExportList.join(lists)
+        exportList.name = "Exported List"
 
-        return preprocessedList
+        order = PrintPostSort.preprocessOrder(exportList)
+        exportList.reorder(order)
+
+        histograms = PrintPostSort.__sharedHistograms(lists, exportList)
+        if histograms is not None:
+            categories = PrintPostSort.organiseHistograms(histograms, exportList.num_records, weight, size,
+                                                          lodgement_state)
+        else:
+            categories = PrintPostSort.organiseCategories(exportList, weight, size, lodgement_state)
+
+        exportOrder = ExportList.exportOrder(exportList, categories)
+        exportList.reorder(exportOrder)
+        return SortResult(fingerprint, categories, order[exportOrder].astype(np.int64)), exportList
+
+    @staticmethod
+    def __sharedHistograms(lists: list[MailList], joined_list: MailList):
+        """
+        :return: the postcode histogram of each list, or None if the categories have to be counted from the joined list
+            because its postcode column isn't made of the postcode columns the lists were counted from
+        """
+        headers = list(joined_list.headers)
+        postcode_idx = headers.index("Postcode") if "Postcode" in headers else joined_list.address_columns[2]
+        if postcode_idx == -1:
+            return None
+
+        name = str(headers[postcode_idx]).lower()
+        for mail_list in lists:
+            if mail_list.address_columns[-1] == -1:
+                continue
+            list_headers = [str(header).lower() for header in mail_list.headers]
+            if list_headers[mail_list.address_columns[-1]] != name or list_headers.count(name) != 1:
+                return None
+
+        return [mail_list.postcode_histogram() for mail_list in lists]
 
     @staticmethod
     def organiseCategories(mail_list, weight: int, size, lodgement_state):
         assert 0 < weight <= 1000, "Weight must be in the range (0, 1000]"
 
-        df = pd.DataFrame(np.transpose(mail_list.content), columns=mail_list.headers)
-
         # If the article size is small than everything goes into residue
         if size.lower() == "small":
-            return PrintPostSort.__organise_small(df)
+            return PrintPostSort.__organise_small(mail_list)
 
         if size.lower() != "large":
             return False
 
-        return PrintPostSort.__organise_large(df, weight, lodgement_state)
+        return PrintPostSort.__organise_large(mail_list, weight, lodgement_state)
+
+    @staticmethod
+    def organiseHistograms(histograms, num_records, weight: int, size, lodgement_state):
+        """
+        Gives the same categories as organiseCategories for the sorted join of lists with the given postcode histograms,
+        without counting every record again.
+        :param histograms: list of the lists' MailList.postcode_histogram
+        :param num_records: int, the number of records in all the lists
+        """
+        assert 0 < weight <= 1000, "Weight must be in the range (0, 1000]"
+
+        if size.lower() not in ["small", "large"]:
+            return False
+
+        counts = PrintPostSort.__countHistograms(histograms, num_records)
+        if size.lower() == "small":
+            return PrintPostSort.__smallTotals(counts)
+
+        assert lodgement_state in PrintPostSort.VALID_STATES and lodgement_state.lower() != "other"
+        return PrintPostSort.__groupTotals(counts, weight, lodgement_state)
+
+    @staticmethod
+    def __countHistograms(histograms, num_records):
+        """
+        Adds postcode histograms together into the counts __countCategories gives for a sorted list, where presort
+        indicators and postcodes first appear in ascending order.
+        """
+        printPost = ReadPrintPost.get_instance()
+        pairs = np.concatenate([np.zeros(0, dtype=np.int64)] + [histogram[0] for histogram in histograms])
+        counts = np.concatenate([np.zeros(0, dtype=np.int64)] + [histogram[1] for histogram in histograms])
+
+        uniquePairs, inverse = np.unique(pairs, return_inverse=True)
+        pairCounts = np.bincount(inverse, weights=counts, minlength=len(uniquePairs)).astype(np.int64)
+        pairPsi = uniquePairs // 10000
+
+        psiCounts = np.bincount(pairPsi, weights=pairCounts, minlength=len(printPost.plan_codes)).astype(np.int64)
+        stateCounts = np.bincount(printPost.plan_state_table[pairPsi], weights=pairCounts,
+                                  minlength=len(printPost.states)).astype(np.int64)
+        uniquePsi = np.unique(pairPsi)
+
+        return {"stateCounts": stateCounts, "otherCount": num_records - int(np.sum(pairCounts)),
+                "psi": uniquePsi, "psiCounts": psiCounts[uniquePsi],
+                "pairPsi": pairPsi, "pairPostcodes": uniquePairs % 10000, "pairCounts": pairCounts}
+
+    @staticmethod
+    def __codeColumns(mail_list: MailList):
+        """
+        Retrieves the presort indicator and postcode of every entry as integer codes.
+        :param mail_list: MailList that either has sort codes assigned or has an MS_SortCode column
+        :return: (np.ndarray, np.ndarray) indices into the compiled plan's presort indicators and the postcodes as
+            integers. Both are -1 where the entry doesn't have one.
+        """
+        printPost = ReadPrintPost.get_instance()
+        headers = list(mail_list.headers)
+
+        if mail_list.sort_codes is not None:
+            psi = mail_list.sort_codes
+        else:
+            psi = mail_list.content[headers.index("MS_SortCode")].transform(printPost.encode_plans)
+
+        postcode_idx = headers.index("Postcode") if "Postcode" in headers else mail_list.address_columns[2]
+        return psi, mail_list.content[postcode_idx].fixed_width_digits(4)
+
+    @staticmethod
+    def __countCategories(psi, postcodes):
+        """
+        Counts the articles for each state, presort indicator and postcode in one pass over the integer codes.
+        Presort indicators and postcodes are given in the order they first appear in the list.
+        :param psi: presort indicator codes from __codeColumns
+        :param postcodes: postcode codes from __codeColumns
+        :return: dict with the keys:
+            stateCounts - np.ndarray of articles for each state of the compiled plan
+            otherCount - number of articles without a presort indicator
+            psi, psiCounts - presort indicator codes and the number of articles in each
+            pairPsi, pairPostcodes, pairCounts - presort indicator and postcode pairs and the number of articles in each
+        """
+        printPost = ReadPrintPost.get_instance()
+        known = psi >= 0
+        known_psi = psi[known].astype(np.int64)
+
+        psiCounts = np.bincount(known_psi, minlength=len(printPost.plan_codes))
+        stateCounts = np.bincount(printPost.plan_state_table[known_psi], minlength=len(printPost.states))
+
+        uniquePsi, firstPsi = np.unique(known_psi, return_index=True)
+        uniquePsi = uniquePsi[np.argsort(firstPsi)]
+
+        # Articles with a presort indicator always have a postcode from the plan unless the codes were given directly
+        pairs = known_psi * 10000 + postcodes[known]
+        pairs = pairs[postcodes[known] >= 0]
+        uniquePairs, firstPair, pairCounts = np.unique(pairs, return_index=True, return_counts=True)
+        pairOrder = np.argsort(firstPair)
+        uniquePairs, pairCounts = uniquePairs[pairOrder], pairCounts[pairOrder]
+
+        return {"stateCounts": stateCounts, "otherCount": len(psi) - len(known_psi),
+                "psi": uniquePsi, "psiCounts": psiCounts[uniquePsi],
+                "pairPsi": uniquePairs // 10000, "pairPostcodes": uniquePairs % 10000, "pairCounts": pairCounts}
 
     @staticmethod
-    def __organise_large(mail_list: pd.DataFrame, weight: int, lodgement_state: str):
+    def __organise_large(mail_list: MailList, weight: int, lodgement_state: str):
         """
         Organise the list for each state into residue, area direct, and postcode direct
         :param mail_list: the list to organise
@@ -81,131 +256,100 @@ class PrintPostSort:
         """
         assert lodgement_state in PrintPostSort.VALID_STATES and lodgement_state.lower() != "other"
 
-        stateCounts = {}
-        for state in PrintPostSort.VALID_STATES:
-            """
-            Each state will hold a dictionary with two keys: count, areaCounts
-            areaCount contains a dictionary where each key is a presort indicator.
-            The value will be a dictionary with two keys: count, postcodeCounts
-            Postcode count will hold a key for the postcode and a value for total number of postcodes 
-            """
-            stateCounts[state] = {"count": 0, "areaCounts": {}}
-
-        indicator_to_state = ReadPrintPost.get_instance().plan_to_state
-        for i in range(0, len(mail_list["Postcode"])):
-            presort_indicator, postcode = mail_list['MS_SortCode'][i], mail_list['Postcode'][i]
-            if presort_indicator in indicator_to_state:
-                state = indicator_to_state[presort_indicator]
-
-                stateCounts[state]["count"] += 1
-
-                # Adding one to the count of that presort indicator
-                if presort_indicator in stateCounts[state]["areaCounts"]:
-                    stateCounts[state]["areaCounts"][presort_indicator]["count"] += 1
-                # Adding the presort indicator to the data structure if it doesn't exist
-                else:
-                    stateCounts[state]["areaCounts"][presort_indicator] = {"count": 1, "postcodeCounts": {}}
-
-                # Adding one to the count of that postcode
-                if postcode in stateCounts[state]["areaCounts"][presort_indicator]["postcodeCounts"]:
-                    stateCounts[state]["areaCounts"][presort_indicator]["postcodeCounts"][postcode] += 1
-                # Adding the postcode to the data structure if it doesn't exist
-                else:
-                    stateCounts[state]["areaCounts"][presort_indicator]["postcodeCounts"][postcode] = 1
-            # If we can't identify the presort indicator then it's Other
-            else:
-                stateCounts["Other"]["count"] += 1
-
-        return PrintPostSort.__groupTotals(stateCounts, weight, lodgement_state)
+        counts = PrintPostSort.__countCategories(*PrintPostSort.__codeColumns(mail_list))
+        return PrintPostSort.__groupTotals(counts, weight, lodgement_state)
 
     @staticmethod
-    def __groupTotals(stateCounts, weight, lodgement_state):
+    def __groupTotals(counts, weight, lodgement_state):
         """
         Groups the totals calculated
-        :param stateCounts: __organise_large describes it
+        :param counts: __countCategories describes it
         :param weight: weight per article
         :param lodgement_state: the state that the mail is being lodged in (must be a valid Australian state)
         """
+        printPost = ReadPrintPost.get_instance()
         sortDivisions = {}
         for state in PrintPostSort.VALID_STATES:
             sortDivisions[state] = []
 
         areaQuantity = 50 if weight <= 250 else (25 if weight <= 500 else 15)
         postcodeQuantity = 30 if weight <= 250 else (15 if weight <= 500 else 10)
+
+        psiStates = printPost.plan_state_table[counts["psi"]]
+        # Only the postcodes that meet the minimum can be postcode direct
+        qualified = counts["pairCounts"] >= postcodeQuantity
+
         for state in sortDivisions.keys():
-            # Postcode Direct is only valid in the lodgement state
+            if state not in printPost.states:
+                # Articles that aren't in any state of the plan can only be residue
+                if state == "Other" and counts["otherCount"] > 0:
+                    sortDivisions[state].append(["Residue", "", int(counts["otherCount"])])
+                continue
+
+            stateCode = np.searchsorted(printPost.states, state)
+            inState = psiStates == stateCode
             # Check if any presort indicator meets area direct minimum quantities
             totalAreaDirect = 0
 
-            if state == lodgement_state:
-                for psi in stateCounts[state]["areaCounts"]:
-                    qualifiedPostcodes = []
-                    postcodeCount = 0
-                    for postcode, value in stateCounts[state]["areaCounts"][psi]["postcodeCounts"].items():
-
-                        if value >= postcodeQuantity:
-                            qualifiedPostcodes.append([postcode, value])
-                            postcodeCount += value
+            for psi, psiCount in zip(counts["psi"][inState], counts["psiCounts"][inState]):
+                psiName = str(printPost.plan_codes[psi])
 
-                    areaDirectQuantity = stateCounts[state]["areaCounts"][psi]["count"] - postcodeCount
+                # Postcode Direct is only valid in the lodgement state
+                if state == lodgement_state:
+                    inPsi = qualified & (counts["pairPsi"] == psi)
+                    qualifiedPostcodes = [["%04d" % postcode, int(count)] for postcode, count in
+                                          zip(counts["pairPostcodes"][inPsi], counts["pairCounts"][inPsi])]
+                    postcodeCount = int(np.sum(counts["pairCounts"][inPsi]))
+                else:
+                    qualifiedPostcodes, postcodeCount = [], 0
 
-                    totalAreaDirect += postcodeCount
+                areaDirectQuantity = int(psiCount) - postcodeCount
+                totalAreaDirect += postcodeCount
 
-                    if len(qualifiedPostcodes) > 0:
-                        sortDivisions[state].append(["Postcode", psi, qualifiedPostcodes])
-                        if areaDirectQuantity > 0:
-                            sortDivisions[state].append(["Area", psi, areaDirectQuantity])
-                            totalAreaDirect += areaDirectQuantity
-                    # If none are postcode direct then check there's enough in the psi to make area direct
-                    elif areaDirectQuantity >= areaQuantity:
-                        sortDivisions[state].append(["Area", psi, areaDirectQuantity])
+                if len(qualifiedPostcodes) > 0:
+                    sortDivisions[state].append(["Postcode", psiName, qualifiedPostcodes])
+                    if areaDirectQuantity > 0:
+                        sortDivisions[state].append(["Area", psiName, areaDirectQuantity])
                         totalAreaDirect += areaDirectQuantity
-            else:
-                for psi, value in stateCounts[state]["areaCounts"].items():
-                    value = value["count"]  # Extracting count attribute from it as we don't care about postcode counts
-                    if value >= areaQuantity:
-                        totalAreaDirect += value
-                        sortDivisions[state].append(["Area", psi, value])
+                # If none are postcode direct then check there's enough in the psi to make area direct
+                elif areaDirectQuantity >= areaQuantity:
+                    sortDivisions[state].append(["Area", psiName, areaDirectQuantity])
+                    totalAreaDirect += areaDirectQuantity
 
             # Add anything leftover to residue
-            stateResidue = stateCounts[state]["count"] - totalAreaDirect
+            stateResidue = int(counts["stateCounts"][stateCode]) - totalAreaDirect
             if stateResidue > 0:
                 sortDivisions[state].append(["Residue", "", stateResidue])
 
         return sortDivisions
 
     @staticmethod
-    def __organise_small(mail_list):
+    def __organise_small(mail_list: MailList):
         """
         Counts the number of articles going into each state (including Other i.e. articles not going inside Australia).
-        :param mail_list: MailList that must have the MS_SortCode Column
+        :param mail_list: MailList that must have sort codes or the MS_SortCode Column
         :return: Returns a dictionary with keys in VALID_STATES. Values are either an empty list if there's no articles
                  going to that state or a list inside a list that describes the number of articles for that state i.e.
                  [["Residue", "", numberOfArticles]]
         """
+        counts = PrintPostSort.__countCategories(*PrintPostSort.__codeColumns(mail_list))
+        return PrintPostSort.__smallTotals(counts)
+
+    @staticmethod
+    def __smallTotals(counts):
+        """
+        Puts every article of each state into residue
+        :param counts: __countCategories describes it
+        """
+        printPost = ReadPrintPost.get_instance()
         sort_divisions = {}
         for state in PrintPostSort.VALID_STATES:
-            sort_divisions[state] = [["Residue", "", 0]]
-
-        i = 0
-        indicator_to_state = ReadPrintPost.get_instance().plan_to_state
-
-        while i < len(mail_list["MS_SortCode"]):
-            presort_indicator = mail_list['MS_SortCode'][i]
-            indicator_count = 1
-            i += 1
-            while i < len(mail_list["MS_SortCode"]) and mail_list["MS_SortCode"][i] == presort_indicator:
-                indicator_count += 1
-                i += 1
-
-            if presort_indicator not in indicator_to_state:
-                sort_divisions["Other"][0][2] += indicator_count
+            if state in printPost.states:
+                total = int(counts["stateCounts"][np.searchsorted(printPost.states, state)])
             else:
-                sort_divisions[indicator_to_state[presort_indicator]][0][2] += indicator_count
+                total = int(counts["otherCount"]) if state == "Other" else 0
 
-        for key in sort_divisions.keys():
-            # If there's no residue values then pop it so we aren't dealing with categories that have no values
-            if sort_divisions[key][0][2] == 0:
-                sort_divisions[key].pop()
+            # If there's no residue values then leave it empty so we aren't dealing with categories that have no values
+            sort_divisions[state] = [["Residue", "", total]] if total > 0 else []
 
         return sort_divisions
@@ -1,66 +1,153 @@
+import copy
+import csv
+import os
+import zipfile
 from .maillistparser import MailListParser
 import numpy as np
 from .maillist import MailList
+from .columns import ColumnBuilder
+from .compressed import archiveMembers, compression, openText
+from .dialect import FileDialect
 
 
 class SplitMailListParser(MailListParser):
-    def __init__(self, split_on_string, include_headers):
+    def __init__(self, split_on_string, include_headers, chunk_size=10000, encoding=None, quotechar='"'):
         super(SplitMailListParser, self).__init__(include_headers)
         self.split_string = split_on_string
+        # Encoding of the file, None for the platform's default. See FileDialect.sniff for working these out.
+        self.encoding = encoding
+        self.quotechar = quotechar
+        # Number of rows held as Python strings at once before they are added to the columns
+        self.chunk_size = chunk_size
 
-    # TODO: error handling when a line has more columns than headers
     def readList(self, file_path):
+        return self.readMember(file_path)
+
+    def readLists(self, file_path):
+        """
+        Reads each file in a zip archive as its own list
+        :param file_path: string
+        :return: MailList[]
+        """
+        members = archiveMembers(file_path)
+        if len(members) == 0:
+            return [self.readList(file_path)]
+
+        mail_lists = []
+        for member in members:
+            # Files in an archive can be written differently so each is sniffed on its own
+            dialect = FileDialect.sniff(file_path, self.split_string, member=member)
+            parser = copy.copy(self)
+            parser.split_string, parser.encoding, parser.quotechar = \
+                dialect.delimiter, dialect.encoding, dialect.quotechar
+            mail_lists.append(parser.readMember(file_path, member))
+
+        return mail_lists
+
+    def readMember(self, file_path, member=None):
+        """
+        Reads a file as a stream, decompressing it if it's compressed
+        :param file_path: string
+        :param member: string, the file to read if file_path is a zip archive, the first file if None
+        :return: MailList
+        """
         try:
-            file_contents = []
-            with open(file_path, "r") as file:
-                for line in file:
-                    if line.strip() != "":
-                        file_contents.append(line.split(self.split_string))
-                        file_contents[-1][-1] = file_contents[-1][-1].strip()
-
-            if self.include_headers:
-                headers = file_contents[0]
-                file_contents = file_contents[1:]
-            else:
-                headers = ["Column " + str(i+1) for i in range(0, len(file_contents[0]))]
-
-            file_name = file_path.split("\\")[-1].split(".")[0]
-            file_contents = np.array(file_contents)
-            file_contents = np.transpose(file_contents)
-
-            new_list = MailList(np.array(headers), file_contents, file_name)
-            new_list.address_columns = MailListParser.identifyAddressField(new_list.headers)
-            return self.remove_empty_columns(new_list)
-
-        except FileNotFoundError:
+            with openText(file_path, self.encoding, member) as file:
+                rows = csv.reader(file, delimiter=self.split_string, quotechar=self.quotechar)
+                headers, columns = self.readColumns(rows)
+
+            file_name = self.nameFromPath(member if member is not None else file_path)
+
+            new_list = MailList(np.array(headers), [column.build() for column in columns], file_name)
+            column_has_data = np.array([column.has_data for column in columns], dtype=bool)
+            new_list = self.remove_empty_columns(new_list, column_has_data)
+            new_list.address_columns = MailListParser.identifyAddressColumns(new_list)
+            return new_list
+
+        except (FileNotFoundError, KeyError, EOFError, zipfile.BadZipFile):
             return MailList([], [], "")
 
-    def remove_empty_columns(self, mail_list: MailList):
+    def estimateRecords(self, file_path, sample_bytes=1 << 20):
+        """
+        Estimates the number of records from the number of lines at the start of the file
+        """
+        if compression(file_path) is not None:
+            # The size of a compressed file says little about how many lines it has
+            return None
+
+        try:
+            file_size = os.path.getsize(file_path)
+            with open(file_path, "rb") as file:
+                sample = file.read(sample_bytes)
+        except OSError:
+            return None
+
+        lines = sample.count(b"\n") + (0 if sample.endswith(b"\n") or len(sample) < file_size else 1)
+        if len(sample) == 0:
+            return 0
+
+        records = lines if len(sample) == file_size else round(lines * file_size / len(sample))
+        return max(records - (1 if self.include_headers else 0), 0)
+
+    def readColumns(self, rows):
+        """
+        Reads rows into columns a chunk at a time. Rows can have more or fewer values than the headers, missing values
+        are left blank and extra values are given their own column.
+        :param rows: iterable of string lists, e.g. a csv.reader
+        :return: (string[], ColumnBuilder[])
+            The headers and a builder for each column
+        """
+        headers = None
+        columns = []
+        chunk = []
+        num_records = 0
+
+        for row in rows:
+            # Skip blank lines
+            if len(row) == 0 or (len(row) == 1 and row[0].strip() == ""):
+                continue
+            row[-1] = row[-1].strip()
+
+            if headers is None and self.include_headers:
+                headers = row
+                columns = [ColumnBuilder() for _ in row]
+                continue
+
+            chunk.append(row)
+            num_records += 1
+            if len(chunk) >= self.chunk_size:
+                self.addChunk(columns, chunk)
+                chunk = []
+
+            if self.max_rows is not None and num_records >= self.max_rows:
+                break
+
+        self.addChunk(columns, chunk)
+
+        if headers is None:
+            headers = []
+        headers = headers + ["Column " + str(i+1) for i in range(len(headers), len(columns))]
+        return headers, columns
+
+    def remove_empty_columns(self, mail_list: MailList, column_has_data=None):
         """
             Remove any trailing columns that contain no data and appear due to formatting of the imported file. Strip
             can't be used on each line as it's impossible to tell while reading in line by line if a later line
             contains information in a column that another line may be blank at.
             :param: mail_list
                 list to remove trailing columns
+            :param: column_has_data
+                np.ndarray of bool, whether each column has any data. Parsers that track this while reading pass it in
+                so the columns don't need to be scanned again.
             :return: MailList
         """
-        trailing_column = True
-        current_column = len(mail_list.headers)-1
-        cut_point = None
-
-        while trailing_column and current_column >= 0:
-            # Check each row of the column to see if they are all blank
-            for i in range(0, len(mail_list.content[current_column])):
-                if mail_list.content[current_column][i] != "":
-                    trailing_column = False
-                    break
-
-            # If a trailing column then set cut point as that column onwards
-            if trailing_column:
-                cut_point = current_column
-                current_column -= 1
-
-        if cut_point is None:
+        if column_has_data is None:
+            column_has_data = np.array([np.any(column.non_empty()) for column in mail_list.content], dtype=bool)
+
+        filled = np.nonzero(column_has_data)[0]
+        cut_point = filled[-1] + 1 if len(filled) > 0 else 0
+
+        if cut_point == len(mail_list.headers):
             return mail_list
 
         new_list = MailList(mail_list.headers[0:cut_point], mail_list.content[0:cut_point], mail_list.name)
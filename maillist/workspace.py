@@ -1,5 +1,96 @@
+import copy
+import os
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from maillist.listparserfactory import ListParserFactory
+from maillist.compressed import archiveMembers, innerFileType
+from maillist.databasemaillistparser import ConnectionPool
+from maillist.exportlist import ExportList
+from maillist.sort import PrintPostSort, SortResult
+
+
+class ImportResult:
+    """
+        The outcome of importing one file with Workspace.importMailLists. mail_list is None and error describes what
+        went wrong if the file couldn't be imported.
+    """
+
+    def __init__(self, file_path, mail_list=None, error=""):
+        self.file_path = file_path
+        self.mail_list = mail_list
+        self.error = error
+
+    @property
+    def succeeded(self):
+        return self.mail_list is not None
+
+
+def loadMailList(parser, file_path, import_cache=None):
+    """
+    Reads a whole file and assigns sort codes if a postcode column was found. If import_cache is given the list is
+    loaded from it when the same file has been read before, otherwise it's saved there once read.
+    :param parser: MailListParser
+    :param file_path: string
+    :param import_cache: ImportCache or None
+    :return: MailList
+    """
+    key = None
+    if import_cache is not None:
+        try:
+            key = import_cache.key(file_path, parser)
+        except OSError:
+            # The parser reports files that can't be read
+            key = None
+        mail_list = import_cache.load(key, file_path) if key is not None else None
+        if mail_list is not None:
+            return mail_list
+
+    mail_list = parser.readList(file_path)
+    if mail_list.address_columns[-1] != -1:
+        mail_list.assign_sort_codes()
+
+    if key is not None and mail_list.num_records > 0:
+        import_cache.store(key, mail_list, file_path)
+    return mail_list
+
+
+def closingConnections(function, *args):
+    """
+    Calls function and then closes the database connections it opened on this thread. Connections are shared by the
+    reads of one import or preview but aren't kept open by threads that have finished with them.
+    """
+    try:
+        return function(*args)
+    finally:
+        ConnectionPool.get_instance().closeThread()
+
+
+def readMailLists(file_path, file_type, include_headers, sheetNum, import_cache=None):
+    """
+    Reads and prepares the mail lists in a file the same way the import page does. Kept at module level so it can be
+    run in a worker process by Workspace.importMailLists.
+    :return: MailList[], one for each file in a zip archive, or None if the file type isn't supported
+    """
+    parser = ListParserFactory.createMailList(file_type, include_headers, sheetNum, file_path)
+    if parser is None:
+        return None
+
+    if len(archiveMembers(file_path)) > 1:
+        mail_lists = parser.readLists(file_path)
+        for mail_list in mail_lists:
+            if mail_list.address_columns[-1] != -1:
+                mail_list.assign_sort_codes()
+    else:
+        mail_lists = [loadMailList(parser, file_path, import_cache)]
+
+    for mail_list in mail_lists:
+        # Named the same as the import page names them so they're joined with other lists' columns, whether they
+        # came from their own file or from an archive
+        mail_list.name_address_columns()
+        mail_list.identify_bad_states()
+        # The values are copied out of any mapped file so only compact buffers are sent back to the workspace
+        mail_list.content = mail_list.content.compact()
+    return mail_lists
 
 
 class Workspace(ABC):
@@ -8,16 +99,26 @@ class Workspace(ABC):
         self.path = ""
         self.name = ""
         self.pending_list = None
+        # Future of the whole file being read while the import page shows a preview, see previewMailList
+        self.pending_import = None
+        # (MailListParser, file path) of a file that is read once the columns to keep are known, see attachImport
+        self.pending_read = None
         self.export_list = None
+        # SortResult of the last sort, kept so the same sort doesn't have to be worked out again
+        self.sort_result = None
         self.labels = None
+        # ImportCache that files are loaded from when they have been imported before, None to always read them
+        self.import_cache = None
+        # AutoSaver that saves changes on another thread, None to save them straight away
+        self.autosaver = None
 
     def createMailList(self, file_path, file_type, include_headers, sheetNum):
-        parser = ListParserFactory.createMailList(file_type, include_headers, sheetNum)
+        parser = ListParserFactory.createMailList(file_type, include_headers, sheetNum, file_path)
 
         if parser is None:
             return False
 
-        read_file = parser.readList(file_path)
+        read_file = closingConnections(loadMailList, parser, file_path, self.import_cache)
 
         if read_file.num_records == 0:
             return False
@@ -25,15 +126,210 @@ class Workspace(ABC):
         self.pending_list = read_file
         return True
 
+    def previewMailList(self, file_path, file_type, include_headers, sheetNum, num_rows=100):
+        """
+        Reads the first rows of a file into pending_list so the import page can be shown straight away, and carries
+        on reading the whole file in the background. attachImport swaps in the whole list once it's needed. Files
+        whose parser can read only some columns are left until then so only the columns that are kept are read.
+        :return: ListPreview or None if the file couldn't be read
+        """
+        parser = ListParserFactory.createMailList(file_type, include_headers, sheetNum, file_path)
+
+        if parser is None:
+            return None
+
+        preview = closingConnections(parser.previewList, file_path, num_rows)
+
+        if preview.mail_list.num_records == 0:
+            return None
+
+        self.pending_list = preview.mail_list
+        self.pending_import = None
+        self.pending_read = None
+        if preview.mail_list.num_records >= num_rows and parser.SELECTS_COLUMNS:
+            self.pending_read = (parser, file_path)
+        elif preview.mail_list.num_records >= num_rows:
+            executor = ThreadPoolExecutor(max_workers=1)
+            self.pending_import = executor.submit(closingConnections, loadMailList, parser, file_path,
+                                                  self.import_cache)
+            # The thread finishes reading on its own, nothing else is given to it
+            executor.shutdown(wait=False)
+
+        return preview
+
+    def attachImport(self, columns=None):
+        """
+        Waits for the file started by previewMailList to be read and makes the whole list the pending list.
+        :param columns: String[], the headers of the columns that will be kept, None if they all are. Files whose
+            parser can read only some columns are read now with just these.
+        :return: bool
+            False if the whole file couldn't be read
+        """
+        if self.pending_read is not None:
+            (parser, file_path), self.pending_read = self.pending_read, None
+            # A copy so the preview's parser is left as it was
+            parser = copy.copy(parser)
+            parser.columns = None if columns is None else [str(column) for column in columns]
+
+            def read():
+                return closingConnections(loadMailList, parser, file_path, self.import_cache)
+        elif self.pending_import is not None:
+            future, self.pending_import = self.pending_import, None
+            read = future.result
+        else:
+            # The preview was already the whole file
+            return self.pending_list is not None
+
+        try:
+            mail_list = read()
+        except Exception:
+            # Each parser fails in its own way, e.g. csv.Error or zipfile.BadZipFile, and any of them means the file
+            # can't be imported
+            return False
+
+        if mail_list.num_records == 0:
+            return False
+
+        self.pending_list = mail_list
+        return True
+
+    def importMailLists(self, file_paths, include_headers, sheetNum="", max_workers=None):
+        """
+        Imports many files at once. Each file is read in its own process and has its address fields and sort codes
+        identified there. The lists that are read are added to the workspace in the order of file_paths.
+        :param file_paths: String[]
+            The absolute path of each file. The file type is taken from the extension, or from the extension of the
+            file inside if it is compressed. Each file in a zip archive is imported as its own list.
+        :param include_headers: bool
+            Whether the first row of each file is headers, None to work it out for each file
+        :param sheetNum: String
+            Sheet to read from excel files, the first sheet if blank
+        :param max_workers: int
+            Most processes to read with at once, defaults to the number of processors
+        :return: ImportResult[]
+            The result of each list in the order of file_paths
+        """
+        jobs = [(file_path, innerFileType(file_path), include_headers, sheetNum, self.import_cache)
+                for file_path in file_paths]
+        max_workers = min(len(jobs), max_workers or os.cpu_count() or 1)
+
+        if max_workers <= 1:
+            # Not worth starting a process for a single file
+            outcomes = [self.__readJob(closingConnections, (readMailLists,) + job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(closingConnections, readMailLists, *job) for job in jobs]
+                outcomes = [self.__readJob(future.result, ()) for future in futures]
+
+        results = []
+        for (file_path, *_), (mail_lists, error) in zip(jobs, outcomes):
+            if error == "" and mail_lists is None:
+                error = "The file type is not supported"
+
+            if error != "":
+                results.append(ImportResult(file_path, error=error))
+                continue
+
+            # Archives give a result for each file in them
+            for mail_list in mail_lists:
+                if mail_list.num_records == 0:
+                    results.append(ImportResult(file_path, error="No records were read from the file"))
+                else:
+                    self.lists.append(mail_list)
+                    results.append(ImportResult(file_path, mail_list))
+
+        if any(result.succeeded for result in results):
+            # New lists need to be sorted with the rest
+            self.export_list = None
+            self.changed()
+
+        return results
+
+    @staticmethod
+    def __readJob(function, args):
+        """
+        :return: (MailList, String)
+            What the function returned and an empty string, or None and the error if it raised one
+        """
+        try:
+            return function(*args), ""
+        except Exception as e:
+            return None, str(e) or type(e).__name__
+
     def addMailList(self):
+        # Copying the values of the kept columns out of the imported file, see Column.compact
+        self.pending_list.content = self.pending_list.content.compact()
         self.lists.append(self.pending_list)
         self.pending_list = None
 
     def removeMailList(self, list_idx):
         self.lists.pop(list_idx)
-        if self.path != "":
+        self.changed()
+
+    def sortLists(self, weight, size, lodgement_state):
+        """
+        Sorts the lists into export_list. If they were last sorted the same way and haven't changed since, the records
+        are only put back in the order that was worked out then. A new sort is saved with the workspace.
+        :param weight: int, weight of each article
+        :param size: String, "small" or "large"
+        :param lodgement_state: String, the state the mail is lodged in
+        :return: dict
+            the categories of the sort, see PrintPostSort.organiseCategories
+        """
+        fingerprint = SortResult.fingerprint(self.lists, weight, size, lodgement_state)
+        if self.sort_result is not None and self.sort_result.fingerprint == fingerprint:
+            export_list = ExportList.join(self.lists)
+            export_list.name = "Exported List"
+            export_list.reorder(self.sort_result.order)
+            self.export_list = export_list
+        else:
+            self.sort_result, self.export_list = PrintPostSort.sortLists(self.lists, weight, size, lodgement_state)
+            self.changed()
+
+        # The kept categories aren't handed out as they are so nothing using them can change the kept result
+        return copy.deepcopy(self.sort_result.categories)
+
+    def changed(self):
+        """
+            Saves the workspace after its lists have changed if it has been saved before. With an autosaver the save is
+            done on its thread and changes made close together are saved at once.
+        """
+        if self.path == "":
+            return
+
+        if self.autosaver is not None:
+            self.autosaver.request()
+        else:
             self.saveWorkspace()
 
+    def snapshot(self):
+        """
+        :return: Workspace
+            A copy of the workspace that can be saved on another thread while this one keeps changing. Nothing that
+            is being imported is copied.
+        """
+        snapshot = copy.copy(self)
+        snapshot.lists = [mail_list.snapshot() for mail_list in self.lists]
+        snapshot.pending_list = None
+        snapshot.pending_import = None
+        snapshot.pending_read = None
+        snapshot.export_list = None
+        snapshot.labels = None
+        return snapshot
+
+    def converted(self, workspace_type):
+        """
+        :param workspace_type: class of Workspace
+        :return: Workspace
+            A workspace of workspace_type with the lists and sort of this one, e.g. to save them in another format
+        """
+        workspace = workspace_type()
+        workspace.lists = self.lists
+        workspace.export_list = self.export_list
+        workspace.sort_result = self.sort_result
+        workspace.labels = self.labels
+        return workspace
+
     def setPath(self, file_path):
         # Sets the file path and extracts the name from the file_path and sets both the directory path and file name
         self.name = file_path.split("/")[-1].split(".")[0]
@@ -41,6 +337,9 @@ class Workspace(ABC):
 
     def cancelImport(self):
         self.pending_list = None
+        # Anything still being read is thrown away when it finishes
+        self.pending_import = None
+        self.pending_read = None
 
     @abstractmethod
     def saveWorkspace(self):
@@ -1,46 +1,88 @@
+import os
+import tempfile
 from .workspace import Workspace
 from lxml import etree
 import numpy as np
 from .maillist import MailList
+from .maillistparser import MailListParser
+from .columns import ColumnBuilder
 
 
 class XMLWorkspace(Workspace):
     def __init__(self):
         super(XMLWorkspace, self).__init__()
 
-    def saveWorkspace(self):
+    def saveWorkspace(self, chunk_size=10000):
+        """
+        Writes the workspace one row at a time so the file is never built in memory first
+        :param chunk_size: int, the number of rows decoded from the columns at a time
+        """
         if self.path == "":
             raise ValueError("Workspace is trying to be saved with an unset path")
 
-        doctype = "<!DOCTYPE msw>\n"
-
-        root = etree.Element("workspace")
-        name = etree.SubElement(root, "name")
-        name.text = self.name
-
-        for i in range(0, len(self.lists)):
-            curr_list_root = etree.SubElement(root, "list", id=str(i+1))
-            list_name = etree.SubElement(curr_list_root, "name")
-            list_name.text = self.lists[i].name
-            num_records = etree.SubElement(curr_list_root, "records")
-            num_records.text = str(self.lists[i].num_records)
-            header_root = etree.SubElement(curr_list_root, "headers")
-
-            for j in range(0, len(self.lists[i].headers)):
-                column = etree.SubElement(header_root, "column")
-                column.text = self.lists[i].headers[j]
-            for j in range(0, len(self.lists[i].content[0])):
-                row_root = etree.SubElement(curr_list_root, "row", number=str(j))
-                for k in range(0, len(self.lists[i].content)):
-                    value = etree.SubElement(row_root, "value")
-                    value.text = self.lists[i].content[k][j]
+        file_path = self.path + self.name + ".msw"
+        # Written to a temporary file first so a save that fails part way never leaves half a workspace
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)), suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as f:
+                with etree.xmlfile(f, encoding="UTF-8") as xf:
+                    xf.write_declaration()
+                    xf.write_doctype("<!DOCTYPE msw>")
+                    with xf.element("workspace"):
+                        xf.write("\n")
+                        self.writeElement(xf, self.textElement("name", self.name), 1)
+                        for i in range(0, len(self.lists)):
+                            self.writeList(xf, self.lists[i], i + 1, chunk_size)
+            os.replace(temp_path, file_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
 
-        tree = etree.tostring(root, pretty_print=True, xml_declaration=True, encoding='UTF-8', doctype=doctype)
+        return True
 
-        with open(self.path + self.name + ".msw", 'wb') as f:
-            f.write(tree)
+    def writeList(self, xf, mail_list, list_id, chunk_size):
+        """
+        :param xf: lxml.etree.xmlfile writer
+        :param mail_list: MailList
+        :param list_id: int, the number of the list in the workspace
+        :param chunk_size: int
+        """
+        xf.write("  ")
+        with xf.element("list", id=str(list_id)):
+            xf.write("\n")
+            self.writeElement(xf, self.textElement("name", mail_list.name), 2)
+            self.writeElement(xf, self.textElement("records", str(mail_list.num_records)), 2)
+
+            header_root = etree.Element("headers")
+            for header in mail_list.headers:
+                etree.SubElement(header_root, "column").text = header
+            self.writeElement(xf, header_root, 2)
+
+            # Each row is written and let go of before the next is built
+            for j, row in enumerate(mail_list.content.iter_rows(chunk_size)):
+                row_root = etree.Element("row", number=str(j))
+                for cell in row:
+                    etree.SubElement(row_root, "value").text = cell
+                self.writeElement(xf, row_root, 2)
+            xf.write("  ")
+        xf.write("\n")
+
+    @staticmethod
+    def writeElement(xf, element, level):
+        """
+        Writes an element indented the same as the whole tree would be pretty printed
+        """
+        etree.indent(element, level=level)
+        xf.write("  " * level)
+        xf.write(element)
+        xf.write("\n")
 
-        return True
+    @staticmethod
+    def textElement(tag, text):
+        element = etree.Element(tag)
+        element.text = text
+        return element
 
     def createWorkspace(self, file_path):
         self.setPath(file_path)
@@ -55,60 +97,66 @@ class XMLWorkspace(Workspace):
         with open(file_path, 'wb') as f:
             f.write(tree)
 
-    def openWorkspace(self, file_path):
+    def openWorkspace(self, file_path, chunk_size=10000):
         """
-        Opens a XML file and restores the state of the workspace if the saved workspace file is valid
+        Opens a XML file and restores the state of the workspace if the saved workspace file is valid. The file is
+        read as a stream and each row is thrown away once its values are in the columns, so only the columns are ever
+        held in memory.
 
         :param file_path: string
                           The absolute file path of the workspace file
+        :param chunk_size: int, the number of rows held as strings before they are added to the columns
         :return: bool
                  status of the workspace file being successfully read
         """
+        workspace_name = None
+        mail_lists = []
+        # Children of the root element seen so far, the first is the workspace's name
+        num_children = 0
+        mail_list = None
+        depth = 0
 
         try:
-            tree = etree.parse(file_path)
-        except IOError:
+            for event, element in etree.iterparse(file_path, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if depth == 1 and element.tag != "workspace":
+                        return False
+                    if depth == 2 and num_children > 0:
+                        if element.tag != "list":
+                            return False
+                        mail_list = SavedList(chunk_size)
+                    continue
+
+                depth -= 1
+                if depth == 1:
+                    if num_children == 0:
+                        workspace_name = element.text
+                    else:
+                        if self.verifyList(mail_list.skeleton()) != "Valid":
+                            return False
+                        # Number of records doesnt match number of rows saved. Something has gone wrong saving the
+                        # workspace.
+                        if mail_list.row_count != mail_list.num_records:
+                            return False
+                        mail_lists.append(mail_list.build())
+                    num_children += 1
+                elif depth == 2 and mail_list is not None:
+                    if not mail_list.add(element):
+                        return False
+                else:
+                    continue
+
+                # Letting go of the elements that have been read
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+        except (OSError, etree.XMLSyntaxError):
             return False
 
-        root = tree.getroot()
-        if root.tag != "workspace" or len(root) < 1:
+        if num_children < 1:
             return False
 
-        workspace_name = root[0].text
-        mail_lists = []
-
-        # Iterate over children of the root element.
-        for c in range(1, len(root)):
-            # The child tags of a list be name, records, headers before the row data can be shown. 1 row is required.
-
-            if self.verifyList(root[c]) != "Valid":
-                return False
-
-            name = root[c][0].text
-            num_records = int(root[c][1].text)
-
-            # Initialising a numpy array for unknown length strings (dtype=object)
-            headers = np.empty(len(root[c][2]), dtype=object)
-
-            for i in range(0, len(headers)):
-                headers[i] = root[c][2][i].text
-
-            content = np.empty((num_records, headers.size), dtype=object)
-            row_count = 0
-
-            # Iterate over the row data stored in the XML file for the current list
-            for i in range(3, len(root[c])):
-                for j, value in enumerate(root[c][i]):
-                    content[row_count][j] = value.text if value.text is not None else ""
-                row_count += 1
-
-            # Number of records doesnt match number of rows saved. Something has gone wrong saving the workspace.
-            if row_count != num_records:
-                return False
-
-            content = np.transpose(content)
-            mail_lists.append(MailList(headers, content, name))
-
         self.lists = mail_lists
         self.setPath(file_path)
         return True
@@ -138,3 +186,92 @@ class XMLWorkspace(Workspace):
 
     def getName(self):
         return self.name
+
+
+class SavedList:
+    """
+        A list being read from a XML workspace. Rows are put into buffers allocated once the number of records is
+        known and the buffers are added to the columns whenever they fill up.
+    """
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        # Tags of the list's child elements in order, for XMLWorkspace.verifyList
+        self.tags = []
+        self.name = None
+        self.num_records = None
+        self.headers = None
+        self.columns = None
+        self.buffers = None
+        self.filled = 0
+        self.row_count = 0
+
+    def add(self, element):
+        """
+        :param element: lxml.etree.Element, the next child element of the list
+        :return: bool
+            False if the list can't be valid
+        """
+        index = len(self.tags)
+        self.tags.append(element.tag)
+
+        if index == 0:
+            self.name = element.text
+        elif index == 1:
+            try:
+                self.num_records = int(element.text)
+            except (TypeError, ValueError):
+                return False
+        elif index == 2:
+            # Initialising a numpy array for unknown length strings (dtype=object)
+            self.headers = np.array([column.text if column.text is not None else "" for column in element],
+                                    dtype=object)
+            self.columns = [ColumnBuilder() for _ in self.headers]
+            # Blank values are left as they were allocated
+            size = min(self.chunk_size, max(self.num_records or 0, 0))
+            self.buffers = [np.full(size, "", dtype=object) for _ in self.headers]
+        else:
+            if self.num_records is None or self.buffers is None or self.row_count >= self.num_records:
+                return False
+            for j, value in enumerate(element):
+                if j < len(self.buffers) and value.text is not None:
+                    self.buffers[j][self.filled] = value.text
+            self.filled += 1
+            self.row_count += 1
+            if len(self.buffers) > 0 and self.filled == len(self.buffers[0]):
+                self.flush()
+
+        return True
+
+    def flush(self):
+        for column, buffer in zip(self.columns, self.buffers):
+            column.append(buffer[:self.filled])
+            buffer[:] = ""
+        self.filled = 0
+
+    def skeleton(self):
+        """
+        :return: lxml.etree.Element, the list's element with only the tags of its children, for
+            XMLWorkspace.verifyList
+        """
+        list_element = etree.Element("list")
+        for tag in self.tags:
+            etree.SubElement(list_element, tag)
+        return list_element
+
+    def build(self):
+        """
+        :return: MailList
+        """
+        if self.buffers is not None and len(self.buffers) > 0:
+            self.flush()
+        content = [column.build() for column in self.columns]
+
+        # Workspaces saved before sort codes were kept as integer codes stored them as string columns. These are
+        # dropped and the codes are assigned again from the postcode column.
+        keep = ~np.isin(self.headers, ["MS_State", "MS_SortCode"])
+        mail_list = MailList(self.headers[keep], [content[j] for j in np.nonzero(keep)[0]], self.name)
+        mail_list.address_columns = MailListParser.identifyAddressField(mail_list.headers)
+        if mail_list.address_columns[-1] != -1:
+            mail_list.assign_sort_codes()
+        return mail_list
@@ -1,19 +1,23 @@
 import sys
 import os
 import subprocess
+import multiprocessing
 from PySide6.QtWidgets import QApplication, QMainWindow, QFileDialog, QAbstractItemView, \
     QMessageBox, QLabel, QLineEdit, QCheckBox, QTableWidgetItem, QDialog, QFrame, QTableView
-from PySide6.QtCore import QDir, QFileInfo, Qt, QSize, QTimer, QPoint
+from PySide6.QtCore import QDir, QFileInfo, Qt, QSize, QTimer, QPoint, Signal
 from PySide6.QtGui import QDoubleValidator, QPixmap, QIcon, QBrush, QColor, QIntValidator
 
 from labels.labels import Labels
-from maillist.exportlist import ExportList
+from maillist.binaryworkspace import BinaryWorkspace
 from maillist.xmlworkspace import XMLWorkspace
+from maillist.autosave import AutoSaver
+from maillist.importcache import ImportCache
+from maillist.arrowmaillistparser import ArrowMailListParser
+from maillist.compressed import archiveMembers
 from settings.readsettings import Settings
 from ui_form import Ui_MainWindow
 from maillist.maillist import MailList
 from printpost.readprintpost import ReadPrintPost
-from maillist.sort import PrintPostSort
 from article.largearticle import LargeArticle
 from article.smallarticle import SmallArticle
 from manifest.createreport import CreateReport
@@ -23,6 +27,9 @@ import numpy as np
 
 
 class MailSort(QMainWindow):
+    # Messages from the autosave thread, shown in the status bar from the window's thread
+    autosaveStatus = Signal(str)
+
     # TODO: FIX BUG OF COMBO BOX SHOWING A LIST TWICE. I AM NOT SURE HOW TO REPLICATE THIS. IT JUST HAPPENS?
     def __init__(self):
         super(MailSort, self).__init__()
@@ -35,9 +42,15 @@ class MailSort(QMainWindow):
         self.setWindowTitle("Mail Sort")
         self.load_stylesheet()
 
-        self.workspace = XMLWorkspace()
+        # Lists read from files are kept on disk so importing the same file again is quick
+        self.importCache = ImportCache(ImportCache.defaultDirectory())
+        self.autosaver = None
+        self.autosaveStatus.connect(self.statusBar().showMessage)
+        self.setWorkspace(BinaryWorkspace())
 
-        self.fileTypeOptions = ["Tab-delimited (*.txt)", "CSV (*.csv)", "Excel (*.xlsx *.xls)"]
+        self.fileTypeOptions = ["Tab-delimited (*.txt *.txt.gz *.txt.bz2 *.zip)", "CSV (*.csv *.csv.gz *.csv.bz2 *.zip)",
+                                "Excel (*.xlsx *.xls)", "Parquet (*.parquet)", "Arrow IPC (*.arrow *.feather)",
+                                "SQLite (*.sqlite *.db)"]
 
         # Storing list of these UI elements to  make it easy to loop over throughout multiple methods
         self.addressFieldBoxes = [self.ui.countryComboBox, self.ui.stateComboBox, self.ui.postcodeComboBox]
@@ -59,6 +72,26 @@ class MailSort(QMainWindow):
         self.onLaunch()
         self.date = datetime.datetime.today().date()
 
+    def setWorkspace(self, workspace):
+        """
+            Makes workspace the current workspace, with changes to it saved by an autosaver. Anything the previous
+            workspace had waiting to be saved is saved first.
+        """
+        if self.autosaver is not None:
+            self.autosaver.stop()
+
+        self.workspace = workspace
+        self.workspace.import_cache = self.importCache
+        self.autosaver = AutoSaver(workspace, on_status=self.autosaveStatus.emit)
+        self.workspace.autosaver = self.autosaver
+
+    def closeEvent(self, event):
+        # Changes still waiting to be saved are written before the window closes
+        if self.autosaver is not None:
+            self.autosaver.stop()
+            self.autosaver = None
+        super(MailSort, self).closeEvent(event)
+
     def connect_ui(self):
         """
             Associates the functionality within the methods outlined in this file with user interface elements.
@@ -178,12 +211,12 @@ class MailSort(QMainWindow):
             be default not saved. The user can choose to save later, but sometimes a workspace
             isn't needed to be saved.
         """
-        self.workspace = XMLWorkspace()
+        self.setWorkspace(BinaryWorkspace())
         self.onEndLaunch()
 
     def on_launchBtnOpenWorkspace_clicked(self):
         """
-            Opens an existing workspace (.msw extension) and updates the UI with the corresponding workspace
+            Opens an existing workspace (.msb or .msw extension) and updates the UI with the corresponding workspace
             data. If opening the workspace is successful than the user will be directed to the workspace page.
         """
         result = self.on_menuOpenWorkspaceBtn_clicked()
@@ -328,15 +361,36 @@ class MailSort(QMainWindow):
     def on_menuSaveWorkspaceBtn_clicked(self):
         self.load_stylesheet()
         if self.workspace.path != "":
-            self.workspace.saveWorkspace()
+            self.saveWorkspaceNow()
 
-        path = self.openFileSelection("Choose the location to save your workspace", "Mail Sort Workspace (*.msw)")
+        path = self.openFileSelection("Choose the location to save your workspace",
+                                      "Mail Sort Workspace (*.msb);;Mail Sort XML Workspace (*.msw)")
 
         if path == "":
             return
 
+        # The workspace is saved in the format of the extension chosen from then on
+        workspace_type = self.workspaceType(path)
+        if type(self.workspace) is not workspace_type:
+            self.setWorkspace(self.workspace.converted(workspace_type))
+
         self.workspace.setPath(path)
-        self.workspace.saveWorkspace()
+        self.saveWorkspaceNow()
+
+    @staticmethod
+    def workspaceType(file_path):
+        """
+        :return: the Workspace class that reads and saves files like file_path
+        """
+        return XMLWorkspace if file_path.lower().endswith(".msw") else BinaryWorkspace
+
+    def saveWorkspaceNow(self):
+        """
+            Saves the workspace and waits for it to be written. The save goes through the autosaver so it can't be
+            written over by an older snapshot that was already waiting.
+        """
+        self.autosaver.request()
+        self.autosaver.flush()
 
     def on_menuHomeBtn_clicked(self):
         self.changeActiveBtnStyle(self.ui.menuHomeBtn)
@@ -347,7 +401,7 @@ class MailSort(QMainWindow):
         """
            This slot function is utilised for the contentNewWorkspaceBtn and subWorkspaceNewBtn. When
            clicked a file dialog will be opened prompting the user to select a location and a name. A
-           new .msw file will be created upon a successful name and location selected.
+           new .msb file will be created upon a successful name and location selected.
         """
         result = True
         if len(self.workspace.lists) > 0 and self.workspace.path == "":
@@ -356,7 +410,7 @@ class MailSort(QMainWindow):
 
         # TODO: NOT RESETTING TABLE PAGE?
         if result:
-            self.workspace = XMLWorkspace()
+            self.setWorkspace(BinaryWorkspace())
             self.resetTableView()
             self.on_menuHomeBtn_clicked()
 
@@ -364,8 +418,8 @@ class MailSort(QMainWindow):
         """
            This slot function is utilised for both the contentOpenWorkspaceBtn and subWorkspaceOpenBtn
            widgets. When clicked a file dialog will be opened prompting the user to select a file
-           from their system to be opened as the workspace. Currently .msw is a valid file extension
-           to be opened.
+           from their system to be opened as the workspace. Both .msb and XML .msw workspaces can be opened,
+           and each is saved back in the format it was opened from.
            :returns - int
                 An int flag representing the status of opening a workspace
                 0 indicates success
@@ -373,18 +427,22 @@ class MailSort(QMainWindow):
                 2 indicates the user cancelled/closed the file dialog.
         """
 
-        file_path = QFileDialog.getOpenFileName(self, "Open workspace", self.settings.openDir, "Mail sort workspace (*.msw)")[0]
+        file_path = QFileDialog.getOpenFileName(self, "Open workspace", self.settings.openDir, "Mail sort workspace (*.msb *.msw)")[0]
 
         if file_path == '':
             return 2
 
-        result = self.workspace.openWorkspace(file_path)
+        # XML workspaces stay XML unless they are saved as a .msb workspace
+        workspace = self.workspaceType(file_path)()
+        result = workspace.openWorkspace(file_path)
 
         if not result:
             QMessageBox.warning(self, "Unable to open workspace", "There was an error when opening the workspace. "
                                                                   "The file structure may be invalid.")
             return 1
 
+        self.setWorkspace(workspace)
+
         for mail_list in self.workspace.lists:
             self.ui.listSelectComboBox.addItem(mail_list.name)
 
@@ -428,14 +486,14 @@ class MailSort(QMainWindow):
             return
 
         self.changeActiveBtnStyle(self.ui.menuExportBtn)
-        self.ui.exportedListTableWidget.setColumnCount(len(self.workspace.export_list.headers))
+        headers, content = self.workspace.export_list.with_sort_code_columns()
+        self.ui.exportedListTableWidget.setColumnCount(len(headers))
         self.ui.exportedListTableWidget.setRowCount(self.workspace.export_list.num_records)
-        self.ui.exportedListTableWidget.setHorizontalHeaderLabels(self.workspace.export_list.headers)
+        self.ui.exportedListTableWidget.setHorizontalHeaderLabels(headers)
 
-        for i in range(0, len(self.workspace.export_list.content)):
-            for j in range(0, len(self.workspace.export_list.content[i])):
-                self.ui.exportedListTableWidget.setItem(j, i,
-                                                        QTableWidgetItem(self.workspace.export_list.content[i][j]))
+        for i in range(0, len(content)):
+            for j, value in enumerate(content[i].tolist()):
+                self.ui.exportedListTableWidget.setItem(j, i, QTableWidgetItem(value))
         self.ui.contentFrame.setCurrentIndex(self.navigate("export"))
 
     def on_menuLabelsBtn_clicked(self):
@@ -525,11 +583,17 @@ class MailSort(QMainWindow):
         # Sheet number in case it is an excel document
         sheetNumber = self.ui.sheetNumLineEdit.text()
 
-        result = self.workspace.createMailList(file_path, self.fileTypeOptions[filter_selection], include_headers,
-                                               sheetNumber)
+        if len(archiveMembers(file_path)) > 1:
+            # Each file in the archive is imported as its own list rather than through the import page
+            self.importArchive(file_path, include_headers, sheetNumber)
+            return
+
+        # Only the start of the file is read before the page is shown, the rest is read while the user maps fields
+        preview = self.workspace.previewMailList(file_path, self.fileTypeOptions[filter_selection], include_headers,
+                                                 sheetNumber)
 
         # If workspace failed to open the file and convert it into a MailList type then report error.
-        if not result:
+        if preview is None:
             QMessageBox.warning(self, "Error", "Error when reading the file. If "
                                                "selecting excel ensure the sheet number inputted exists.")
             return
@@ -538,11 +602,35 @@ class MailSort(QMainWindow):
         self.showImportElements()
 
         # Display number of records so the user can check if number of records imported matches the file.
-        self.ui.contentLabelRecordsRead.setText("Records read: " + str(self.workspace.pending_list.num_records))
+        if self.workspace.pending_import is None and self.workspace.pending_read is None:
+            self.ui.contentLabelRecordsRead.setText("Records read: " + str(self.workspace.pending_list.num_records))
+        elif preview.estimated_records is not None:
+            self.ui.contentLabelRecordsRead.setText("Records read: about " + str(preview.estimated_records))
+        else:
+            self.ui.contentLabelRecordsRead.setText("Records read: still reading")
 
         # Show the headers and auto fill combobox with any address (i.e country/postcode) fields that were detected
         self.updateImportMailListUI(self.workspace.pending_list.headers)
 
+    def importArchive(self, file_path, include_headers, sheetNumber):
+        """
+            Imports every file in a zip archive as its own list and reports how many could be read
+        """
+        results = self.workspace.importMailLists([file_path], include_headers, sheetNumber)
+
+        for result in results:
+            if result.succeeded:
+                self.ui.listSelectComboBox.addItem(result.mail_list.name)
+
+        failed = [result for result in results if not result.succeeded]
+        message = str(len(results) - len(failed)) + " lists were imported from the archive."
+        if len(failed) > 0:
+            message += " " + str(len(failed)) + " files could not be read: " + \
+                       ", ".join(result.error for result in failed)
+
+        self.workspace.labels = None
+        self.createInformationBox(message)
+
     def on_fileTypeComboBox_activated(self, index):
         if "Excel" in self.fileTypeOptions[index]:
             self.ui.sheetNumLineEdit.show()
@@ -685,19 +773,41 @@ class MailSort(QMainWindow):
            the created workspace file. This function also utilises the resetImportMailListUI
            function to reset the workspace and UI.
         """
+        preview_headers = self.workspace.pending_list.headers
+        kept_headers = [str(preview_headers[i]) for i in range(0, len(self.addFieldBoxes))
+                        if self.addFieldBoxes[i].checkState() == Qt.CheckState.Checked]
+
+        # Waiting for the whole file if it is still being read. Files that can be read a column at a time are only
+        # read now, and only for the columns that are kept.
+        if not self.workspace.attachImport(kept_headers):
+            QMessageBox.warning(self, "Error", "Error when reading the file.")
+            self.resetImportMailListUI()
+            return
+
+        if self.workspace.pending_list.headers.tolist() not in [preview_headers.tolist(), kept_headers]:
+            # Columns that were blank at the start of the file have data further on so the fields need checking again
+            mail_list = self.workspace.pending_list
+            self.resetImportMailListUI()
+            self.workspace.pending_list = mail_list
+
+            self.showImportElements()
+            self.ui.contentLabelRecordsRead.setText("Records read: " + str(mail_list.num_records))
+            self.updateImportMailListUI(mail_list.headers)
+            QMessageBox.information(self, "Check fields", "More columns were found once the whole file was read. "
+                                                          "Check the fields before importing.")
+            return
+
         new_name = self.ui.fileNameEdit.text()
         new_column_names, selected_headers = [], []
 
         for i in range(0, len(self.addFieldBoxes)):
             if self.addFieldBoxes[i].checkState() == Qt.CheckState.Checked:
                 new_column_names.append(self.editFieldNames[i].text())
-                selected_headers.append(self.workspace.pending_list.headers[i])
+                selected_headers.append(preview_headers[i])
 
         if len(selected_headers) == len(self.workspace.pending_list.headers):
-            # If user wants to get all columns then don't waste time reconstructing a new list
-            new_mail_list = self.workspace.pending_list
-            new_mail_list.name = new_name
-            new_mail_list.headers = np.array(new_column_names)
+            # If user wants to get all columns then only the names change
+            new_mail_list = MailList.renamed(self.workspace.pending_list, new_column_names, new_name)
         else:
             new_mail_list = MailList.subset(selected_headers, self.workspace.pending_list, new_name, new_column_names)
 
@@ -714,15 +824,12 @@ class MailSort(QMainWindow):
         for i in range(0, len(self.addressFieldBoxes)):
             address_fields[i] = self.addressFieldBoxes[i].currentIndex()
 
-        # If the user chosen to set a state so they can check for bad postcode/state combinations then rename column
-        if address_fields[1] != -1:
-            new_mail_list.headers[address_fields[1]] = "State"
-
-        # Setting the postcode column name as postcode
-        new_mail_list.headers[address_fields[-1]] = "Postcode"
+        # Renaming the postcode column, and the state column if the user chose one so they can check for bad
+        # postcode/state combinations
+        new_mail_list.address_columns = address_fields
+        new_mail_list.name_address_columns()
 
         self.workspace.pending_list = new_mail_list
-        self.workspace.pending_list.address_columns = address_fields
         # Adding the list as a possible selection in the table view
         self.ui.listSelectComboBox.addItem(self.workspace.pending_list.name)
         # Assign sort codes to the postcode
@@ -733,8 +840,7 @@ class MailSort(QMainWindow):
 
         self.workspace.addMailList()
         # Only save the workspace if the user has chosen create a workspace file on hard disk.
-        if self.workspace.path != "":
-            self.workspace.saveWorkspace()
+        self.workspace.changed()
 
         # Setting export_list to None as a new list needs to be sorted with the rest
         self.workspace.export_list = None
@@ -827,9 +933,11 @@ class MailSort(QMainWindow):
             self.ui.listTableWidget.clear()
 
         mail_list: MailList = self.workspace.lists[index]
+        # Sort codes are shown alongside the list's own columns
+        headers, content = mail_list.with_sort_code_columns()
 
         self.ui.valueLabelRecords.setText(str(mail_list.num_records))
-        self.ui.valueLabelColumns.setText(str(len(mail_list.headers)))
+        self.ui.valueLabelColumns.setText(str(len(headers)))
 
         # The check for incorrect states may not be completed as this is something that is computed not stored
         # so we need to attempt to recompute it again
@@ -858,14 +966,14 @@ class MailSort(QMainWindow):
             self.ui.warningsLabel.setText(warningsText.strip())
 
         self.currentTableList = index
-        self.ui.listTableWidget.setColumnCount(len(mail_list.headers))
+        self.ui.listTableWidget.setColumnCount(len(headers))
         self.ui.listTableWidget.setRowCount(mail_list.num_records)
-        self.ui.listTableWidget.setHorizontalHeaderLabels(mail_list.headers)
+        self.ui.listTableWidget.setHorizontalHeaderLabels(headers)
 
         # Note QTableWidget won't take an int as an argument and will not provide warnings and therefore just render ""
-        for i in range(0, len(mail_list.content)):
-            for j in range(0, len(mail_list.content[i])):
-                table_widget_item = QTableWidgetItem(mail_list.content[i][j])
+        for i in range(0, len(content)):
+            for j, value in enumerate(content[i].tolist()):
+                table_widget_item = QTableWidgetItem(value)
                 if j in warningIndices:
                     table_widget_item.setBackground(QBrush(QColor(Qt.yellow)))
                 self.ui.listTableWidget.setItem(j, i, table_widget_item)
@@ -1108,12 +1216,8 @@ class MailSort(QMainWindow):
             # Extract the first word from the combo box text as only "small" or "large" is needed.
             size = self.ui.sortComboBoxSize.currentText().split(" ")[0]
 
-        # First sort the list by presort indicator and postcode so we can calculate the categories
-        preprocessedList = PrintPostSort.preprocessList(self.workspace.lists)
-
-        categories = PrintPostSort.organiseCategories(preprocessedList, weight, size, "VIC")
-
-        self.workspace.export_list = ExportList.createExportList(preprocessedList, categories)
+        # Sorts the lists into the workspace's export list, or reuses the last sort if nothing has changed since
+        categories = self.workspace.sortLists(weight, size, "VIC")
 
         # Generate labels from the organised categories
         # TODO: Try catch to alert if failed to read
@@ -1157,26 +1261,28 @@ class MailSort(QMainWindow):
         if self.workspace.export_list is None:
             return
 
-        to_write = '\t'.join(self.workspace.export_list.headers) + "\n"
-        for i in range(0, self.workspace.export_list.num_records):
-            for j in range(0, len(self.workspace.export_list.content) - 1):
-                to_write += ("" if self.workspace.export_list.content[j][i] is None else
-                             self.workspace.export_list.content[j][i]) + "\t"
-
-            to_write += ("" if self.workspace.export_list.content[-1][i] is None else
-                         self.workspace.export_list.content[-1][i]) + "\n"
+        headers, content = self.workspace.export_list.with_sort_code_columns()
 
         if not self.settings.enableAutoSave:
             path_to_save = self.openFileSelection("Choose the location to save the export file",
-                                                  "Text Tab Delimited (*.txt)")
+                                                  "Text Tab Delimited (*.txt);;Parquet (*.parquet);;"
+                                                  "Arrow IPC (*.arrow)")
         else:
             path_to_save = self.settings.saveDir + "/" + self.settings.exportListName + ".txt"
 
         if path_to_save == "":
             return
 
+        if path_to_save.lower().endswith(".parquet") or path_to_save.lower().endswith(".arrow"):
+            # Columns are written as they are stored rather than as text
+            ArrowMailListParser.writeList(path_to_save, headers, content)
+            self.createInformationBox("Export file has been saved")
+            return
+
+        # Rows are built a chunk at a time as they are written so the whole file is never held in memory
         with open(path_to_save, "w") as f:
-            f.write(to_write)
+            f.write('\t'.join(headers) + "\n")
+            f.writelines('\t'.join(row) + "\n" for row in content.iter_rows())
 
         self.createInformationBox("Export file has been saved")
 
@@ -1389,6 +1495,8 @@ class MailSort(QMainWindow):
 
 
 if __name__ == "__main__":
+    # Needed by the worker processes that import files when running as a frozen executable
+    multiprocessing.freeze_support()
     app = QApplication([])
     window = MailSort()
     window.show()
@@ -1,20 +1,38 @@
 import datetime
+import hashlib
 import os
+import threading
+import numpy as np
+
 
 class ReadPrintPost:
     instance = None
+    _instance_lock = threading.Lock()
 
     def __init__(self):
         self.plan_to_state = None
         self.postcode_to_plan = None
         self.expiry_date = None
+        # Changes whenever the plan file changes, so results worked out from an older plan can be recognised
+        self.version = None
+
+        # Compiled form of the plan, see compilePlan. These arrays are read only so the one instance can be shared
+        # between threads.
+        self.states = None
+        self.plan_codes = None
+        self.postcode_table = None
+        self.plan_state_table = None
 
     @staticmethod
     def get_instance():
         if ReadPrintPost.instance is None:
-            instance = ReadPrintPost()
-            instance.readCodeList(os.path.dirname(os.path.realpath(__file__)) + "/printpost.txt")
-        return instance
+            with ReadPrintPost._instance_lock:
+                # Another thread may have built the plan while this one was waiting on the lock
+                if ReadPrintPost.instance is None:
+                    instance = ReadPrintPost()
+                    instance.readCodeList(os.path.dirname(os.path.realpath(__file__)) + "/PrintPost.txt")
+                    ReadPrintPost.instance = instance
+        return ReadPrintPost.instance
 
     def readCodeList(self, file_name: str):
         plan_to_state = {}
@@ -57,6 +75,99 @@ class ReadPrintPost:
 
         f.close()
 
+        with open(file_name, "rb") as f:
+            self.version = hashlib.sha256(f.read()).hexdigest()[:16]
+
         self.plan_to_state = plan_to_state
         self.postcode_to_plan = postcode_to_plan
+        self.compilePlan()
+
+    def compilePlan(self):
+        """
+        Builds dense lookup tables from the plan dictionaries so whole columns can be looked up at once.
+        Presort indicators and states are referred to by their index into plan_codes and states. Both are sorted so
+        comparing indices gives the same order as comparing the strings.
+            postcode_table: 10000 entries, postcode 0000-9999 -> presort indicator index (-1 if not in the plan)
+            plan_state_table: presort indicator index -> state index
+        """
+        self.states = np.array(sorted(set(self.plan_to_state.values())))
+        self.plan_codes = np.array(sorted(self.plan_to_state.keys()))
+
+        state_index = {state: i for i, state in enumerate(self.states)}
+        plan_index = {plan: i for i, plan in enumerate(self.plan_codes)}
+
+        self.plan_state_table = np.array([state_index[self.plan_to_state[plan]] for plan in self.plan_codes],
+                                         dtype=np.int8)
+
+        self.postcode_table = np.full(10000, -1, dtype=np.int16)
+        for postcode, plan in self.postcode_to_plan.items():
+            if len(postcode) != 4 or not postcode.isdigit():
+                raise SyntaxError("Syntax incorrect in the file. Postcode " + postcode + " is not 4 digits.")
+            self.postcode_table[int(postcode)] = plan_index[plan]
+
+        for table in [self.states, self.plan_codes, self.plan_state_table, self.postcode_table]:
+            table.setflags(write=False)
+
+    @staticmethod
+    def encode_postcodes(postcodes):
+        """
+        Converts a column of postcode strings into integers without looping in Python.
+        :param postcodes: array-like of strings
+        :return: np.ndarray of int16 where each value is the postcode or -1 if the string is not exactly 4 digits
+        """
+        postcodes = np.asarray(postcodes)
+        if postcodes.dtype.kind != "U":
+            postcodes = postcodes.astype(str)
+
+        codes = np.full(len(postcodes), -1, dtype=np.int16)
+        if len(postcodes) == 0:
+            return codes
+
+        # Reading the code points of the first 4 characters. Shorter strings are padded with 0 which fails the check.
+        digits = postcodes.astype("U4").view(np.uint32).reshape(-1, 4).astype(np.int32) - ord("0")
+        valid = (np.char.str_len(postcodes) == 4) & np.all((digits >= 0) & (digits <= 9), axis=1)
+        codes[valid] = digits[valid] @ np.array([1000, 100, 10, 1], dtype=np.int32)
+        return codes
+
+    def lookup(self, postcodes):
+        """
+        Looks up the presort indicator and state for a whole column of postcodes at once.
+        :param postcodes: array-like of postcode strings
+        :return: (np.ndarray of int16, np.ndarray of int8)
+            Indices into plan_codes and states for each postcode. Both are -1 where the postcode is not in the plan.
+        """
+        return self.lookup_codes(ReadPrintPost.encode_postcodes(postcodes))
+
+    def lookup_codes(self, postcode_codes):
+        """
+        Same as lookup but for postcodes that have already been encoded with encode_postcodes
+        """
+        plans = np.where(postcode_codes >= 0, self.postcode_table[postcode_codes], -1).astype(np.int16)
+        states = np.where(plans >= 0, self.plan_state_table[plans], -1).astype(np.int8)
+        return plans, states
+
+    def encode_plans(self, plans):
+        """
+        Converts a column of presort indicator strings into indices of plan_codes
+        :param plans: array-like of strings
+        :return: np.ndarray of int16, -1 where the string is not a presort indicator in the plan
+        """
+        plans = np.asarray(plans)
+        if plans.dtype.kind != "U":
+            plans = plans.astype(str)
+
+        positions = np.searchsorted(self.plan_codes, plans)
+        found = np.take(self.plan_codes, positions, mode="clip") == plans
+        return np.where(found, positions, -1).astype(np.int16)
+
+    def decode_plans(self, plan_codes):
+        """
+        :return: np.ndarray of presort indicator strings for each index given, "" where the index is -1
+        """
+        return np.where(plan_codes >= 0, self.plan_codes[plan_codes], "")
 
+    def decode_states(self, state_codes):
+        """
+        :return: np.ndarray of state strings for each index given, "" where the index is -1
+        """
+        return np.where(state_codes >= 0, self.states[state_codes], "")
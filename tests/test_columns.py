@@ -0,0 +1,85 @@
+import pytest
+import numpy as np
+
+from maillist.columns import ColumnStore, ChainedColumn, DictionaryColumn, IndexedColumn, TextColumn, encode_column, \
+    concat_columns
+from maillist.maillist import MailList
+
+
+@pytest.mark.parametrize("values, columnType", [
+    (["VIC", "NSW", "VIC", "VIC", "", "NSW"], DictionaryColumn),
+    (["1 Main St", "22 Long Road Apartment 4", "", "Ünit 5/6 Smith Ave"], TextColumn)
+])
+def test_encodeColumn(values, columnType):
+    """
+    Tests that repeated values are dictionary encoded, free text is stored as text and that either way the values read
+    back out are exactly the values that went in.
+    """
+    column = encode_column(values)
+
+    assert isinstance(column, columnType)
+    assert column.tolist() == values
+    assert [column[i] for i in range(0, len(values))] == values
+    assert column[-1] == values[-1]
+
+
+def test_takeAndConcat():
+    """
+    Tests that taking rows and joining columns keep the values in the right order for both types of column
+    """
+    text = TextColumn.from_numpy(np.array(["a", "bb", "", "dddd"]))
+    states = encode_column(["VIC", "VIC", "NSW", "VIC"])
+
+    assert text.take(np.array([3, 0, 2])).tolist() == ["dddd", "a", ""]
+    assert states[np.array([False, True, True, False])].tolist() == ["VIC", "NSW"]
+    assert concat_columns([states, encode_column(["QLD", "QLD"])]).tolist() == ["VIC", "VIC", "NSW", "VIC", "QLD", "QLD"]
+    assert concat_columns([states, text]).tolist() == ["VIC", "VIC", "NSW", "VIC", "a", "bb", "", "dddd"]
+
+
+def test_iterRows():
+    """
+    Tests that rows are built across chunk boundaries
+    """
+    store = ColumnStore.from_values([["a", "b", "c"], ["1", "2", "3"]])
+
+    assert list(store.iter_rows(chunk_size=2)) == [("a", "1"), ("b", "2"), ("c", "3")]
+
+
+def test_lazyTake():
+    """
+    Tests that reordering a store of chained columns only records the indices and still reads back the right values
+    """
+    text = TextColumn.from_numpy(np.array(["a", "bb", "", "dddd"]))
+    states = encode_column(["VIC", "NSW"])
+    store = ColumnStore([ChainedColumn([text, states])])
+
+    reordered = store.take(np.array([5, 0, 3, 4])).take(np.array([0, 2, 3]))
+
+    assert isinstance(reordered[0], IndexedColumn)
+    assert reordered[0].base is store[0]
+    assert reordered.tolist() == [["NSW", "dddd", "VIC"]]
+    assert list(reordered.iter_rows(chunk_size=2)) == [("NSW",), ("dddd",), ("VIC",)]
+
+
+def test_subsetSharesColumns():
+    """
+    Tests that subsets and renamed lists share the parent's columns, keep sort codes that still apply, and that
+    renaming or reordering one list doesn't change the other
+    """
+    mail_list = MailList(["Name", "State", "Postcode"], [["Ann", "Bob"], ["VIC", "NSW"], ["3000", "3000"]], "list")
+    mail_list.address_columns = np.array([-1, 1, 2])
+    mail_list.identify_bad_states()
+
+    subset = MailList.subset(["Postcode", "Name"], mail_list, "subset", ["PC", "Who"])
+    assert subset.content[0] is mail_list.content[2]
+    assert subset.address_columns.tolist() == [-1, -1, 0]
+    assert subset.sort_codes is mail_list.sort_codes
+    assert subset.incorrect_states is None
+
+    renamed = MailList.renamed(mail_list, ["A", "B", "C"])
+    renamed.headers[0] = "Z"
+    renamed.content = renamed.content.take(np.array([1, 0]))
+    assert renamed.name == "list"
+    assert renamed.incorrect_states == mail_list.incorrect_states == [[1, "VIC"]]
+    assert mail_list.headers.tolist() == ["Name", "State", "Postcode"]
+    assert mail_list.content[0].tolist() == ["Ann", "Bob"]
@@ -0,0 +1,240 @@
+import pytest
+
+from maillist.splitmaillistparser import SplitMailListParser
+from maillist.mappedmaillistparser import MappedMailListParser
+from maillist.excelmaillistparser import ExcelMailListParser
+from maillist.columns import MappedColumn
+from maillist.maillist import MailList
+from maillist.maillistparser import MailListParser
+from maillist.listparserfactory import ListParserFactory
+from maillist.dialect import FileDialect
+from maillist.arrowmaillistparser import ArrowMailListParser
+from maillist.databasemaillistparser import ConnectionPool, DatabaseMailListParser
+
+
+def test_readQuotedCsv(tmp_path):
+    """
+    Tests that quoted values containing the delimiter stay in one column, that short rows are padded, and that trailing
+    columns with no data are removed
+    """
+    file_path = tmp_path / "list.csv"
+    file_path.write_text('Name,Address,Postcode,,\n'
+                         'Ann,"1 Main St, Fitzroy",3065,,\n'
+                         '\n'
+                         'Bob,"Unit 2, ""The Block""",2000\n')
+
+    mail_list = SplitMailListParser(",", True, chunk_size=1).readList(str(file_path))
+
+    assert mail_list.headers.tolist() == ["Name", "Address", "Postcode"]
+    assert mail_list.content.tolist() == [["Ann", "Bob"], ["1 Main St, Fitzroy", 'Unit 2, "The Block"'],
+                                          ["3065", "2000"]]
+    assert mail_list.address_columns[-1] == 2
+
+
+def test_readExtraColumns(tmp_path):
+    """
+    Tests that rows with more values than the headers are given new columns that are blank for earlier rows
+    """
+    file_path = tmp_path / "list.txt"
+    file_path.write_text("a\t1\nb\t2\tx\n")
+
+    mail_list = SplitMailListParser("\t", False, chunk_size=1).readList(str(file_path))
+
+    assert mail_list.headers.tolist() == ["Column 1", "Column 2", "Column 3"]
+    assert mail_list.content.tolist() == [["a", "b"], ["1", "2"], ["", "x"]]
+
+
+def test_mappedMatchesSplit(tmp_path):
+    """
+    Tests that the memory mapped reader finds the same values as the csv reader, including across chunk boundaries,
+    blank lines, Windows line endings and blank values at the end of a line
+    """
+    file_path = tmp_path / "list.txt"
+    file_path.write_bytes("Name\tPostcode\tState\r\n\r\nÉmile\t0800\tNT\r\n  \nBob\t2000\t\t\r\nSue\t3000\tVIC \t x\n"
+                          .encode("utf-8"))
+
+    mapped = MappedMailListParser("\t", True, chunk_bytes=8).readList(str(file_path))
+    split = SplitMailListParser("\t", True).readList(str(file_path))
+
+    assert mapped.headers.tolist() == split.headers.tolist()
+    assert mapped.content.tolist() == split.content.tolist()
+    assert mapped.content[1].fixed_width_digits(4).tolist() == [800, 2000, 3000]
+    assert isinstance(mapped.content[0], MappedColumn)
+    assert mapped.content.compact().tolist() == split.content.tolist()
+
+
+def test_readMacLineEndings(tmp_path):
+    """
+    Tests that a file with only \r line endings, e.g. saved as "CSV (Macintosh)", is read through the factory the same
+    way the csv reader reads it, including when a chunk ends on a \r
+    """
+    file_path = tmp_path / "list.csv"
+    file_path.write_bytes(b"Name,Postcode\rAnn,3000\rBob,2000\r")
+
+    mail_list = ListParserFactory.createMailList("CSV (*.csv)", True, "", str(file_path)).readList(str(file_path))
+    assert mail_list.headers.tolist() == ["Name", "Postcode"]
+    assert mail_list.content.tolist() == [["Ann", "Bob"], ["3000", "2000"]]
+
+    mapped = MappedMailListParser(",", True, chunk_bytes=14).readList(str(file_path))
+    assert mapped.content.tolist() == [["Ann", "Bob"], ["3000", "2000"]]
+
+
+def test_listNames(tmp_path):
+    """
+    Tests that lists are named after the file alone whichever parser reads it
+    """
+    (tmp_path / "list.csv").write_bytes(b"Name,Postcode\nAnn,3000\n")
+    (tmp_path / "quoted.csv").write_bytes(b'Name,Postcode\n"Ann, Bob",3000\n')
+    (tmp_path / "mac.csv").write_bytes(b"Name,Postcode\rAnn,3000\r")
+
+    names = [ListParserFactory.createMailList("CSV (*.csv)", True, "", str(tmp_path / name)).readList(
+        str(tmp_path / name)).name for name in ["list.csv", "quoted.csv", "mac.csv"]]
+    assert names == ["list", "quoted", "mac"]
+
+    assert MailListParser.nameFromPath("C:\\Lists\\my.list.csv") == "my.list"
+    assert MailListParser.nameFromPath("/lists/list.csv.gz") == "list"
+
+
+def test_readExcelRows():
+    """
+    Tests that streamed sheet rows are read as text, blank rows are skipped and reading stops after max_rows records
+    """
+    rows = iter([("Name", "Postcode", None), (None, None, None), ("Ann", 3000, None), ("Bob", 2000, True),
+                 ("Sue", 4000, None)])
+
+    mail_list = ExcelMailListParser(True, "", chunk_size=1, max_rows=2).readRows(rows, "sheet")
+
+    assert mail_list.headers.tolist() == ["Name", "Postcode", "Unnamed: 2"]
+    assert mail_list.content.tolist() == [["Ann", "Bob"], ["3000", "2000"], ["", "True"]]
+    assert mail_list.address_columns[-1] == 1
+    # The rest of the sheet was never read
+    assert next(rows) == ("Sue", 4000, None)
+
+
+def test_readExcelRepeatedHeaders(tmp_path):
+    """
+    Tests that repeated headers in a sheet are made unique the same way pandas makes them
+    """
+    import openpyxl
+    import pandas as pd
+
+    workbook = openpyxl.Workbook()
+    for row in [["Name", "Name", "Postcode", "Name.1", "Name"], ["Ann", "Bob", "3000", "Sue", "Kim"]]:
+        workbook.active.append(row)
+    workbook.save(tmp_path / "list.xlsx")
+
+    mail_list = ExcelMailListParser(True, "").readList(str(tmp_path / "list.xlsx"))
+    expected = pd.read_excel(tmp_path / "list.xlsx", dtype=str).columns.tolist()
+    assert mail_list.headers.tolist() == expected == ["Name", "Name.2", "Postcode", "Name.1", "Name.3"]
+    assert mail_list.content.tolist() == [["Ann"], ["Bob"], ["3000"], ["Sue"], ["Kim"]]
+
+
+def test_identifyAddressColumns():
+    """
+    Tests that address columns are found from their values when the headers don't name them, and from loosely matching
+    headers such as "Post Code 1"
+    """
+    content = [["Ann", "Bob", "Sue", "Tom"], ["Victoria", "NSW", "qld", "VIC"], ["3000", "2000", "4000", "9999"],
+               ["Australia", "Australia", "New Zealand", ""]]
+    mail_list = MailList(["Column 1", "Column 2", "Column 3", "Column 4"], content, "list")
+
+    assert MailListParser.identifyAddressColumns(mail_list).tolist() == [3, 1, 2]
+
+    ranked = MailListParser.rankAddressColumns(mail_list)
+    assert ranked[2][0] == (2, 0.75)
+
+    mail_list = MailList(["Name", "Post Code 1"], [["Ann"], [""]], "list")
+    assert MailListParser.identifyAddressColumns(mail_list).tolist() == [-1, -1, 1]
+
+
+@pytest.mark.parametrize("text, encoding, delimiter", [
+    ("Name;Address;Postcode\r\nRené;\"1 Main St; Fitzroy\";3065\r\nZoë;2 High St;2000\r\n", "cp1252", ";"),
+    ("Name\tAddress\tPostcode\nRené\t1 Main St, Fitzroy\t3065\nZoë\t2 High St\t2000\n", "utf-8-sig", "\t"),
+])
+def test_sniffedImport(tmp_path, text, encoding, delimiter):
+    """
+    Tests that the encoding, delimiter and header row are worked out from the file rather than the file type
+    """
+    file_path = tmp_path / "list.txt"
+    file_path.write_bytes(text.encode(encoding))
+
+    dialect = FileDialect.sniff(str(file_path), ",")
+    assert (dialect.encoding, dialect.delimiter, dialect.has_header) == (encoding, delimiter, True)
+
+    mail_list = ListParserFactory.createMailList("txt", None, "", str(file_path)).readList(str(file_path))
+    assert mail_list.headers.tolist() == ["Name", "Address", "Postcode"]
+    assert mail_list.content[0].tolist() == ["René", "Zoë"]
+    assert mail_list.content[1][0].startswith("1 Main St")
+
+
+def test_sniffKeepsChosenDelimiter(tmp_path):
+    """
+    Tests that the delimiter of the chosen file type is kept when it splits every line the same way, even when another
+    delimiter is in every line
+    """
+    file_path = tmp_path / "list.txt"
+    file_path.write_text("Ann Smith\t1 Main St, Richmond\tVIC\t3121\nBob Jones\t2 High St, Carlton\tVIC\t3053\n"
+                         "Sue Brown\t3 Low St, Glebe\tNSW\t2037\n")
+
+    assert FileDialect.sniff(str(file_path), "\t").delimiter == "\t"
+
+    mail_list = ListParserFactory.createMailList("txt", False, "", str(file_path)).readList(str(file_path))
+    assert len(mail_list.content) == 4
+    assert mail_list.content[1].tolist() == ["1 Main St, Richmond", "2 High St, Carlton", "3 Low St, Glebe"]
+
+
+@pytest.mark.parametrize("file_name, file_type", [("list.parquet", "parquet"), ("list.arrow", "arrow")])
+def test_arrowRoundTrip(tmp_path, file_name, file_type):
+    """
+    Tests that columns written to Parquet and Arrow IPC files read back the same, and that only selected columns are read
+    """
+    mail_list = MailList(["Name", "State", "Postcode"], [["Ann", "Bob", ""], ["VIC", "VIC", "NSW"],
+                                                         ["3000", "3001", "2000"]], "list")
+    file_path = str(tmp_path / file_name)
+    ArrowMailListParser.writeList(file_path, mail_list.headers, mail_list.content, chunk_size=2)
+
+    read = ListParserFactory.createMailList(file_type, True, "").readList(file_path)
+    assert read.headers.tolist() == mail_list.headers.tolist()
+    assert read.content.tolist() == mail_list.content.tolist()
+    assert read.address_columns.tolist() == [-1, 1, 2]
+
+    file_format = "parquet" if file_type == "parquet" else "ipc"
+    projected = ArrowMailListParser(file_format, columns=["Postcode"]).readList(file_path)
+    assert projected.headers.tolist() == ["Postcode"]
+    assert projected.content.tolist() == [["3000", "3001", "2000"]]
+
+
+def test_readDatabase(tmp_path):
+    """
+    Tests that a query is fetched in chunks into columns, that nulls and numbers are read as text, that each table is
+    its own list without a query and that lists from the same database share a connection
+    """
+    import sqlite3
+
+    database = str(tmp_path / "subscribers.db")
+    with sqlite3.connect(database) as connection:
+        connection.execute("CREATE TABLE people (name TEXT, address TEXT, postcode INTEGER)")
+        connection.executemany("INSERT INTO people VALUES (?, ?, ?)",
+                               [("Ann", "1 Main St", 3000), ("Bob", None, 2000), ("Sue", "3 Low St", 4000)])
+        connection.execute("CREATE TABLE stores (store TEXT)")
+        connection.execute("INSERT INTO stores VALUES ('Fitzroy')")
+    connection.close()
+
+    parser = DatabaseMailListParser("SELECT * FROM people WHERE postcode > ? ORDER BY name", (2500,), chunk_size=1)
+    mail_list = parser.readList(database)
+
+    assert mail_list.name == "subscribers"
+    assert mail_list.headers.tolist() == ["name", "address", "postcode"]
+    assert mail_list.content.tolist() == [["Ann", "Sue"], ["1 Main St", "3 Low St"], ["3000", "4000"]]
+    assert mail_list.address_columns[-1] == 2
+    assert parser.previewList(database, num_rows=1).estimated_records == 2
+
+    pool = ConnectionPool.get_instance()
+    connection = pool.connection(database, parser.connect)
+    mail_lists = DatabaseMailListParser().readLists(database)
+    assert pool.connection(database, parser.connect) is connection
+
+    assert [mail_list.name for mail_list in mail_lists] == ["subscribers - people", "subscribers - stores"]
+    assert mail_lists[0].content[1].tolist() == ["1 Main St", "", "3 Low St"]
+    assert DatabaseMailListParser().readList(str(tmp_path / "missing.db")).num_records == 0
+    pool.close()
@@ -1,6 +1,8 @@
 import pytest
+import numpy as np
 
 from maillist.sort import PrintPostSort
+from maillist.exportlist import ExportList
 from mockFiles import *
 
 
@@ -67,4 +69,114 @@ def test_organiseLarge(mailList, expectedCategories, weight):
                         expectedPostcode = expectedValues[i][2][j]
                         if not (postcode[0] == expectedPostcode[0] and postcode[1] == expectedPostcode[1]):
                             match = False
-    assert match
\ No newline at end of file
+    assert match
+
+def test_createExportList():
+    """
+    Tests that createExportList orders the list the same way the manifest does. States are in order with overseas
+    articles at the bottom. Within a state, postcode direct postcodes come first, then the rest of each area direct
+    presort indicator and then residue.
+    """
+    headers = ["Name", "Postcode", "MS_State", "MS_SortCode"]
+    content = [["a", "b", "c", "d", "e", "f", "g", "h"],
+               ["3001", "3000", "3550", "NZ", "2000", "3000", "", "3199"],
+               ["VIC", "VIC", "VIC", "", "NSW", "VIC", "", "VIC"],
+               ["022", "022", "033", "", "015", "022", "", "026"]]
+    mailList = MailList(headers, content, "createExportList")
+    mailList.address_columns = np.array([-1, 2, 1])
+
+    categories = {"ACT": [], "NSW": [["Residue", "", 1]],
+                  "VIC": [["Postcode", "022", [["3000", 2]]], ["Area", "022", 1], ["Area", "026", 1],
+                          ["Residue", "", 1]],
+                  "QLD": [], "SA": [], "WA": [], "TAS": [], "NT": [], "Other": [["Residue", "", 2]]}
+
+    exportList = ExportList.createExportList(mailList, categories)
+
+    assert list(exportList.content[0]) == ["e", "b", "f", "a", "h", "c", "g", "d"]
+
+
+def test_join():
+    """
+    Tests that join matches columns ignoring case, leaves blanks where a list doesn't have a column and records which
+    list every record came from.
+    """
+    aList = MailList(["Name", "Postcode"], [["a", "b"], ["3000", "2000"]], "a")
+    bList = MailList(["postcode", "Phone"], [["0800"], ["123"]], "b")
+    cList = MailList(["NAME"], [["c"]], "c")
+
+    joinedList = ExportList.join([aList, bList, cList])
+
+    assert list(joinedList.headers) == ["Name", "Postcode", "Phone"]
+    assert list(joinedList.address_columns) == [-1, -1, 1]
+    assert joinedList.content.tolist() == [["a", "b", "", "c"], ["3000", "2000", "0800", ""], ["", "", "123", ""]]
+    assert list(joinedList.source_ids) == [0, 0, 1, 2]
+
+
+@pytest.mark.parametrize("size, weight", [("large", 125), ("large", 600), ("small", 50)])
+def test_sortLists(size, weight):
+    """
+    Tests that sorting lists in one go, with the categories counted from each list's postcode histogram, gives the
+    same categories and export list as preprocessList, organiseCategories and createExportList
+    """
+    import random
+    from maillist.maillist import MailList
+
+    rand = random.Random(4)
+    postcodes = ["3000", "3001", "3550", "3199", "2000", "6000", "6012", "", "NZ", "0800"]
+
+    def makeList(headers, name, num_records):
+        content = [["%s %d" % (name, i) for i in range(num_records)],
+                   [rand.choice(postcodes) for _ in range(num_records)]]
+        mailList = MailList(headers, content, name)
+        mailList.address_columns = np.array([-1, -1, 1])
+        return mailList
+
+    lists = [makeList(["Name", "Postcode"], "a", 400), makeList(["Name", "postcode"], "b", 300),
+             MailList(["Name"], [["c"]], "c")]
+
+    result, exportList = PrintPostSort.sortLists(lists, weight, size, "VIC")
+
+    preprocessedList = PrintPostSort.preprocessList(lists)
+    categories = PrintPostSort.organiseCategories(preprocessedList, weight, size, "VIC")
+    expectedList = ExportList.createExportList(preprocessedList, categories)
+
+    assert result.categories == categories
+    assert exportList.content.tolist() == expectedList.content.tolist()
+    assert list(exportList.source_ids) == list(expectedList.source_ids)
+
+
+def test_exportColumnOrder():
+    """
+    Tests that the exported columns are in the same order as they have always been: MS_State after the columns of the
+    first list with sort codes, then the columns only later lists have and MS_SortCode last
+    """
+    from maillist.maillist import MailList
+
+    aList = MailList(["Name", "Postcode"], [["a"], ["3000"]], "a")
+    aList.address_columns = np.array([-1, -1, 1])
+    bList = MailList(["Postcode", "Phone"], [["2000"], ["123"]], "b")
+    bList.address_columns = np.array([-1, -1, 0])
+
+    headers, content = ExportList.join([aList, bList]).with_sort_code_columns()
+    assert list(headers) == ["Name", "Postcode", "MS_State", "Phone", "MS_SortCode"]
+    assert content.tolist() == [["a", ""], ["3000", "2000"], ["VIC", "NSW"], ["", "123"], ["022", "015"]]
+
+    # A single list has them at the end
+    headers, _ = ExportList.join([bList]).with_sort_code_columns()
+    assert list(headers) == ["Postcode", "Phone", "MS_State", "MS_SortCode"]
+
+
+def test_joinKeepsAddressColumns():
+    """
+    Tests that a joined list sorts on the lists' postcode column even when it isn't named one join recognises
+    """
+    from maillist.maillist import MailList
+
+    aList = MailList(["Name", "Postal Code", "Notes"], [["a", "b"], ["3000", "2000"], ["x", "y"]], "a")
+    aList.address_columns = np.array([-1, -1, 1])
+
+    joinedList = ExportList.join([aList])
+    assert list(joinedList.address_columns) == [-1, -1, 1]
+
+    sortedList = PrintPostSort.preprocessList([aList])
+    assert sortedList.content.tolist() == [["b", "a"], ["2000", "3000"], ["y", "x"]]
@@ -7,9 +7,9 @@ from main import MailSort
 import main
 import pytest
 from PySide6.QtTest import QTest
-from maillist.xmlworkspace import XMLWorkspace
+from maillist.binaryworkspace import BinaryWorkspace
+from maillist.maillistparser import ListPreview
 from manifest.createreport import CreateReport
-from maillist.sort import PrintPostSort
 from labels.labels import Labels
 messageBoxOpened = False
 
@@ -96,7 +96,7 @@ def test_launchBtnOpenWorkspace(app, monkeypatch, workspace_name, pageIndex, sho
         return [workspace_name]
 
     monkeypatch.setattr(QFileDialog, "getOpenFileName", mock_getOpenFileName)
-    monkeypatch.setattr(XMLWorkspace, "openWorkspace", mock_openWorkspace)
+    monkeypatch.setattr(BinaryWorkspace, "openWorkspace", mock_openWorkspace)
 
     """
     Setting a singleShot to execute a function after a time period. This is because the UI thread
@@ -226,12 +226,16 @@ def test_contentBrowseMailFileBtn_successfulRead(app, monkeypatch):
     def mock_getOpenFileName(*args, **kwargs):
         return ["test"]
 
+    mockMailList = mock_mailListObject()
+
+    def mock_previewMailList(workspace, *args, **kwargs):
+        workspace.pending_list = mockMailList
+        workspace.pending_import = None
+        return ListPreview(mockMailList, mockMailList.num_records)
+
     setupImportPage(app)
     monkeypatch.setattr(QFileDialog, "getOpenFileName", mock_getOpenFileName)
-    monkeypatch.setattr(XMLWorkspace, "createMailList", lambda x, y, z, w: True)
-
-    mockMailList = mock_mailListObject()
-    app.workspace.pending_list = mockMailList
+    monkeypatch.setattr(BinaryWorkspace, "previewMailList", mock_previewMailList)
 
     # Clicking browse
     QTest.mouseClick(app.ui.contentBtnBrowseMailFile, Qt.LeftButton)
@@ -272,7 +276,7 @@ def test_contentBrowseMailFileBtn_failedToRead(app, monkeypatch):
 
     setupImportPage(app)
     monkeypatch.setattr(QFileDialog, "getOpenFileName", mock_getOpenFileName)
-    monkeypatch.setattr(XMLWorkspace, "createMailList", lambda x, y, z, w: False)
+    monkeypatch.setattr(BinaryWorkspace, "previewMailList", lambda *args, **kwargs: None)
 
     global messageBoxOpened
     messageBoxOpened = False
@@ -523,8 +527,11 @@ def test_sortPage(app, monkeypatch, articleWeight, articleSize, deliveryStandard
     # Mocking functionality of these functions that are used to generate manifest as we only focus on ui validation here
     monkeypatch.setattr(CreateReport, "create_pdf", mock_createPdf())
     monkeypatch.setattr(QFileDialog, "getSaveFileName", lambda x, y, z, w: "")
-    monkeypatch.setattr(PrintPostSort, "organiseCategories", lambda x, y, z, w: [])
-    monkeypatch.setattr(PrintPostSort, "preprocessList", lambda x: mockedMailList)
+    def mock_sortLists(*args, **kwargs):
+        app.workspace.export_list = mockedMailList
+        return []
+
+    monkeypatch.setattr(app.workspace, "sortLists", mock_sortLists)
     monkeypatch.setattr(Labels, "__init__", mock_labelsInit)
 
 
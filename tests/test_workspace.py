@@ -0,0 +1,457 @@
+import pytest
+
+from maillist.xmlworkspace import XMLWorkspace
+from maillist.binaryworkspace import BinaryWorkspace
+from maillist.importcache import ImportCache
+from maillist.mappedmaillistparser import MappedMailListParser
+
+
+def test_importMailLists(tmp_path):
+    """
+    Tests that files imported together keep their order, have sort codes assigned and that files that can't be read are
+    reported without stopping the others
+    """
+    first = tmp_path / "first.csv"
+    first.write_text("Name,Postcode\nAnn,3000\nBob,2000\n")
+    second = tmp_path / "second.txt"
+    second.write_text("Name\tState\tPostcode\nSue\tVIC\t3000\n")
+
+    workspace = XMLWorkspace()
+    results = workspace.importMailLists([str(first), str(tmp_path / "missing.csv"), str(second),
+                                         str(tmp_path / "notes.doc")], True, max_workers=2)
+
+    assert [result.succeeded for result in results] == [True, False, True, False]
+    assert results[1].error != "" and results[3].error != ""
+    assert [mail_list.num_records for mail_list in workspace.lists] == [2, 1]
+    assert workspace.lists[0] is results[0].mail_list
+    assert all(mail_list.sort_codes is not None for mail_list in workspace.lists)
+
+
+def test_importNamedAddressColumns(tmp_path):
+    """
+    Tests that lists imported together have their postcode and state columns named the same as the import page names
+    them, so lists whose columns are called something else are still sorted on their postcodes
+    """
+    first = tmp_path / "first.csv"
+    first.write_text("Name,Postal Code\n" + "".join("A" + str(i) + "," + str(3000 + i % 3) + "\n" for i in range(0, 150)))
+    second = tmp_path / "second.csv"
+    second.write_text("Name,State/Territory,Post Code\n" + "".join("B" + str(i) + ",VIC," + str(3000 + i % 3) + "\n"
+                                                                     for i in range(0, 75)))
+
+    workspace = XMLWorkspace()
+    workspace.importMailLists([str(first), str(second)], True, max_workers=1)
+    assert workspace.lists[0].headers.tolist() == ["Name", "Postcode"]
+    assert workspace.lists[1].headers.tolist() == ["Name", "State", "Postcode"]
+
+    categories = workspace.sortLists(125, "large", "VIC")
+    assert categories["VIC"] == [["Postcode", "022", [["3000", 75], ["3001", 75], ["3002", 75]]]]
+    assert categories["Other"] == []
+
+
+def test_previewMailList(tmp_path):
+    """
+    Tests that a preview only has the first rows and that the whole list replaces it once attached
+    """
+    file_path = tmp_path / "list.txt"
+    file_path.write_text("Name\tPostcode\n" + "".join("Person " + str(i) + "\t3000\n" for i in range(0, 50)))
+
+    workspace = XMLWorkspace()
+    preview = workspace.previewMailList(str(file_path), "txt", True, "", num_rows=10)
+
+    assert workspace.pending_list.num_records == 10
+    assert workspace.pending_list.address_columns[-1] == 1
+    assert 40 <= preview.estimated_records <= 60
+
+    assert workspace.attachImport()
+    assert workspace.pending_list.num_records == 50
+    assert workspace.pending_list.content[0][-1] == "Person 49"
+
+    # A file that fails part way through reading is reported as not imported whatever the parser raised
+    import csv
+    from concurrent.futures import Future
+    workspace.pending_import = Future()
+    workspace.pending_import.set_exception(csv.Error("field larger than field limit"))
+    assert not workspace.attachImport()
+
+
+@pytest.mark.parametrize("file_name", ["list.parquet", "list.arrow"])
+def test_previewSelectedColumns(tmp_path, file_name):
+    """
+    Tests that Parquet and Arrow files are only read in full once the columns to keep are known, and then only those
+    columns are read
+    """
+    from maillist.maillist import MailList
+    from maillist.arrowmaillistparser import ArrowMailListParser
+
+    mail_list = MailList(["Name", "Notes", "Postcode"], [["Person " + str(i) for i in range(0, 50)], ["x"] * 50,
+                                                         ["3000"] * 50], "list")
+    file_path = str(tmp_path / file_name)
+    ArrowMailListParser.writeList(file_path, mail_list.headers, mail_list.content)
+
+    workspace = XMLWorkspace()
+    preview = workspace.previewMailList(file_path, file_name.split(".")[-1], True, "", num_rows=10)
+    assert preview.estimated_records == 50
+    assert workspace.pending_import is None and workspace.pending_read is not None
+
+    assert workspace.attachImport(["Name", "Postcode"])
+    assert workspace.pending_list.headers.tolist() == ["Name", "Postcode"]
+    assert workspace.pending_list.num_records == 50
+    assert workspace.pending_list.content[1].tolist() == ["3000"] * 50
+
+
+def test_importCache(tmp_path, monkeypatch):
+    """
+    Tests that importing an unchanged file again loads it from the cache with its sort codes, and that changing the
+    file reads it again
+    """
+    file_path = tmp_path / "list.csv"
+    file_path.write_text("Name,Address,Postcode\nAnn,1 Main St,3000\nBob,2 High St,2000\n")
+
+    workspace = XMLWorkspace()
+    workspace.import_cache = ImportCache(str(tmp_path / "cache"))
+    assert workspace.createMailList(str(file_path), "csv", True, "")
+    first = workspace.pending_list
+
+    # Reading the file again would fail, so the list has to come from the cache
+    monkeypatch.setattr(MappedMailListParser, "readList", lambda *args: pytest.fail("file was read again"))
+    assert workspace.createMailList(str(file_path), "csv", True, "")
+    cached = workspace.pending_list
+
+    assert cached is not first
+    assert cached.headers.tolist() == first.headers.tolist()
+    assert cached.content.tolist() == first.content.tolist()
+    assert cached.sort_codes.tolist() == first.sort_codes.tolist()
+    assert cached.address_columns.tolist() == [-1, -1, 2]
+    # The columns are mapped from the file again rather than stored as values
+    from maillist.columns import MappedColumn
+    assert all(isinstance(column, MappedColumn) for column in cached.content)
+
+    # An unchanged file isn't hashed again, its hash is kept with its size and modified time
+    memo_path = next((tmp_path / "cache").glob("*.stat"))
+    memo = memo_path.read_text()
+    memo_path.write_text(memo[:-64] + "kept")
+    assert workspace.import_cache.contentHash(str(file_path)) == "kept"
+    memo_path.write_text(memo)
+
+    # The same contents in a file with another name are loaded under that name
+    copied = tmp_path / "copied.csv"
+    copied.write_bytes(file_path.read_bytes())
+    assert workspace.createMailList(str(copied), "csv", True, "")
+    assert workspace.pending_list.name == "copied"
+    assert workspace.pending_list.content.tolist() == first.content.tolist()
+
+    monkeypatch.undo()
+    file_path.write_text("Name,Address,Postcode\nSue,3 Low St,4000\n")
+    assert workspace.createMailList(str(file_path), "csv", True, "")
+    assert workspace.pending_list.content[0].tolist() == ["Sue"]
+
+
+def test_importCacheLimit(tmp_path):
+    """
+    Tests that the cache removes the entries used longest ago once it is bigger than its limit
+    """
+    import os
+    from maillist.maillist import MailList
+
+    cache = ImportCache(str(tmp_path / "cache"), max_bytes=1 << 20)
+    lists = [MailList(["Name"], [["Person " + str(i) + str(j) for i in range(0, 20000)]], str(j)) for j in range(0, 3)]
+    for j, mail_list in enumerate(lists):
+        cache.store("key" + str(j), mail_list, str(tmp_path / (str(j) + ".csv")))
+        # Entries are ordered by when they were last used, which has to differ between them
+        os.utime(cache.path("key" + str(j)), ns=(j * 10 ** 9, j * 10 ** 9))
+
+    cache.evict()
+    assert sum(entry.stat().st_size for entry in os.scandir(cache.directory)) <= 1 << 20
+    assert cache.load("key0", "") is None
+    assert cache.load("key2", "").content.tolist() == lists[2].content.tolist()
+
+
+def test_importCompressed(tmp_path):
+    """
+    Tests that gzip files are read as the file inside and that each file in a zip archive becomes its own list
+    """
+    import gzip
+    import zipfile
+
+    gzipped = tmp_path / "clients.csv.gz"
+    with gzip.open(gzipped, "wt") as file:
+        file.write("Name,Postcode\nAnn,3000\nBob,2000\n")
+
+    archive = tmp_path / "lists.zip"
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as file:
+        file.writestr("north.csv", "Name,Postcode\nSue,4000\n")
+        file.writestr("south/south.txt", "Name\tState\tPostcode\nTom\tVIC\t3000\nAmy\tTAS\t7000\n")
+        file.writestr("__MACOSX/._north.csv", "")
+
+    workspace = XMLWorkspace()
+    results = workspace.importMailLists([str(gzipped), str(archive)], True, max_workers=1)
+
+    assert all(result.succeeded for result in results)
+    assert [mail_list.name for mail_list in workspace.lists] == ["clients", "north", "south"]
+    assert [mail_list.num_records for mail_list in workspace.lists] == [2, 1, 2]
+    assert workspace.lists[2].content[2].tolist() == ["3000", "7000"]
+    assert all(mail_list.sort_codes is not None for mail_list in workspace.lists)
+
+    # Files in an archive have their address columns named the same as the import page names them
+    archive = tmp_path / "named.zip"
+    with zipfile.ZipFile(archive, "w") as file:
+        file.writestr("east.csv", "Name,Post Code\n" + "A,3000\n" * 40)
+        file.writestr("west.csv", "Name,State/Territory,Postal Code\n" + "B,VIC,3000\n" * 40)
+
+    workspace = XMLWorkspace()
+    workspace.importMailLists([str(archive)], True, max_workers=1)
+    assert [mail_list.headers.tolist() for mail_list in workspace.lists] == [["Name", "Postcode"],
+                                                                            ["Name", "State", "Postcode"]]
+    assert workspace.sortLists(125, "large", "VIC")["VIC"] == [["Postcode", "022", [["3000", 80]]]]
+
+
+def test_importWorkbook(tmp_path):
+    """
+    Tests that an Excel workbook, which is a zip of several files, is imported as one Excel list and not as an archive
+    """
+    import openpyxl
+    from maillist.compressed import archiveMembers, innerFileType
+
+    workbook = openpyxl.Workbook()
+    for row in [["Name", "Postcode"], ["Ann", "3000"], ["Bob", "2000"]]:
+        workbook.active.append(row)
+    workbook.save(tmp_path / "clients.xlsx")
+
+    assert archiveMembers(str(tmp_path / "clients.xlsx")) == []
+    assert innerFileType(str(tmp_path / "clients.xlsx")) == "xlsx"
+
+    workspace = XMLWorkspace()
+    results = workspace.importMailLists([str(tmp_path / "clients.xlsx")], True, max_workers=1)
+    assert all(result.succeeded for result in results)
+    assert [mail_list.name for mail_list in workspace.lists] == ["clients"]
+    assert workspace.lists[0].content.tolist() == [["Ann", "Bob"], ["3000", "2000"]]
+
+
+def test_importDatabaseConnections(tmp_path):
+    """
+    Tests that the connections opened to preview and import a database are closed once they are done with, including
+    the one opened by the thread reading the whole list in the background
+    """
+    import sqlite3
+    from maillist.databasemaillistparser import ConnectionPool
+
+    database = str(tmp_path / "subscribers.db")
+    with sqlite3.connect(database) as connection:
+        connection.execute("CREATE TABLE people (name TEXT, postcode TEXT)")
+        connection.executemany("INSERT INTO people VALUES (?, ?)", [("Person " + str(i), "3000") for i in range(0, 50)])
+    connection.close()
+
+    pool = ConnectionPool.get_instance()
+    workspace = XMLWorkspace()
+    assert workspace.previewMailList(database, "sqlite", True, "", num_rows=10) is not None
+    assert workspace.pending_import is not None
+    assert workspace.attachImport()
+    assert workspace.pending_list.num_records == 50
+    assert pool.connections == {}
+
+    assert workspace.createMailList(database, "sqlite", True, "")
+    assert all(result.succeeded for result in workspace.importMailLists([database], True, max_workers=1))
+    assert pool.connections == {}
+
+
+def test_binaryWorkspace(tmp_path):
+    """
+    Tests that a binary workspace opens without reading any columns, reads back what was saved, opens old XML
+    workspaces and finds damaged columns
+    """
+    file_path = tmp_path / "list.csv"
+    file_path.write_text("Name,Address,Postcode\n" + "".join("Person " + str(i) + "," + str(i) + " Main St,3000\n"
+                                                             for i in range(0, 200)))
+
+    old = XMLWorkspace()
+    old.importMailLists([str(file_path)], True, max_workers=1)
+    old.setPath(str(tmp_path / "work.msw"))
+    old.saveWorkspace()
+
+    workspace = BinaryWorkspace()
+    assert workspace.openWorkspace(str(tmp_path / "work.msw"))
+    workspace.saveWorkspace()
+
+    opened = BinaryWorkspace()
+    assert opened.openWorkspace(str(tmp_path / "work.msb"))
+    mail_list = opened.lists[0]
+    assert mail_list.num_records == 200
+    assert mail_list.address_columns.tolist() == [-1, -1, 2]
+    assert all(column.column is None for column in mail_list.content)
+
+    assert mail_list.content.tolist() == old.lists[0].content.tolist()
+    assert mail_list.headers.tolist() == ["Name", "Address", "Postcode"]
+
+    # Damaging the last byte of the first column's block
+    block = BinaryWorkspace.readManifest(str(tmp_path / "work.msb"))[1]["lists"][0]["columns"][0]["data"]
+    with open(tmp_path / "work.msb", "r+b") as file:
+        file.seek(block["offset"] + block["length"] - 1)
+        last = file.read(1)
+        file.seek(-1, 1)
+        file.write(bytes([last[0] ^ 0xFF]))
+
+    damaged = BinaryWorkspace()
+    assert damaged.openWorkspace(str(tmp_path / "work.msb"))
+    with pytest.raises(ValueError):
+        damaged.lists[0].content[0].tolist()
+
+
+def test_incrementalSave(tmp_path):
+    """
+    Tests that saves with nothing changed don't write, that adding a list only appends its columns, that a save cut
+    short opens as the save before, and that the file is rewritten once most of it isn't used
+    """
+    from maillist.maillist import MailList
+    from maillist.binaryworkspace import HEADER
+
+    big = MailList(["Name", "Postcode"], [["Person " + str(i) for i in range(0, 5000)], ["3000"] * 5000], "big")
+    workspace = BinaryWorkspace(compress=False)
+    workspace.lists = [big]
+    workspace.setPath(str(tmp_path / "work.msb"))
+    workspace.saveWorkspace()
+
+    opened = BinaryWorkspace(compress=False)
+    assert opened.openWorkspace(str(tmp_path / "work.msb"))
+    size = (tmp_path / "work.msb").stat().st_size
+    opened.saveWorkspace()
+    assert (tmp_path / "work.msb").stat().st_size == size
+
+    opened.lists.append(MailList(["Name"], [["Sue"]], "small"))
+    opened.saveWorkspace()
+    assert 0 < (tmp_path / "work.msb").stat().st_size - size < 1000
+    # The columns that were already saved weren't read to save the new list
+    assert all(column.column is None for column in opened.lists[0].content)
+
+    # A save that stopped while writing its header opens as the save before it
+    sequence, _ = BinaryWorkspace.readManifest(str(tmp_path / "work.msb"))
+    with open(tmp_path / "work.msb", "r+b") as file:
+        file.seek((sequence % 2) * HEADER.size + HEADER.size - 4)
+        file.write(b"\0\0\0\0")
+    reopened = BinaryWorkspace()
+    assert reopened.openWorkspace(str(tmp_path / "work.msb"))
+    assert [mail_list.name for mail_list in reopened.lists] == ["big"]
+
+    opened.COMPACT_MIN_BYTES = 0
+    opened.saveWorkspace()
+    opened.removeMailList(0)
+    assert (tmp_path / "work.msb").stat().st_size < 1000
+    assert opened.openWorkspace(str(tmp_path / "work.msb"))
+    assert opened.lists[0].content.tolist() == [["Sue"]]
+
+
+def test_xmlWorkspace(tmp_path):
+    """
+    Tests that XML workspaces read back the same when rows are streamed in chunks, that old sort code columns are
+    dropped, that a list with fewer rows than its record count isn't opened, and that a binary workspace can be saved
+    as XML
+    """
+    from maillist.maillist import MailList
+
+    workspace = XMLWorkspace()
+    workspace.lists = [MailList(["Name", "State", "Postcode", "MS_SortCode"],
+                                [["Ann", "", "Sue"], ["VIC", "NSW", "TAS"], ["3000", "2000", "7000"], ["1", "2", "3"]],
+                                "first"), MailList(["Name"], [["Bob & Co"]], "second")]
+    workspace.setPath(str(tmp_path / "work.msw"))
+    workspace.saveWorkspace(chunk_size=2)
+
+    opened = XMLWorkspace()
+    assert opened.openWorkspace(str(tmp_path / "work.msw"), chunk_size=2)
+    assert [mail_list.name for mail_list in opened.lists] == ["first", "second"]
+    assert opened.lists[0].headers.tolist() == ["Name", "State", "Postcode"]
+    assert opened.lists[0].content.tolist() == [["Ann", "", "Sue"], ["VIC", "NSW", "TAS"], ["3000", "2000", "7000"]]
+    assert opened.lists[0].sort_codes is not None
+    assert opened.lists[1].content.tolist() == [["Bob & Co"]]
+
+    text = (tmp_path / "work.msw").read_text()
+    (tmp_path / "short.msw").write_text(text.replace("<records>3</records>", "<records>4</records>"))
+    assert not XMLWorkspace().openWorkspace(str(tmp_path / "short.msw"))
+
+    binary = BinaryWorkspace()
+    assert binary.openWorkspace(str(tmp_path / "work.msw"))
+    converted = binary.converted(XMLWorkspace)
+    converted.setPath(str(tmp_path / "converted.msw"))
+    converted.saveWorkspace()
+    reopened = XMLWorkspace()
+    assert reopened.openWorkspace(str(tmp_path / "converted.msw"))
+    assert [mail_list.content.tolist() for mail_list in reopened.lists] == \
+           [mail_list.content.tolist() for mail_list in opened.lists]
+
+
+def test_autosave(tmp_path, monkeypatch):
+    """
+    Tests that changes close together are saved at once, that a save has the lists as they were when it was asked for
+    and that the status is reported
+    """
+    from maillist.maillist import MailList
+    from maillist.autosave import AutoSaver
+
+    saves = []
+    save = BinaryWorkspace.saveWorkspace
+    monkeypatch.setattr(BinaryWorkspace, "saveWorkspace", lambda self: saves.append(len(self.lists)) or save(self))
+
+    workspace = BinaryWorkspace()
+    workspace.setPath(str(tmp_path / "work.msb"))
+    messages = []
+    workspace.autosaver = AutoSaver(workspace, delay=0.2, on_status=messages.append)
+
+    for i in range(0, 3):
+        workspace.lists.append(MailList(["Name"], [["Person " + str(i)]], "list " + str(i)))
+        workspace.changed()
+    # Changed after the save was asked for, so it isn't saved until it is asked for again
+    workspace.lists[0].headers[0] = "Changed"
+    workspace.lists[0].content = workspace.lists[0].content.take([0, 0])
+
+    assert workspace.autosaver.flush(timeout=5)
+    workspace.autosaver.stop()
+
+    assert saves == [3]
+    assert messages[0] == "Saving workspace..." and messages[-1].startswith("Workspace saved in")
+    opened = BinaryWorkspace()
+    assert opened.openWorkspace(str(tmp_path / "work.msb"))
+    assert opened.lists[0].headers.tolist() == ["Name"]
+    assert opened.lists[0].num_records == 1
+
+
+def test_derivedData(tmp_path, monkeypatch):
+    """
+    Tests that sort codes, bad states and the last sort are saved with a workspace and used when it's opened again
+    without reading the lists' columns or sorting again, and that they are worked out again with another sort plan
+    """
+    from maillist.sort import PrintPostSort
+    from printpost.readprintpost import ReadPrintPost
+
+    file_path = tmp_path / "list.csv"
+    file_path.write_text("Name,State,Postcode\n" + "".join("Person " + str(i) + "," + ("NSW" if i % 7 == 0 else "VIC")
+                                                           + "," + str(3000 + i % 3) + "\n" for i in range(0, 200)))
+
+    workspace = BinaryWorkspace()
+    workspace.setPath(str(tmp_path / "work.msb"))
+    workspace.importMailLists([str(file_path)], True, max_workers=1)
+    categories = workspace.sortLists(125, "large", "VIC")
+    expected = workspace.export_list.content.tolist()
+
+    opened = BinaryWorkspace()
+    assert opened.openWorkspace(str(tmp_path / "work.msb"))
+    mail_list = opened.lists[0]
+    assert mail_list.incorrect_states == workspace.lists[0].incorrect_states
+    assert len(mail_list.incorrect_states) == 29
+    assert list(mail_list.sort_codes) == list(workspace.lists[0].sort_codes)
+    assert mail_list.fingerprint() == workspace.lists[0].fingerprint()
+    assert all(column.column is None for column in mail_list.content)
+
+    def sortAgain(*args):
+        raise AssertionError("The lists were sorted again")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(PrintPostSort, "sortLists", sortAgain)
+        assert opened.sortLists(125, "large", "VIC") == categories
+    assert opened.export_list.content.tolist() == expected
+    # Sorting another way isn't the same sort
+    assert opened.sortLists(50, "small", "VIC") == {"ACT": [], "NSW": [], "VIC": [["Residue", "", 200]], "QLD": [], "SA": [],
+                                                    "WA": [], "TAS": [], "NT": [], "Other": []}
+
+    monkeypatch.setattr(ReadPrintPost.get_instance(), "version", "another plan")
+    other = BinaryWorkspace()
+    assert other.openWorkspace(str(tmp_path / "work.msb"))
+    assert other.lists[0].sort_codes is None and other.lists[0].incorrect_states is None
+    assert other.sortLists(125, "large", "VIC") == categories